@@ -1,3 +1,4 @@
+import numpy as np
 from matplotlib import path
 from ..Utils.utils import Point
 from .people_graph import PeopleGraph
@@ -9,6 +10,7 @@ class Camera:
             self.p_graph = PeopleGraph()
         self.id = id
         self.p_graph.edge_threshold = config_data.get("group_distance_threshold", -1)
+        self.p_graph.count_groups = config_data.get("count_groups", False)
         self.screen_w = screen_w
         self.screen_h = screen_h
         self.enabled = config_data.get("enabled", False)
@@ -76,7 +78,7 @@ class Camera:
         return x,y
 
     def update_config(self, screen_w, screen_h, config_data, reset_graph=False):
-        Camera.__init__(self, self.id, screen_w, screen_h, config_data, init_graph=reset_graph)
+        Camera.__init__(self, self.app_logger, self.id, screen_w, screen_h, config_data, init_graph=reset_graph)
 
     def build_path(self):
         vertices = [[v.x, v.y] for v in self.path_vertices]
@@ -101,6 +103,16 @@ class Camera:
                 self.p_graph.add_node(x=chest_p.x, y=chest_p.y)
                 return
 
+    def add_tracks(self, centers):
+        if not self.enabled:
+            return
+        self.p_graph.add_nodes(centers)
+
+    def contains_points(self, points):
+        if not self.enabled:
+            return np.zeros(len(points), dtype=bool)
+        return self.path.contains_points(points)
+
     def is_in_camera(self, x=-1, y=-1):
         return self.path.contains_point([x, y])
         # return self.start_x <= x <= self.end_x and self.start_y <= y <= self.end_y
@@ -1,4 +1,6 @@
+import numpy as np
 from .Camera import Camera
+from .zone_map import ZoneLabelMap, MULTI_ZONE
 from ..SwarmComponentMeta import SwarmComponentMeta
 
 class CamerasManager(SwarmComponentMeta):
@@ -8,6 +10,9 @@ class CamerasManager(SwarmComponentMeta):
         self.screen_h = screen_h
         super(CamerasManager, self).__init__(ui_drawer, tasks_manager, "CamerasManager", r'CamerasConfig.yaml', self.update_config_data)
         self.cameras = []
+        # Bumped every time the camera zones are reloaded
+        self.zones_version = 0
+        self.zone_map = ZoneLabelMap(screen_w, screen_h)
     
     def update_config(self):
       super().update_config_from_file(self.app_logger, self.tag, self.config_filename, self.last_modified_time)
@@ -21,6 +26,38 @@ class CamerasManager(SwarmComponentMeta):
             else:
                 self.cameras[i].update_config(self.screen_w, self.screen_h, cameras_data[i])
         self.last_modified_time = last_modified_time
+        self.zones_version += 1
+        self.zone_map.build(self.cameras, cameras_data, self.app_logger)
+        source = "cache" if self.zone_map.from_cache else "config"
+        self.app_logger.info(f"Zone map loaded from {source}, {self.zone_map.overlapping} pixels shared between zones")
+
+    def get_zone_ids(self, points):
+        # Camera index of each point from the label map, -1 outside of every camera and -2 where cameras overlap
+        return self.zone_map.lookup(points)
+
+    def assign_zones(self, points):
+        # (N, cameras) membership matrix, one contains_points call per camera instead of one per track
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        membership = np.zeros((len(points), len(self.cameras)), dtype=bool)
+        if len(points) <= 0:
+            return membership
+        if self.zone_map.labels is None:
+            shared = np.arange(len(points))
+        else:
+            zones = self.zone_map.lookup(points)
+            membership = zones[:, None] == np.arange(len(self.cameras))[None, :]
+            shared = np.flatnonzero(zones == MULTI_ZONE)
+        if len(shared) > 0:
+            for i, camera in enumerate(self.cameras):
+                membership[shared, i] = camera.contains_points(points[shared])
+        return membership
+
+    def add_tracks(self, centers):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        membership = self.assign_zones(centers)
+        for i, camera in enumerate(self.cameras):
+            camera.add_tracks(centers[membership[:, i]])
+        return membership
 
     def get_cameras_data(self):
         data = {}
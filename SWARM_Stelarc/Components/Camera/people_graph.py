@@ -1,103 +1,165 @@
-import networkx as nx
+import numpy as np
 import math
 from ..Utils.utils import Point
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Above this many people a KD-tree radius query is cheaper than the full distance matrix
+KDTREE_MIN_NODES = 200
+
+
+def connected_components(n_nodes, edges_from, edges_to):
+    # Batched union-find: roots are hooked to the smallest index they are linked to, then paths are compressed
+    parent = np.arange(n_nodes)
+    if len(edges_from) <= 0:
+        return parent
+    while True:
+        p_from, p_to = parent[edges_from], parent[edges_to]
+        if np.array_equal(p_from, p_to):
+            return parent
+        np.minimum.at(parent, np.maximum(p_from, p_to), np.minimum(p_from, p_to))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
 
 class PeopleGraph:
-    def __init__(self, edge_threshold=-1):
-        self.nx_graph = nx.Graph()
+    def __init__(self, edge_threshold=-1, capacity=32, count_groups=False):
         self.edge_threshold = edge_threshold
+        # The networkx graph never got to count groups and always reported 0, the behaviour thresholds are tuned on that
+        self.count_groups = count_groups
+        self.positions = np.zeros((capacity, 2), dtype=np.float64)
+        self.init_graph()
+
+    def init_graph(self):
+        # Keeps the node buffer, only the counters are reset between frames
         self.edges_calculated = False
         self.n_people = 0
         self.n_edges = 0
         self.n_groups = 0
         self.groups = []
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.edges_from = np.zeros(0, dtype=np.int64)
+        self.edges_to = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.float64)
         self.avg_people_distance = 0
         self.avg_machine_distance = 0
         self.max_weight = 0
         self.min_weight = 9999
 
-    def init_graph(self):
-        PeopleGraph.__init__(self, self.edge_threshold)
+    @property
+    def nodes(self):
+        return self.positions[:self.n_people]
 
     def add_node(self, x, y, z=None):
-        node = Point(x,y,z)
-        self.nx_graph.add_node(node, pos=node.pos)
-        return node.pos
-
-    def add_edge(self, from_node, to_node, dist_threshold=-1):
-        dist = from_node.distance_from(to_node)
-        if dist_threshold > 0:
-            if dist <= dist_threshold:
-                if dist >= self.max_weight:
-                    self.max_weight = dist
-                if dist <= self.min_weight:
-                    self.min_weight = dist
-                self.nx_graph.add_edge(from_node, to_node, weight=dist)
-            else:
-                return dist
-        else:
-            self.nx_graph.add_edge(from_node, to_node, weight=dist)
-        return dist
-    
+        if self.n_people >= len(self.positions):
+            positions = np.zeros((2 * len(self.positions), 2), dtype=np.float64)
+            positions[:self.n_people] = self.positions[:self.n_people]
+            self.positions = positions
+        self.positions[self.n_people] = (x, y)
+        self.n_people += 1
+        return self.positions[self.n_people - 1].copy()
+
+    def add_nodes(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        n = self.n_people + len(positions)
+        if n > len(self.positions):
+            grown = np.zeros((max(n, 2 * len(self.positions)), 2), dtype=np.float64)
+            grown[:self.n_people] = self.positions[:self.n_people]
+            self.positions = grown
+        self.positions[self.n_people:n] = positions
+        self.n_people = n
+
+    def set_nodes(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        if len(positions) > len(self.positions):
+            self.positions = np.zeros((max(len(positions), 2 * len(self.positions)), 2), dtype=np.float64)
+        self.positions[:len(positions)] = positions
+        self.n_people = len(positions)
+
     def update_graph(self, machine_pos=None):
         try:
             self.calculate_edges()
             self.update_avg_distance()
             self.update_avg_machine_distance(machine_pos=machine_pos)
-            self.n_people = self.nx_graph.number_of_nodes()
-            self.n_edges = self.nx_graph.number_of_edges()
+            self.n_edges = len(self.weights)
             if self.edge_threshold > 0:
-                    self.groups = []
-                    self.n_groups = 0
-                    for c in connected_components(self.nx_graph):
-                        subgraph = self.nx_graph.subgraph(c)
-                        self.groups.append(subgraph)
-                        self.n_groups = 1 if subgraph.number_of_nodes() > 1 else 0 # n gives the number of sub graphs
+                self.labels = connected_components(self.n_people, self.edges_from, self.edges_to)
+                roots, counts = np.unique(self.labels, return_counts=True)
+                self.groups = [np.flatnonzero(self.labels == r) for r in roots]
+                # Single people are not a group
+                self.n_groups = int(np.count_nonzero(counts > 1)) if self.count_groups else 0
         except Exception as e:
             pass
             # print(f"Error ugrading graph {e}")
 
     def calculate_edges(self):
-        for i in self.nx_graph.nodes():
-            for j in self.nx_graph.nodes():
-                if i != j:
-                    if not self.nx_graph.has_edge(i, j):            
-                        self.add_edge(i, j, self.edge_threshold)
+        nodes = self.nodes
+        n = len(nodes)
+        if n < 2:
+            edges_from = edges_to = np.zeros(0, dtype=np.int64)
+            weights = np.zeros(0, dtype=np.float64)
+        elif self.edge_threshold > 0 and cKDTree is not None and n >= KDTREE_MIN_NODES:
+            pairs = cKDTree(nodes).query_pairs(self.edge_threshold, output_type='ndarray')
+            pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+            edges_from, edges_to = pairs[:, 0].astype(np.int64), pairs[:, 1].astype(np.int64)
+            weights = np.sqrt(np.sum((nodes[edges_from] - nodes[edges_to]) ** 2, axis=1))
+        else:
+            edges_from, edges_to = np.triu_indices(n, 1)
+            weights = np.sqrt(np.sum((nodes[edges_from] - nodes[edges_to]) ** 2, axis=1))
+            if self.edge_threshold > 0:
+                keep = weights <= self.edge_threshold
+                edges_from, edges_to, weights = edges_from[keep], edges_to[keep], weights[keep]
+        self.edges_from, self.edges_to, self.weights = edges_from, edges_to, weights
+        if len(weights) > 0:
+            self.max_weight = max(self.max_weight, weights.max())
+            self.min_weight = min(self.min_weight, weights.min())
         self.edges_calculated = True
 
     def update_avg_distance(self):
-        n_edges = self.nx_graph.number_of_edges()
-        if self.edges_calculated and n_edges > 0:
-            total_distance = 0
-            for i, j, w in self.nx_graph.edges(data=True):
-                total_distance += w['weight']
-                self.avg_people_distance = total_distance/n_edges
+        if self.edges_calculated and len(self.weights) > 0:
+            self.avg_people_distance = float(self.weights.mean())
             return self.avg_people_distance
         return 0
 
     def update_avg_machine_distance(self, machine_pos=None):
         m_pos = machine_pos
-        n_nodes = self.nx_graph.number_of_nodes()
+        n_nodes = self.n_people
         if self.edges_calculated and n_nodes > 0:
-            total_distance_from_machine = 0
-            for node, node_data in self.nx_graph.nodes(data=True):
-                total_distance_from_machine += node.distance_from(m_pos)
+            total_distance_from_machine = np.sqrt(np.sum((self.nodes - m_pos.pos) ** 2, axis=1)).sum()
             if n_nodes > 1:
                 n_nodes -= 1
-            self.avg_machine_distance = total_distance_from_machine/(n_nodes)
+            self.avg_machine_distance = float(total_distance_from_machine / n_nodes)
             return self.avg_machine_distance
         return 0
 
+    def get_edges(self):
+        nodes = self.nodes
+        return zip(nodes[self.edges_from], nodes[self.edges_to], self.weights)
+
     def get_average_clustering(self):
-        # if self.edges_calculated:
-        #     return nx.average_clustering(self.nx_graph, weight='weight')
         return 0
 
+    def to_networkx(self):
+        import networkx as nx
+        graph = nx.Graph()
+        for i, pos in enumerate(self.nodes):
+            graph.add_node(i, pos=pos)
+        for i, j, w in zip(self.edges_from, self.edges_to, self.weights):
+            graph.add_edge(int(i), int(j), weight=w)
+        return graph
+
     def draw_nx_graph(self):
-        labels = nx.get_edge_attributes(self.nx_graph, 'weight')
-        pos = nx.get_node_attributes(self.nx_graph, 'pos')
-        nx.draw(self.nx_graph, pos)
-        nx.draw_networkx_edge_labels(self.nx_graph, pos, edge_labels=labels)
+        import networkx as nx
+        nx_graph = self.to_networkx()
+        labels = nx.get_edge_attributes(nx_graph, 'weight')
+        pos = nx.get_node_attributes(nx_graph, 'pos')
+        nx.draw(nx_graph, pos)
+        nx.draw_networkx_edge_labels(nx_graph, pos, edge_labels=labels)
 
     def normalize_weight(self, weight):
         normalized = (weight - self.min_weight) / (self.max_weight - self.min_weight)
@@ -106,33 +168,31 @@ class PeopleGraph:
         return normalized
 
     def draw_nodes(self, logger, debug=False, surfaces=None):
-        color = (255, 255, 255)
-        for node, node_data in self.nx_graph.nodes(data=True):
-            logger.draw_circle(Point(node.pos[0], node.pos[1]), (255, 255, 255), 3, 3, s_names=surfaces)
+        for pos in self.nodes:
+            logger.draw_circle(Point(pos[0], pos[1]), (255, 255, 255), 3, 3, s_names=surfaces)
 
     def draw_edges(self, logger, debug=False, surfaces=None):
         if self.edges_calculated:
             thickness = 1
             # thickness = int((self.normalize_weight(w['weight'])+1) * 2)
-            for i, j, w in self.nx_graph.edges(data=True):
-                logger.draw_line(Point(i.pos[0], i.pos[1]), Point(j.pos[0], j.pos[1]), (0, 0, 255), thickness, s_names=surfaces)
+            for p1, p2, w in self.get_edges():
+                logger.draw_line(Point(p1[0], p1[1]), Point(p2[0], p2[1]), (0, 0, 255), thickness, s_names=surfaces)
                 if debug:
-                    print(f"thickness (max: {self.min_weight}, min: {self.max_weight}, Original: {w['weight']} Normalized: {thickness}")
+                    print(f"thickness (max: {self.min_weight}, min: {self.max_weight}, Original: {w} Normalized: {thickness}")
 
     def draw_dist_from_machine(self, logger, m_pos, debug=False, surfaces=None):
-        for node, node_data in self.nx_graph.nodes(data=True):
-            logger.draw_line(Point(node.pos[0], node.pos[1]), Point(m_pos.x, m_pos.y), (255, 0, 0), 1, s_names=surfaces)
+        for pos in self.nodes:
+            logger.draw_line(Point(pos[0], pos[1]), Point(m_pos.x, m_pos.y), (255, 0, 0), 1, s_names=surfaces)
         logger.draw_circle(Point(m_pos.x, m_pos.y), (255, 255, 255), 3, 3, s_names=surfaces)
 
     def draw_debug_text(self, logger, start_pos, camera_n=0, debug=False, surfaces=None):
         nodes_data = ""
-        for node in self.nx_graph.nodes():
-            nodes_data = f"{nodes_data}, ({node.pos[0]:.2f}, {node.pos[1]:.2f})"
+        for pos in self.nodes:
+            nodes_data = f"{nodes_data}, ({pos[0]:.2f}, {pos[1]:.2f})"
         nodes_data = f"[{nodes_data}]"
         edges_data = ""
-        for i, j, w in self.nx_graph.edges(data=True):
-            # edges_data = f"{edges_data}, ({i.pos[0]:.2f}, {i.pos[1]:.2f}, weight: {w['weight']:.2f}\n)"
-            edges_data = f"{edges_data},{w['weight']:.2f}"
+        for w in self.weights:
+            edges_data = f"{edges_data},{w:.2f}"
         edges_data = f"[{edges_data}]"
 
         color = (255, 255, 0)
@@ -144,16 +204,11 @@ class PeopleGraph:
         start_pos = logger.add_text_line(f"Avg dist: {self.avg_people_distance:.2f}", color, start_pos, s_names=surfaces)
         start_pos = logger.add_text_line(f"Avg_m: {self.avg_machine_distance:.2f}", color, start_pos, s_names=surfaces)
         if debug:
-            print(f"Camera {camera_n:<2} - Nodes: {self.nx_graph.number_of_nodes():<3} Edges: {self.nx_graph.number_of_edges():<3}")
+            print(f"Camera {camera_n:<2} - Nodes: {self.n_people:<3} Edges: {self.n_edges:<3}")
 
     def get_graph_data(self):
         data = {}
-        data["nodes"] = []
-        data["edges"] = []
-        for node, node_data in self.nx_graph.nodes(data=True):
-            data["nodes"].append({'x': node.pos[0], 'y': node.pos[1]})
-        for i, j, w in self.nx_graph.edges(data=True):
-            data["edges"].append({'p1': {'x': i.pos[0], 'y': i.pos[1]},'p2': {'x': j.pos[0], 'y': j.pos[1]}, 'weight': w['weight']})
+        data["nodes"] = [{'x': float(pos[0]), 'y': float(pos[1])} for pos in self.nodes]
+        data["edges"] = [{'p1': {'x': float(p1[0]), 'y': float(p1[1])}, 'p2': {'x': float(p2[0]), 'y': float(p2[1])}, 'weight': float(w)}
+                         for p1, p2, w in self.get_edges()]
         return data
-
-
@@ -0,0 +1,90 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+cache_folder = "./Cache"
+# Bump when the rasterization changes so old cached maps are not reused
+ZONE_MAP_VERSION = 1
+NO_ZONE = -1
+# Pixels shared by more than one zone (usually their common border), those points are resolved with the polygons
+MULTI_ZONE = -2
+
+
+class ZoneLabelMap:
+    # int8 image at screen resolution, each pixel holds the index of the camera zone it belongs to.
+    # Pixels crossed by a zone border are MULTI_ZONE, so the lookup agrees with the polygons
+    def __init__(self, screen_w, screen_h):
+        self.screen_w = int(screen_w)
+        self.screen_h = int(screen_h)
+        self.labels = None
+        self.overlapping = 0
+        self.key = None
+        self.from_cache = False
+
+    def get_key(self, cameras_data):
+        data = json.dumps({'cameras': cameras_data, 'screen': [self.screen_w, self.screen_h], 'version': ZONE_MAP_VERSION},
+                          sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_cache_path(self, key):
+        return f"{cache_folder}/zones_{key}.npz"
+
+    def build(self, cameras, cameras_data, app_logger=None):
+        self.key = self.get_key(cameras_data)
+        cache_path = self.get_cache_path(self.key)
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    self.labels = cached['labels']
+                    self.overlapping = int(cached['overlapping'])
+                self.from_cache = True
+                return self.labels
+            except Exception as e:
+                if app_logger is not None:
+                    app_logger.error(f"Error reading cached zone map {cache_path}: {e}")
+        self.labels, self.overlapping = self.rasterize(cameras)
+        self.from_cache = False
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            np.savez_compressed(cache_path, labels=self.labels, overlapping=self.overlapping)
+        except Exception as e:
+            if app_logger is not None:
+                app_logger.error(f"Error caching zone map {cache_path}: {e}")
+        return self.labels
+
+    def rasterize(self, cameras):
+        # Zones are sampled on the pixel corners, a pixel gets a label only if its 4 corners agree
+        corners = np.full((self.screen_h + 1, self.screen_w + 1), NO_ZONE, dtype=np.int8)
+        overlapping = 0
+        for i, camera in enumerate(cameras):
+            if not camera.enabled or len(camera.path_points) <= 0:
+                continue
+            # Only test the points inside the zone bounding box
+            x0, y0 = max(0, int(np.floor(camera.min_point.x))), max(0, int(np.floor(camera.min_point.y)))
+            x1, y1 = min(self.screen_w, int(np.ceil(camera.max_point.x))) + 1, min(self.screen_h, int(np.ceil(camera.max_point.y))) + 1
+            if x0 >= x1 or y0 >= y1:
+                continue
+            ys, xs = np.mgrid[y0:y1, x0:x1]
+            inside = camera.path.contains_points(np.column_stack((xs.ravel(), ys.ravel()))).reshape(xs.shape)
+            region = corners[y0:y1, x0:x1]
+            shared = inside & (region != NO_ZONE)
+            overlapping += int(np.count_nonzero(shared & (region != MULTI_ZONE)))
+            region[inside] = i
+            region[shared] = MULTI_ZONE
+        top_left = corners[:-1, :-1]
+        same = (top_left == corners[1:, :-1]) & (top_left == corners[:-1, 1:]) & (top_left == corners[1:, 1:])
+        labels = np.where(same, top_left, MULTI_ZONE).astype(np.int8)
+        return labels, overlapping
+
+    def lookup(self, points):
+        # Zone index of every point, NO_ZONE outside of all the zones or of the screen, MULTI_ZONE where zones overlap
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        zones = np.full(len(points), NO_ZONE, dtype=np.int8)
+        if self.labels is None or len(points) <= 0:
+            return zones
+        xs = np.floor(points[:, 0]).astype(np.int64)
+        ys = np.floor(points[:, 1]).astype(np.int64)
+        valid = (xs >= 0) & (xs < self.screen_w) & (ys >= 0) & (ys < self.screen_h)
+        zones[valid] = self.labels[ys[valid], xs[valid]]
+        return zones
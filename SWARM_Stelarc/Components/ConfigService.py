@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+import threading
+import oyaml as yaml
+from .SwarmComponentMeta import SwarmComponentMeta, local_config_folder, online_config_folder
+
+
+class ConfigSnapshot:
+    # One parsed version of a config file, never modified once published
+    def __init__(self, filename, path, data, last_modified_time, version):
+        self._filename = filename
+        self._path = path
+        self._data = data
+        self._last_modified_time = last_modified_time
+        self._version = version
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def last_modified_time(self):
+        return self._last_modified_time
+
+    @property
+    def version(self):
+        return self._version
+
+    def get_data(self):
+        # Managers are free to modify what they get, the snapshot keeps its own copy
+        return copy.deepcopy(self._data)
+
+
+class ConfigSubscription:
+    def __init__(self, filename, callback, folders):
+        self.filename = filename
+        self.callback = callback
+        self.folders = folders
+        self.path = None
+        self.last_modified_time = -1
+        self.version = 0
+
+
+class ConfigService(SwarmComponentMeta):
+    # Watches the config folders from a single low-rate thread, files are parsed there and the
+    # resulting snapshots are only handed to the managers when apply_pending() is called between frames
+    def __init__(self, app_logger, ui_drawer, tasks_manager, poll_interval=0.5):
+        super(ConfigService, self).__init__(ui_drawer, tasks_manager, "ConfigService")
+        self.app_logger = app_logger
+        self.poll_interval = poll_interval
+        self.subscriptions = []
+        self.snapshots = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.polls = 0
+        self.reloads = 0
+        self.errors = 0
+        self.background_task = self.tasks_manager.add_task("ConfigWatcher", None, self.watch_loop, self.wake.set)
+
+    def subscribe(self, filename, callback, folders=(online_config_folder, local_config_folder)):
+        subscription = ConfigSubscription(filename, callback, folders)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def resolve_path(self, subscription):
+        # Online configs override the local ones, same as SwarmComponentMeta.get_config_file
+        for folder in subscription.folders:
+            file_path = f"{folder}/{subscription.filename}"
+            if os.path.exists(file_path):
+                return file_path
+        return None
+
+    def poll(self):
+        self.polls += 1
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            file_path = self.resolve_path(subscription)
+            if file_path is None:
+                continue
+            try:
+                last_modified_time = os.path.getmtime(file_path)
+                if file_path == subscription.path and last_modified_time <= subscription.last_modified_time:
+                    continue
+                with open(file_path) as file:
+                    data = yaml.load(file, Loader=yaml.FullLoader)
+            except Exception as e:
+                self.errors += 1
+                self.app_logger.error(f"Error opening {subscription.filename} config file: {e}")
+                continue
+            if subscription.path != file_path:
+                self.app_logger.critical(f"Reading config file {subscription.filename}, from {file_path}")
+            subscription.path = file_path
+            subscription.last_modified_time = last_modified_time
+            subscription.version += 1
+            snapshot = ConfigSnapshot(subscription.filename, file_path, data, last_modified_time, subscription.version)
+            with self.lock:
+                self.snapshots[subscription.filename] = snapshot
+                self.pending.append((subscription, snapshot))
+
+    def watch_loop(self, task_manager=None):
+        self.wake.wait(self.poll_interval)
+        if not self.background_task.is_running():
+            return False
+        self.poll()
+        return True
+
+    def has_pending(self):
+        return len(self.pending) > 0
+
+    def apply_pending(self):
+        # Called at frame boundaries, no file system access here
+        if not self.has_pending():
+            return 0
+        with self.lock:
+            # Only the newest snapshot of each file matters if it changed more than once since the last frame
+            pending = list({id(subscription): (subscription, snapshot) for subscription, snapshot in self.pending}.values())
+            self.pending = []
+        for subscription, snapshot in pending:
+            self.app_logger.debug(f"Updating {subscription.filename} configuration {snapshot.path}")
+            try:
+                subscription.callback(snapshot.get_data(), snapshot.last_modified_time)
+                self.reloads += 1
+            except Exception as e:
+                self.errors += 1
+                self.app_logger.error(f"Error applying {subscription.filename} config: {e}")
+        return len(pending)
+
+    def get_snapshot(self, filename):
+        with self.lock:
+            return self.snapshots.get(filename, None)
+
+    def init(self):
+        # The first read happens right away so that the managers start with their config
+        self.poll()
+        self.apply_pending()
+        if not self.background_task.is_running():
+            self.wake.clear()
+            self.background_task.start()
+
+    def stop(self):
+        self.background_task.stop()
+
+    def update_config(self):
+        self.apply_pending()
+
+    def update_config_data(self, data, last_modified_time):
+        pass
+
+    def draw(self, text_pos, debug=False, surfaces=None):
+        text_pos = self.ui_drawer.add_text_line(f"{self.tag} - Files: {len(self.subscriptions)}, Polls: {self.polls}, Reloads: {self.reloads}, Errors: {self.errors}", (255, 255, 0), text_pos, surfaces)
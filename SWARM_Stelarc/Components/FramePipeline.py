@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from .SwarmComponentMeta import SwarmComponentMeta
+from .Utils.FPSCounter import FPSCounter
+
+
+class BackpressurePolicy:
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    BLOCK = "block"
+
+
+class FramePacket:
+    # Travels through every stage of the pipeline, stages attach their results as attributes
+    def __init__(self, seq, frame=None):
+        self.seq = seq
+        self.frame = frame
+        self.frame_data = None
+        self.cameras_data = None
+        self.timestamps = {'created': time.time()}
+
+    def stamp(self, name):
+        self.timestamps[name] = time.time()
+
+    def age(self):
+        return time.time() - self.timestamps['created']
+
+
+class PipelineStage:
+    def __init__(self, name, stage_fun, queue_size=2, policy=BackpressurePolicy.DROP_OLDEST, block_timeout=0.1):
+        self.name = name
+        self.stage_fun = stage_fun
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = deque([])
+        self.cond = threading.Condition()
+        self.next_stage = None
+        self.pipeline = None
+        self.background_task = None
+        self.fps_counter = FPSCounter()
+        self.processed = 0
+        self.dropped = 0
+        self.last_seq = -1
+        self.avg_time = 0
+        self.total_time = 0
+        self.time_count = 0
+
+    def put(self, packet):
+        dropped = None
+        with self.cond:
+            if len(self.queue) >= self.queue_size:
+                if self.policy == BackpressurePolicy.BLOCK:
+                    deadline = time.time() + self.block_timeout
+                    while len(self.queue) >= self.queue_size:
+                        remaining = deadline - time.time()
+                        if remaining <= 0 or not self.is_running():
+                            dropped = packet
+                            break
+                        self.cond.wait(remaining)
+                elif self.policy == BackpressurePolicy.DROP_NEWEST:
+                    dropped = packet
+                else:
+                    dropped = self.queue.popleft()
+            if dropped is not packet:
+                self.queue.append(packet)
+                self.cond.notify_all()
+        if dropped is not None:
+            self.drop(dropped)
+        return dropped is not packet
+
+    def drop(self, packet):
+        # Every packet that leaves the pipeline without completing goes through here
+        self.dropped += 1
+        if self.pipeline is not None:
+            self.pipeline.release_packet(packet)
+
+    def get(self, timeout=0.1):
+        with self.cond:
+            if len(self.queue) <= 0:
+                self.cond.wait(timeout)
+            if len(self.queue) <= 0:
+                return None
+            packet = self.queue.popleft()
+            self.cond.notify_all()
+            return packet
+
+    def clear(self):
+        with self.cond:
+            packets = list(self.queue)
+            self.queue.clear()
+            self.cond.notify_all()
+        for packet in packets:
+            self.drop(packet)
+
+    def is_running(self):
+        return self.background_task is not None and self.background_task.is_running()
+
+    def run_once(self, packet):
+        start = time.time()
+        try:
+            packet = self.stage_fun(packet)
+        except Exception as e:
+            print(f"Error running pipeline stage {self.name} on frame {packet.seq}: {e}")
+            self.drop(packet)
+            return None
+        if packet is None:
+            return None
+        packet.stamp(self.name)
+        self.total_time += time.time() - start
+        self.time_count += 1
+        self.avg_time = self.total_time / self.time_count
+        if self.time_count > 10:
+            self.total_time = 0
+            self.time_count = 0
+        self.processed += 1
+        self.last_seq = packet.seq
+        self.fps_counter.update(1)
+        return packet
+
+    def stage_loop(self, task_manager=None):
+        packet = self.get()
+        if packet is None:
+            self.fps_counter.update()
+            return True
+        packet = self.run_once(packet)
+        if packet is not None:
+            self.pipeline.forward(self, packet)
+        return True
+
+    def get_stats(self):
+        return {'name': self.name, 'fps': self.fps_counter.fps, 'avg_time': self.avg_time,
+                'queue': len(self.queue), 'queue_size': self.queue_size, 'policy': self.policy,
+                'processed': self.processed, 'dropped': self.dropped, 'last_seq': self.last_seq}
+
+
+class SourceStage(PipelineStage):
+    # First stage of the pipeline, it produces new packets instead of reading them from a queue.
+    # source_fun is expected to block for a while when it has nothing new
+    def __init__(self, name, source_fun):
+        super(SourceStage, self).__init__(name, None, queue_size=0)
+        self.source_fun = source_fun
+
+    def stage_loop(self, task_manager=None):
+        start = time.time()
+        frame = self.source_fun()
+        if frame is None:
+            self.fps_counter.update()
+            return True
+        packet = self.pipeline.new_packet(frame)
+        packet.stamp(self.name)
+        self.total_time += time.time() - start
+        self.time_count += 1
+        self.avg_time = self.total_time / self.time_count
+        if self.time_count > 10:
+            self.total_time = 0
+            self.time_count = 0
+        self.processed += 1
+        self.last_seq = packet.seq
+        self.fps_counter.update(1)
+        self.pipeline.forward(self, packet)
+        return True
+
+
+class FramePipeline(SwarmComponentMeta):
+    def __init__(self, app_logger, ui_drawer, tasks_manager, tag="Pipeline", release_fun=None):
+        super(FramePipeline, self).__init__(ui_drawer, tasks_manager, tag)
+        self.app_logger = app_logger
+        # Called with the packets dropped on the way, so they can give back what they hold (e.g. ring slots)
+        self.release_fun = release_fun
+        self.enabled = False
+        self.stages = []
+        self.seq_lock = threading.Lock()
+        self.next_seq = 0
+        self.output_lock = threading.Lock()
+        self.latest_output = None
+        self.completed = 0
+        self.avg_latency = 0
+        self.fps_counter = FPSCounter()
+
+    def add_source(self, name, source_fun):
+        return self.add_stage(SourceStage(name, source_fun))
+
+    def add_processing_stage(self, name, stage_fun, queue_size=2, policy=BackpressurePolicy.DROP_OLDEST):
+        return self.add_stage(PipelineStage(name, stage_fun, queue_size, policy))
+
+    def add_stage(self, stage):
+        stage.pipeline = self
+        if len(self.stages) > 0:
+            self.stages[-1].next_stage = stage
+        stage.background_task = self.tasks_manager.add_task(f"{self.tag}_{stage.name}", None, stage.stage_loop, None)
+        self.stages.append(stage)
+        return stage
+
+    def new_packet(self, frame):
+        with self.seq_lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        return FramePacket(seq, frame)
+
+    def forward(self, stage, packet):
+        if stage.next_stage is not None:
+            stage.next_stage.put(packet)
+            return
+        with self.output_lock:
+            # Stages never reorder packets, a late packet can only come from a restart
+            if self.latest_output is None or packet.seq > self.latest_output.seq:
+                self.latest_output = packet
+                self.completed += 1
+                self.avg_latency = self.avg_latency * 0.9 + packet.age() * 0.1
+                self.fps_counter.update(1)
+
+    def release_packet(self, packet):
+        if self.release_fun is None:
+            return
+        try:
+            self.release_fun(packet)
+        except Exception as e:
+            print(f"Error releasing pipeline frame {packet.seq}: {e}")
+
+    def get_latest_output(self):
+        with self.output_lock:
+            return self.latest_output
+
+    def init(self):
+        for stage in self.stages:
+            if not self.enabled:
+                if stage.background_task.is_running():
+                    print(f"Stopping {stage.background_task.name} background task")
+                    stage.background_task.stop()
+            else:
+                if not stage.background_task.is_running():
+                    print(f"Starting {stage.background_task.name} background task")
+                    stage.clear()
+                    stage.background_task.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.background_task.stop()
+            stage.clear()
+
+    def update_config(self):
+        pass
+
+    def update_config_data(self, data, last_modified_time):
+        pass
+
+    def get_stats(self):
+        return [stage.get_stats() for stage in self.stages]
+
+    def draw(self, text_pos, debug=False, surfaces=None):
+        if not self.enabled:
+            return
+        self.fps_counter.update()
+        text_pos = self.ui_drawer.add_text_line(f"{self.tag} - FPS: {self.fps_counter.fps}, Latency: {self.avg_latency:.3f}, Completed: {self.completed}", (255, 255, 0), text_pos, surfaces)
+        for stage in self.stages:
+            s = stage.get_stats()
+            text_pos = self.ui_drawer.add_text_line(f"  {s['name']} - FPS: {s['fps']} Time: {s['avg_time']:.3f} Queue: {s['queue']}/{s['queue_size']} Dropped: {s['dropped']}", (255, 255, 0), text_pos, surfaces)
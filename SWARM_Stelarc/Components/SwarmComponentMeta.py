@@ -15,6 +15,7 @@ class SwarmComponentMeta:
       self.config_data = None
       self.last_modified_time = -1
       self.current_config_folder = None
+      self.config_service = None
       self.update_config_data_callback = update_config_data_callback if update_config_data_callback is not None else self.update_config_data
 
    def init(self):
@@ -33,7 +34,14 @@ class SwarmComponentMeta:
       return None
 
 
+   def subscribe_config(self, config_service):
+      # The service now delivers the config, update_config_from_file won't touch the file system anymore
+      self.config_service = config_service
+      config_service.subscribe(self.config_filename, self.update_config_data_callback)
+
    def update_config_from_file(self, app_logger, tag, filename, last_modified_time):
+      if self.config_service is not None:
+         return
       if self.current_config_folder is None:
          self.current_config_folder = online_config_folder
          file_path = self.get_config_file(app_logger, filename)
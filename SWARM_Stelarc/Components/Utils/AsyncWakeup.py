@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+from .WaitHistogram import WaitHistogram
+
+
+class AsyncWakeup:
+    # Wakes a coroutine waiting in an event loop from any thread. A set() with nobody waiting is not lost,
+    # the next wait() returns straight away
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flag = False
+        self.loop = None
+        self.event = None
+        self.waits = WaitHistogram()
+
+    def set(self):
+        with self.lock:
+            self.flag = True
+            loop, event = self.loop, self.event
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has been closed, the next wait() will run in a new one
+                pass
+
+    async def wait(self, timeout=None):
+        with self.lock:
+            if self.flag:
+                self.flag = False
+                return True
+            loop = asyncio.get_running_loop()
+            if self.loop is not loop:
+                self.loop = loop
+                self.event = asyncio.Event()
+            self.event.clear()
+            event = self.event
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.waits.add(time.perf_counter() - start)
+        with self.lock:
+            woken = self.flag
+            self.flag = False
+        return woken
@@ -1,66 +1,172 @@
-import datetime
-import base64
+import threading
+import time
 from .FPSCounter import FPSCounter
-from collections import deque
+from .AsyncWakeup import AsyncWakeup
+from .WaitHistogram import WaitHistogram
+
+
+class DropPolicy:
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+    BLOCK = "block"
+
 
 class DataQueue:
-    def __init__(self, size=None, target_fps=-1):
+    # Fixed capacity ring between one producer and one consumer, threads or coroutines. What happens to an item
+    # inserted in a full queue is up to the policy: it is dropped, it replaces the oldest one or the producer
+    # waits up to block_timeout for some room. Every inserted item ends up either consumed, dropped or still queued
+    def __init__(self, size=2, target_fps=-1, policy=DropPolicy.DROP_NEWEST, block_timeout=0.1, wakeup=None):
         self.fps_counter = FPSCounter()
-        self.buffer_size = size
-        self.buffer = deque([])
+        self.buffer_size = max(1, int(size))
         self.target_fps = target_fps
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.slots = [None] * self.buffer_size
+        # Absolute read and write positions, the slot is the position modulo the size
+        self.head = 0
+        self.tail = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        # Can be shared by several queues when a single coroutine consumes all of them
+        self.wakeup = AsyncWakeup() if wakeup is None else wakeup
+        self.enqueued = 0
+        self.dropped = 0
+        self.consumed = 0
+        # Time between the last two pops
+        self.pop_interval = 0
+        self.put_waits = WaitHistogram()
+        self.get_waits = WaitHistogram()
+
+    def _wait(self, predicate, timeout, histogram):
+      # Called with the condition held, returns predicate() once it holds or the timeout expires
+      if predicate() or timeout == 0 or self.closed:
+        return predicate()
+      start = time.perf_counter()
+      result = self.cond.wait_for(lambda: predicate() or self.closed, timeout) and predicate()
+      histogram.add(time.perf_counter() - start)
+      return result
+
+    def _pop(self):
+      # Called with the condition held on a non empty queue
+      index = self.head % self.buffer_size
+      data = self.slots[index]
+      self.slots[index] = None
+      self.head += 1
+      self.cond.notify_all()
+      return data
 
     def peek(self):
-      if len(self.buffer) > 0:
-        return self.buffer[0]
+      with self.cond:
+        if self.tail > self.head:
+          return self.slots[self.head % self.buffer_size]
       return None
 
+    def items(self):
+      with self.cond:
+        return [self.slots[i % self.buffer_size] for i in range(self.head, self.tail)]
 
     def fps(self):
       return self.fps_counter.fps
 
-    def insert_data(self, data):
-      if len(self.buffer) >= self.buffer_size:
-          return
+    def wait_not_full(self, timeout=None):
+      # Lets the producer wait for room before it makes the item, so it is as fresh as possible
+      with self.cond:
+        return self._wait(lambda: self.tail - self.head < self.buffer_size, timeout, self.put_waits)
+
+    def insert_data(self, data, timeout=None):
+      # Returns False when the item was dropped. timeout overrides block_timeout, None items are ignored
       if data is None:
-        return
-      self.buffer.append(data)
+        return False
+      with self.cond:
+        if self.tail - self.head >= self.buffer_size:
+          if self.policy == DropPolicy.DROP_OLDEST:
+            self._pop()
+            self.dropped += 1
+          elif self.policy == DropPolicy.BLOCK and timeout != 0:
+            timeout = self.block_timeout if timeout is None else timeout
+            if not self._wait(lambda: self.tail - self.head < self.buffer_size, timeout, self.put_waits):
+              self.dropped += 1
+              return False
+          else:
+            self.dropped += 1
+            return False
+        self.slots[self.tail % self.buffer_size] = data
+        self.tail += 1
+        self.enqueued += 1
+        self.cond.notify_all()
+      self.wakeup.set()
+      return True
 
     def clear(self):
-      self.buffer.clear()
+      with self.cond:
+        self.dropped += self.tail - self.head
+        self.slots = [None] * self.buffer_size
+        self.head = self.tail
+        self.cond.notify_all()
+
+    def close(self):
+      # Wakes up every waiting producer and consumer, reopen() before using the queue again
+      with self.cond:
+        self.closed = True
+        self.cond.notify_all()
+      self.wakeup.set()
+
+    def reopen(self):
+      with self.cond:
+        self.closed = False
 
     def discard_next(self):
       self.fps_counter.update()
-      if self.is_empty():
-        return None
-      return self.buffer.popleft()
-
-    def pop_data(self):
-      if self.is_empty():
-        return None
-      # if self.target_fps > 0:
-      #   if self.fps() > self.target_fps:
-      #     self.fps_counter.update(1)
-      #     self.buffer.popleft()
-      #     return None
+      with self.cond:
+        if self.tail <= self.head:
+          return None
+        self.dropped += 1
+        return self._pop()
+
+    def pop_data(self, timeout=0):
+      # Doesn't wait by default, None when nothing came within the timeout
+      with self.cond:
+        if not self._wait(lambda: self.tail > self.head, timeout, self.get_waits):
+          return None
+        # if self.target_fps > 0:
+        #   if self.fps() > self.target_fps:
+        #     self.fps_counter.update(1)
+        #     self.buffer.popleft()
+        #     return None
+        self.consumed += 1
+        data = self._pop()
+      self.pop_interval = self.fps_counter.time_since_last_update()
       self.fps_counter.update(1)
-      return self.buffer.popleft()
+      return data
+
+    async def get_async(self, timeout=None):
+      # pop_data for a coroutine, the producer wakes the event loop up through the queue wakeup. Also returns
+      # None when the wakeup was set for another queue sharing it, so one coroutine can serve all of them
+      data = self.pop_data()
+      if data is not None or self.closed:
+        return data
+      start = time.perf_counter()
+      await self.wakeup.wait(timeout)
+      self.get_waits.add(time.perf_counter() - start)
+      return self.pop_data()
 
     def time_since_last_pop(self):
       return self.fps_counter.time_since_last_update()
 
     def is_full(self):
-      if len(self.buffer) > self.buffer_size:
-        return True
-      return False
+      return self.tail - self.head >= self.buffer_size
 
     def is_empty(self):
-      if len(self.buffer) <= 0:
-        return True
-      return False
+      return self.tail <= self.head
 
     def size(self):
       return self.buffer_size
 
     def count(self):
-      return len(self.buffer)
+      return self.tail - self.head
+
+    def get_stats(self):
+      with self.cond:
+        return {'count': self.tail - self.head, 'size': self.buffer_size, 'policy': self.policy,
+                'enqueued': self.enqueued, 'dropped': self.dropped, 'consumed': self.consumed,
+                'put_waits': self.put_waits.get_stats(), 'get_waits': self.get_waits.get_stats()}
@@ -1,3 +1,4 @@
+import threading
 import time
 
 
@@ -8,8 +9,14 @@ class FPSCounter():
     self.frame_count = 0
     self.start_time = 0
     self.last_frame_time = time.time()
+    # Producers, consumers and the UI thread update the same counter
+    self.lock = threading.Lock()
 
   def reset(self):
+    with self.lock:
+      self._reset()
+
+  def _reset(self):
     self.frame_count = 0
     self.start_time = time.time()
     self.last_frame_time = time.time()
@@ -18,12 +25,12 @@ class FPSCounter():
     return time.time() - self.last_frame_time
 
   def update(self, new_frames=0):
-    if new_frames > 0:
-      self.frame_count += new_frames
-      self.last_frame_time = time.time()
-    elapsed = time.time() - self.start_time
-    if elapsed > 0:
-      self.fps = int(self.frame_count / (elapsed))
-      if elapsed >= self.reset_time:
-        self.reset()
-
+    with self.lock:
+      if new_frames > 0:
+        self.frame_count += new_frames
+        self.last_frame_time = time.time()
+      elapsed = time.time() - self.start_time
+      if elapsed > 0:
+        self.fps = int(self.frame_count / (elapsed))
+        if elapsed >= self.reset_time:
+          self._reset()
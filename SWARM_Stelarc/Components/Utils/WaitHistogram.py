@@ -0,0 +1,46 @@
+import threading
+
+
+class WaitHistogram:
+    # Time spent blocked, counted in log buckets: <10us, <100us, <1ms, <10ms, <100ms, <1s, longer
+    EDGES = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.EDGES) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, wait):
+        bucket = 0
+        while bucket < len(self.EDGES) and wait >= self.EDGES[bucket]:
+            bucket += 1
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += wait
+            self.max = max(self.max, wait)
+
+    def percentile(self, p):
+        # Upper edge of the bucket holding the p-th percentile, the max for the last bucket
+        with self.lock:
+            if self.count <= 0:
+                return 0.
+            target = p / 100. * self.count
+            seen = 0
+            for bucket, count in enumerate(self.counts):
+                seen += count
+                if seen >= target and count > 0:
+                    return self.EDGES[bucket] if bucket < len(self.EDGES) else self.max
+            return self.max
+
+    def get_stats(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count > 0 else 0., 'max': self.max,
+                'p50': self.percentile(50), 'p99': self.percentile(99), 'buckets': list(self.counts)}
+
+    def summary(self):
+        return f"n: {self.count}, p50 < {self.percentile(50) * 1000:.2f}ms, p99 < {self.percentile(99) * 1000:.2f}ms, max: {self.max * 1000:.1f}ms"
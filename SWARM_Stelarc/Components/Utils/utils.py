@@ -74,30 +74,49 @@ def pairwise(iterable):
     next(b, None)
     return izip(a, b)
 
-def poses2boxes(poses):
-    global seen_bodyparts
+def poses2boxes(poses, with_tlwh=False):
     """
     Parameters
     ----------
-    poses: ndarray of human 2D poses [People * BodyPart]
+    poses: ndarray of human 2D poses [People * BodyPart * 2]
+    with_tlwh: also return the boxes as [x1,y1,width,height]
     Returns
     ----------
-    boxes: ndarray of containing boxes [People * [x1,y1,x2,y2]]
+    boxes: ndarray of containing boxes [People * [x1,y1,x2,y2]], one standard deviation around
+        the mean of the seen body parts. People without any seen body part get an empty box
     """
-    boxes = []
-    for person in poses:
-        seen_bodyparts = person[np.where((person[:,0] != 0) | (person[:,1] != 0))]
-        # box = [ int(min(seen_bodyparts[:,0])),int(min(seen_bodyparts[:,1])),
-        #        int(max(seen_bodyparts[:,0])),int(max(seen_bodyparts[:,1]))]
-        mean = np.mean(seen_bodyparts, axis=0)
-        deviation = np.std(seen_bodyparts, axis = 0)
-        box = [int(mean[0]-deviation[0]), int(mean[1]-deviation[1]), int(mean[0]+deviation[0]), int(mean[1]+deviation[1])]
-        boxes.append(box)
-    return np.array(boxes)
+    poses = np.asarray(poses, dtype=np.float64)
+    poses = poses.reshape((-1,) + poses.shape[-2:])
+    seen = (poses[:, :, 0] != 0) | (poses[:, :, 1] != 0)
+    n_seen = np.count_nonzero(seen, axis=1)[:, None]
+    # Unseen body parts are left out of the sums, people with nothing seen don't divide by 0
+    weights = seen[:, :, None]
+    count = np.maximum(n_seen, 1)
+    mean = np.sum(poses, axis=1, where=weights) / count
+    deviation = np.sqrt(np.sum(np.square(poses - mean[:, None, :]), axis=1, where=weights) / count)
+    boxes = np.trunc(np.hstack((mean - deviation, mean + deviation))).astype(np.int64)
+    boxes[n_seen[:, 0] == 0] = 0
+    if not with_tlwh:
+        return boxes
+    boxes_tlwh = boxes.copy()
+    boxes_tlwh[:, 2:] -= boxes[:, :2]
+    return boxes, boxes_tlwh
 
 def distancia_midpoints(mid1, mid2):
     return np.linalg.norm(np.array(mid1)-np.array(mid2))
 
+def poses2midpoints(poses):
+    """
+    Parameters
+    ----------
+    poses: ndarray of human 2D poses [People * BodyPart * 2]
+    Returns
+    ----------
+    midpoints: centers of the poses2boxes boxes [People * [x,y]]
+    """
+    boxes = poses2boxes(poses)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2
+
 def pose2midpoint(pose):
     """
     Parameters
@@ -107,9 +126,7 @@ def pose2midpoint(pose):
     ----------
     boxes: pose midpint [x,y]
     """
-    box = poses2boxes([pose])[0]
-    midpoint = [np.mean([box[0],box[2]]), np.mean([box[1],box[3]])]
-    return np.array(midpoint)
+    return poses2midpoints(pose)[0]
 
 @jit
 def iou(bb_test,bb_gt):
@@ -4,15 +4,35 @@ import sys
 import os
 from sys import platform
 import time
+import threading
 from Components.VideoProcessor.deep_sort.detection import Detection
-from Components.VideoProcessor.deep_sort import nn_matching, preprocessing
-from Components.VideoProcessor.deep_sort.tracker import Tracker as DeepTracker
+from Components.VideoProcessor.deep_sort import preprocessing
+from Components.VideoProcessor.tracking import BODY_PARTS, POSE_PAIRS, create_tracker
 from tools import generate_detections as gdet
 from Components.Utils.utils import poses2boxes
 import Constants
 
 # app = Flask(__name__)
 
+# One batching encoder per process, shared by every Input so crops from concurrent frames go through one session run
+_shared_encoders = {}
+_shared_encoders_lock = threading.Lock()
+
+
+def get_shared_encoder(model_filename):
+    with _shared_encoders_lock:
+        if model_filename not in _shared_encoders:
+            _shared_encoders[model_filename] = gdet.create_batching_box_encoder(
+                model_filename, max_batch_size=Constants.reid_max_batch, max_latency=Constants.reid_max_latency)
+        return _shared_encoders[model_filename]
+
+
+def stop_shared_encoders():
+    with _shared_encoders_lock:
+        for model_filename in _shared_encoders:
+            _shared_encoders[model_filename].stop()
+        _shared_encoders.clear()
+
 # Load OpenPose:
 dir_path = os.path.dirname(os.path.realpath(__file__))
 openpose_modelfolder = Constants.openpose_modelfolder
@@ -38,41 +58,35 @@ except ImportError as e:
 
 
 class Input:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, net_resolution="-1x320", preload_resolutions=()):
         # from openpose import *
-        params = dict()
-        params["model_folder"] = openpose_modelfolder
-        print(f"Using openpose model at {params['model_folder']}")
-        params["net_resolution"] = "-1x320"
-        self.openpose = op.WrapperPython()
-        self.openpose.configure(params)
-        self.openpose.start()
-
-        max_cosine_distance = Constants.max_cosine_distance
-        nn_budget = Constants.nn_budget
+        print(f"Using openpose model at {openpose_modelfolder}")
+        self.openpose_wrappers = {}
+        self.openpose = None
+        self.net_resolution = None
+        for resolution in preload_resolutions:
+            self.start_openpose(resolution)
+        self.set_net_resolution(net_resolution, keep_previous=True)
+
         self.nms_max_overlap = Constants.nms_max_overlap
-        max_age = Constants.max_age
-        n_init = Constants.n_init
+        self.nms_backend = Constants.nms_backend
 
         model_filename = 'model_data/mars-small128.pb'
-        self.encoder = gdet.create_box_encoder(model_filename, batch_size=1)
-        metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-        self.tracker = DeepTracker(metric, max_age=max_age, n_init=n_init)
+        if Constants.reid_batching:
+            self.encoder = get_shared_encoder(model_filename)
+        else:
+            self.encoder = gdet.create_box_encoder(model_filename, batch_size=Constants.reid_max_batch)
+        self.tracker = create_tracker()
+        self.last_keypoints = np.zeros((0, 25, 3))
+        self.inference_time = 0
 
         self.start_time = time.time()
 
         # For calculating angels:
 
-        self.BODY_PARTS = {"Nose": 0, "Neck": 1, "RShoulder": 2, "RElbow": 3, "RWrist": 4,
-                           "LShoulder": 5, "LElbow": 6, "LWrist": 7, "MHip": 8, "RHip": 9, "RKnee": 10,
-                           "RAnkle": 11, "LHip": 12, "LKnee": 13, "LAnkle": 14, "REye": 15,
-                           "LEye": 16, "REar": 17, "LEar": 18}
+        self.BODY_PARTS = BODY_PARTS
 
-        self.POSE_PAIRS = [["Neck", "RShoulder"], ["Neck", "LShoulder"], ["RShoulder", "RElbow"],
-                           ["RElbow", "RWrist"], ["LShoulder", "LElbow"], ["LElbow", "LWrist"],
-                           ["MHip", "RHip"], ["RHip", "RKnee"], ["RKnee", "RAnkle"], ["MHip", "LHip"],
-                           ["LHip", "LKnee"], ["LKnee", "LAnkle"], ["Neck", "Nose"], ["Nose", "REye"],
-                           ["REye", "REar"], ["Nose", "LEye"], ["LEye", "LEar"]]
+        self.POSE_PAIRS = POSE_PAIRS
 
         self.POINTS = []
 
@@ -105,42 +119,78 @@ class Input:
     #             s += (',' + str(j))
     #     csv_writer.writerow([s])
 
+    def start_openpose(self, net_resolution):
+        if net_resolution not in self.openpose_wrappers:
+            params = dict()
+            params["model_folder"] = openpose_modelfolder
+            params["net_resolution"] = net_resolution
+            wrapper = op.WrapperPython()
+            wrapper.configure(params)
+            wrapper.start()
+            self.openpose_wrappers[net_resolution] = wrapper
+        return self.openpose_wrappers[net_resolution]
+
+    def set_net_resolution(self, net_resolution, keep_previous=False):
+        # Preloaded wrappers are kept and switching is instant, otherwise OpenPose restarts at the new resolution
+        if net_resolution == self.net_resolution:
+            return
+        previous = self.net_resolution
+        self.openpose = self.start_openpose(net_resolution)
+        self.net_resolution = net_resolution
+        if not keep_previous and previous is not None:
+            self.openpose_wrappers.pop(previous).stop()
+
     def dancing_processing(self, frame):
         res, trackers = self.update_trackers(frame)
 
-    def update_trackers(self, frame):
+    def update_trackers(self, frame, cropper=None, layout=None):
+        keypoints, detections, frame = self.detect(frame, cropper, layout)
+        self.last_keypoints = keypoints
+        if frame is not None:
+            # Call the tracker
+            self.tracker.predict()
+            self.tracker.update(frame, detections)
+            return self.tracker.tracks, keypoints, frame
+        return self.tracker.tracks, keypoints, None
+
+    def coast_trackers(self, frame):
+        # Frames skipped by the motion gate: tracks follow their Kalman prediction, poses stay the last seen ones
+        self.tracker.predict(coasting=True)
+        return self.tracker.tracks, self.last_keypoints, frame
+
+    def detect(self, frame, cropper=None, layout=None):
+        # With a crop layout OpenPose only sees the camera zones, results are mapped back to the full frame
         datum = op.Datum()
-        datum.cvInputData = frame
+        datum.cvInputData = frame if layout is None else cropper.crop(frame, layout)
+        start = time.time()
         self.openpose.emplaceAndPop(op.VectorDatum([datum]))
+        # Only this part depends on net_resolution, the cropping, ReID and tracking costs don't
+        self.inference_time = time.time() - start
         keypoints = np.array(datum.poseKeypoints)
-        frame = datum.cvOutputData
+        if layout is None:
+            frame = datum.cvOutputData
+        else:
+            keypoints = cropper.map_keypoints(keypoints, layout)
+            frame = cropper.paste(frame, datum.cvOutputData, layout)
         # print(keypoints)
         # Doesn't use keypoint confidence
 
         if keypoints.any():
             poses = keypoints[:, :, :2]
             # Get containing box for each seen body
-            boxes = poses2boxes(poses)
-            boxes_xywh = [[x1, y1, x2 - x1, y2 - y1] for [x1, y1, x2, y2] in boxes]
-            features = self.encoder(frame, boxes_xywh)
+            boxes, boxes_tlwh = poses2boxes(poses, with_tlwh=True)
+            features = self.encoder(frame, boxes_tlwh)
             # print(features)
 
-            nonempty = lambda xywh: xywh[2] != 0 and xywh[3] != 0
-            detections = [Detection(bbox, 1.0, feature, pose) for bbox, feature, pose in
-                          zip(boxes_xywh, features, poses) if nonempty(bbox)]
+            nonempty = np.flatnonzero((boxes_tlwh[:, 2] != 0) & (boxes_tlwh[:, 3] != 0))
+            detections = [Detection(boxes_tlwh[i], 1.0, features[i], poses[i]) for i in nonempty]
             # Run non-maxima suppression.
-            boxes_det = np.array([d.tlwh for d in detections])
+            boxes_det = boxes_tlwh[nonempty]
             scores = np.array([d.confidence for d in detections])
-            indices = preprocessing.non_max_suppression(boxes_det, self.nms_max_overlap, scores)
+            indices = preprocessing.non_max_suppression(boxes_det, self.nms_max_overlap, scores, self.nms_backend)
             detections = [detections[i] for i in indices]
-            # Call the tracker
-            self.tracker.predict()
-            self.tracker.update(frame, detections)
-
-            hand_count = 0
-            raise_count = 0
-            return self.tracker.tracks, keypoints, frame
-        return self.tracker.tracks, keypoints, None
+            return keypoints, detections, frame
+        return keypoints, [], None
 
 
 
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+from ..Camera.zone_map import NO_ZONE
+
+
+class MotionGate:
+    # Decides if a frame is worth a pose inference: frames are compared, small and grey, with the last inferred
+    # one inside the camera zones. Slow movements add up until they cross the threshold
+    def __init__(self, downscale=4):
+        self.enabled = False
+        self.downscale = downscale
+        self.pixel_threshold = 25
+        self.min_motion = 0.002
+        self.max_skip = 5
+        self.max_skip_empty = 15
+        self.reference = None
+        self.mask = None
+        self.mask_key = None
+        self.skipped = 0
+        self.inferred = 0
+        self.total_skipped = 0
+        self.motion = 0
+
+    def update_config_data(self, data):
+        self.enabled = data.get("motion_gate", self.enabled)
+        self.pixel_threshold = data.get("motion_threshold", self.pixel_threshold)
+        self.min_motion = data.get("motion_min_ratio", self.min_motion)
+        self.max_skip = data.get("max_skip_frames", self.max_skip)
+        self.max_skip_empty = data.get("max_skip_frames_empty", self.max_skip_empty)
+
+    def get_small_frame(self, frame):
+        h, w = frame.shape[:2]
+        size = (max(1, w // self.downscale), max(1, h // self.downscale))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.GaussianBlur(cv2.resize(gray, size, interpolation=cv2.INTER_AREA), (5, 5), 0)
+
+    def get_mask(self, small_shape, zone_map):
+        # Pixels of the enabled camera zones, the whole frame when no zone map is available
+        labels = None if zone_map is None else zone_map.labels
+        key = (small_shape, id(labels))
+        if key != self.mask_key:
+            self.mask_key = key
+            self.mask = None
+            if labels is not None:
+                mask = cv2.resize((labels != NO_ZONE).astype(np.uint8), small_shape[::-1], interpolation=cv2.INTER_NEAREST)
+                self.mask = mask.astype(bool) if mask.any() else None
+        return self.mask
+
+    def should_infer(self, frame, n_tracks, zone_map=None):
+        if not self.enabled or frame is None:
+            return True
+        small = self.get_small_frame(frame)
+        infer = self.reference is None or self.reference.shape != small.shape
+        if not infer:
+            moving = cv2.absdiff(small, self.reference) > self.pixel_threshold
+            mask = self.get_mask(small.shape, zone_map)
+            self.motion = moving[mask].mean() if mask is not None else moving.mean()
+            max_skip = self.max_skip if n_tracks > 0 else self.max_skip_empty
+            infer = self.motion >= self.min_motion or self.skipped >= max_skip
+        if infer:
+            self.reference = small
+            self.skipped = 0
+            self.inferred += 1
+        else:
+            self.skipped += 1
+            self.total_skipped += 1
+        return infer
+
+    def get_metrics(self):
+        total = self.inferred + self.total_skipped
+        return {'enabled': self.enabled, 'inferred': self.inferred, 'skipped': self.total_skipped,
+                'skip_rate': self.total_skipped / total if total > 0 else 0, 'motion': float(self.motion)}
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import time
+import queue
+import numpy as np
+import multiprocessing as mp
+from .SharedFrameRing import SharedFrameRing, FrameSlot
+
+
+def pose_worker_main(worker_id, jobs, results):
+    # Runs in its own process with its own OpenPose wrapper and ReID encoder
+    from Components.VideoProcessor.Input import Input, stop_shared_encoders
+    from Components.VideoProcessor.tracking import detections_to_data
+    pose_input = Input()
+    rings = {}
+    results.put((-1, worker_id, None, None, False, 0, None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        seq, ring_spec, index = job
+        start = time.time()
+        try:
+            ring = rings.get(ring_spec['name'], None)
+            if ring is None:
+                ring = SharedFrameRing.attach(ring_spec)
+                rings[ring_spec['name']] = ring
+            frame = ring.frames[index]
+            keypoints, detections, out_frame = pose_input.detect(frame)
+            rendered = out_frame is not None
+            if rendered:
+                # The input frame is not needed anymore, send the rendered one back through the same slot
+                np.copyto(frame, out_frame)
+            results.put((seq, worker_id, keypoints, detections_to_data(detections), rendered, time.time() - start, None))
+        except Exception as e:
+            results.put((seq, worker_id, None, [], False, time.time() - start, f"{e}"))
+    stop_shared_encoders()
+    for name in rings:
+        rings[name].close()
+
+
+class PoseWorkerStats:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.ready = False
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+        self.last_latency = 0
+        self.avg_latency = 0
+
+    def add_result(self, latency, error=None):
+        self.in_flight -= 1
+        self.processed += 1
+        self.errors += 1 if error is not None else 0
+        self.last_latency = latency
+        self.avg_latency = latency if self.processed <= 1 else self.avg_latency * 0.9 + latency * 0.1
+
+    def get_json(self):
+        return {'worker': self.worker_id, 'ready': self.ready, 'queue': self.in_flight, 'processed': self.processed,
+                'errors': self.errors, 'latency': self.last_latency, 'avg_latency': self.avg_latency}
+
+
+class PoseResult:
+    def __init__(self, seq, keypoints, detections_data, frame, rendered, latency, error=None):
+        self.seq = seq
+        self.keypoints = keypoints
+        self.detections_data = detections_data
+        self.frame = frame
+        self.rendered = rendered
+        self.latency = latency
+        self.error = error
+
+
+class PoseWorkerPool:
+    def __init__(self, n_workers, frame_shape, max_queue_per_worker=1, reorder_timeout=2.0):
+        self.n_workers = n_workers
+        self.max_queue_per_worker = max_queue_per_worker
+        self.reorder_timeout = reorder_timeout
+        self.frame_shape = tuple(frame_shape)
+        # Frames that don't already live in shared memory are copied into the pool's own ring
+        self.ring = SharedFrameRing(self.frame_shape, n_workers * (max_queue_per_worker + 1))
+        ctx = mp.get_context("spawn")
+        self.results = ctx.Queue()
+        self.jobs = [ctx.Queue() for i in range(n_workers)]
+        self.workers = [ctx.Process(target=pose_worker_main, args=(i, self.jobs[i], self.results), daemon=True) for i in range(n_workers)]
+        self.stats = [PoseWorkerStats(i) for i in range(n_workers)]
+        self.in_flight = {}
+        self.reorder_buffer = {}
+        self.next_seq = 0
+        self.next_out_seq = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.running = False
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for jobs in self.jobs:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        for seq in self.in_flight:
+            self.in_flight[seq][1].release()
+        self.in_flight.clear()
+        self.ring.close()
+
+    def check_workers(self):
+        # A crashed worker never sends its results, stop feeding it and take its slots back
+        for worker, stats in zip(self.workers, self.stats):
+            if stats.ready and not worker.is_alive():
+                print(f"Pose worker {stats.worker_id} died with exit code {worker.exitcode}")
+                stats.ready = False
+                for seq in [seq for seq, pending in self.in_flight.items() if pending[0] == stats.worker_id]:
+                    worker_id, slot, submit_time = self.in_flight.pop(seq)
+                    stats.in_flight -= 1
+                    slot.release()
+
+    def get_free_worker(self):
+        self.check_workers()
+        ready = [s for s in self.stats if s.ready and s.in_flight < self.max_queue_per_worker]
+        if len(ready) <= 0:
+            return None
+        return min(ready, key=lambda s: s.in_flight)
+
+    def submit(self, camera_frame):
+        # Takes ownership of FrameSlots, they are released once the result has been collected
+        worker = self.get_free_worker()
+        slot = camera_frame if isinstance(camera_frame, FrameSlot) else None
+        if worker is None:
+            self.dropped += 1
+            if slot is not None:
+                slot.release()
+            return False
+        if slot is None:
+            if self.ring.write(camera_frame) is None:
+                self.dropped += 1
+                return False
+            slot = self.ring.acquire_next()
+        seq = self.next_seq
+        self.next_seq += 1
+        self.in_flight[seq] = (worker.worker_id, slot, time.time())
+        worker.in_flight += 1
+        self.jobs[worker.worker_id].put((seq, slot.ring.get_spec(), slot.index))
+        return True
+
+    def drain_results(self):
+        while True:
+            try:
+                seq, worker_id, keypoints, detections_data, rendered, latency, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            stats = self.stats[worker_id]
+            if seq < 0:
+                stats.ready = self.workers[worker_id].is_alive()
+                continue
+            if seq not in self.in_flight:
+                # Its worker was found dead and the slot already released
+                continue
+            stats.add_result(latency, error)
+            worker_id, slot, submit_time = self.in_flight.pop(seq)
+            if seq < self.next_out_seq:
+                # Arrived after collect() skipped it, the worker is done writing so the slot can be reused
+                slot.release()
+                continue
+            frame = slot.frame.copy()
+            slot.release()
+            if error is not None:
+                print(f"Pose worker {worker_id} failed on frame {seq}: {error}")
+            self.reorder_buffer[seq] = PoseResult(seq, keypoints, detections_data, frame, rendered,
+                                                  time.time() - submit_time, error)
+
+    def collect(self):
+        # Returns the finished results strictly in submission order
+        self.drain_results()
+        ordered = []
+        while self.next_out_seq < self.next_seq:
+            result = self.reorder_buffer.pop(self.next_out_seq, None)
+            if result is None:
+                pending = self.in_flight.get(self.next_out_seq, None)
+                if pending is not None and time.time() - pending[2] < self.reorder_timeout:
+                    break
+                # Lost frame (crashed or stuck worker), don't let it stall the following ones. A stuck worker
+                # may still write into the slot, it stays in flight until its result comes or the worker dies
+                self.skipped += 1
+                self.next_out_seq += 1
+                continue
+            ordered.append(result)
+            self.next_out_seq += 1
+        return ordered
+
+    def get_metrics(self):
+        return {'workers': [s.get_json() for s in self.stats], 'in_flight': len(self.in_flight),
+                'reorder_buffer': len(self.reorder_buffer), 'dropped': self.dropped, 'skipped': self.skipped,
+                'submitted': self.next_seq, 'completed': self.next_out_seq}
@@ -2,39 +2,69 @@ from ..SwarmComponentMeta import SwarmComponentMeta
 import threading
 import cv2
 import time
-from collections import deque
+import numpy as np
 from ..Utils.utils import Point
 from ..Utils.FPSCounter import FPSCounter
+from ..Utils.DataQueue import DataQueue, DropPolicy
+from .SharedFrameRing import FrameSlot
+from .MotionGate import MotionGate
+from .ResolutionController import ResolutionController
+from .ZoneCropper import ZoneCropper
 
 
 class FrameData:
-    def __init__(self, tracks=None, keypoints=None, frame=None):
+    def __init__(self, tracks=None, keypoints=None, frame=None, slot=None):
         self.tracks = [] if tracks is None else tracks
         self.keypoints = [] if keypoints is None else keypoints
+        self.slot = slot
+        if frame is None and slot is not None:
+            frame = slot.frame
         self.frame = None if frame is None else frame
         self.processed = False
 
+    def release_slot(self):
+        if self.slot is None:
+            return
+        # Frames that were not replaced by the processing still point into the ring
+        if self.frame is not None and np.may_share_memory(self.frame, self.slot.frame):
+            self.frame = self.frame.copy()
+        self.slot.release()
+        self.slot = None
+
+    @staticmethod
+    def from_camera_frame(camera_frame):
+        if isinstance(camera_frame, FrameSlot):
+            return FrameData(slot=camera_frame)
+        return FrameData(frame=camera_frame)
+
 class ProcessingManager(SwarmComponentMeta):
     def __init__(self, tag, app_logger, ui_drawer, tasks_manager, camera_manager=None, cont_color=(0, 255, 0)):
         self.app_logger = app_logger
         self.processing_type = "simple"
         self.input = None
         super(ProcessingManager, self).__init__(ui_drawer, tasks_manager, "ProcessingManager")
+        self.cameras_manager = camera_manager
         self.cameras = camera_manager.cameras if camera_manager is not None else []
         self.processed_frame_data = None
         self.multi_threaded = False
         self.background_task = self.tasks_manager.add_task(f"OP_{tag}", None, self.processing_loop, None)
-        self.processing_lock = threading.Lock()
         self.processed_lock = threading.Lock()
         self.buffer_size = 2
-        self.frames_to_process = deque([])
-        self.frames_processed = deque([])
+        self.frames_to_process = DataQueue(self.buffer_size)
+        # Results nobody picked up in time are replaced by newer ones
+        self.frames_processed = DataQueue(self.buffer_size, policy=DropPolicy.DROP_OLDEST)
         self.fps_counter = FPSCounter()
         self.cont_color = cont_color
         self.avg_processing_time = 0
         self.total_processing_time = 0
         self.proc_time_count = 0
         self.op_lock = threading.Lock()
+        self.pool_workers = 2
+        self.pose_pool = None
+        self.pool_tracker = None
+        self.motion_gate = MotionGate()
+        self.resolution_controller = ResolutionController(app_logger)
+        self.zone_cropper = ZoneCropper()
 
     def init(self):
         if not self.multi_threaded:
@@ -50,17 +80,25 @@ class ProcessingManager(SwarmComponentMeta):
         if self.processing_type == "op" and self.input is None:
             from . import Input
             print(f"Initializing input for OP")
-            self.input = Input.Input()
+            controller = self.resolution_controller
+            self.input = Input.Input(net_resolution=controller.current,
+                                     preload_resolutions=controller.resolutions if controller.preload else ())
+        elif self.processing_type != "op_pool" and self.pose_pool is not None:
+            # Waits for the processing thread to be done with the pool
+            with self.op_lock:
+                if self.pose_pool is not None:
+                    print(f"Stopping pose worker pool")
+                    self.pose_pool.stop()
+                    self.pose_pool = None
 
     def update_config_data(self, data, last_modified_time):
         pass
 
     def processing_loop(self, task_manager=None, async_loop=None):
-        if len(self.frames_to_process) <= 0:
-            time.sleep(0.001)
+        # Sleep until a frame is handed over, the timeout lets a stop through
+        to_process = self.frames_to_process.pop_data(timeout=0.1)
+        if to_process is None:
             return True
-        with self.processing_lock:
-            to_process = self.frames_to_process.popleft()
         processed = to_process
         try:
             start = time.time()
@@ -74,17 +112,34 @@ class ProcessingManager(SwarmComponentMeta):
             if self.proc_time_count > 10:
                 self.proc_time_count = 0
                 self.total_processing_time = 0
-            self.frames_processed.append(processed)
+            if processed is not None:
+                self.frames_processed.insert_data(processed)
         return True
 
     def process_frame(self, to_process):
         if to_process is None:
             return FrameData()
+        if self.processing_type == "op_pool":
+            # The pool owns the slot from here on, results come back in order but possibly later
+            return self.pool_processing(to_process)
+        try:
+            return self.run_processing(to_process)
+        finally:
+            to_process.release_slot()
+
+    def run_processing(self, to_process):
         try:
             if self.processing_type == "op":
                 with self.op_lock:
-                    tracks, keypoints, updated_frame = self.input.update_trackers(to_process.frame)
-                    to_process.processed = True
+                    zone_map = None if self.cameras_manager is None else self.cameras_manager.zone_map
+                    if self.motion_gate.should_infer(to_process.frame, len(self.input.tracker.tracks), zone_map):
+                        layout = self.get_crop_layout(to_process.frame)
+                        tracks, keypoints, updated_frame = self.input.update_trackers(to_process.frame, self.zone_cropper, layout)
+                        self.adapt_resolution(self.input.inference_time, keypoints)
+                        to_process.processed = True
+                    else:
+                        tracks, keypoints, updated_frame = self.input.coast_trackers(to_process.frame)
+                        to_process.processed = False
             elif self.processing_type == "simple":
                 with self.op_lock:
                     tracks, keypoints, updated_frame = self.simple_processing(to_process.frame)
@@ -106,6 +161,80 @@ class ProcessingManager(SwarmComponentMeta):
             print(f"Error processing frame: {e}")
         return to_process
 
+    def get_crop_layout(self, frame):
+        if not self.zone_cropper.enabled or self.cameras_manager is None or frame is None:
+            return None
+        return self.zone_cropper.get_layout(frame.shape, self.cameras, self.cameras_manager.zones_version)
+
+    def adapt_resolution(self, inference_time, keypoints):
+        controller = self.resolution_controller
+        controller.update(inference_time, keypoints)
+        if self.input.net_resolution != controller.current:
+            self.input.set_net_resolution(controller.current, keep_previous=controller.preload)
+
+    def pool_processing(self, to_process):
+        if to_process.frame is None:
+            return None
+        with self.op_lock:
+            return self.run_pool_processing(to_process)
+
+    def run_pool_processing(self, to_process):
+        if self.pose_pool is None:
+            from .PoseWorkerPool import PoseWorkerPool
+            from .tracking import create_tracker
+            print(f"Starting pose worker pool with {self.pool_workers} workers")
+            self.pose_pool = PoseWorkerPool(self.pool_workers, to_process.frame.shape)
+            self.pool_tracker = create_tracker()
+            self.pose_pool.start()
+        if to_process.slot is not None:
+            self.pose_pool.submit(to_process.slot)
+            to_process.slot = None
+        else:
+            self.pose_pool.submit(to_process.frame)
+        frame_data = None
+        for result in self.pose_pool.collect():
+            # Workers only run OpenPose and the encoder, a single tracker keeps identities consistent
+            if result.rendered:
+                from .tracking import data_to_detections
+                self.pool_tracker.predict()
+                self.pool_tracker.update(result.frame, data_to_detections(result.detections_data))
+            self.fps_counter.update(1)
+            frame_data = FrameData(list(self.pool_tracker.tracks), result.keypoints, result.frame)
+            frame_data.processed = result.rendered
+        return frame_data
+
+    def stop(self):
+        with self.op_lock:
+            if self.pose_pool is not None:
+                self.pose_pool.stop()
+                self.pose_pool = None
+            if self.input is not None:
+                from .Input import stop_shared_encoders
+                stop_shared_encoders()
+
+    def get_metrics(self):
+        metrics = {'type': self.processing_type, 'fps': self.fps_counter.fps, 'avg_time': self.avg_processing_time,
+                   'to_process': self.frames_to_process.get_stats(), 'processed': self.frames_processed.get_stats()}
+        if self.pose_pool is not None:
+            metrics['pool'] = self.pose_pool.get_metrics()
+        if self.motion_gate.enabled:
+            metrics['motion_gate'] = self.motion_gate.get_metrics()
+        if self.input is not None:
+            metrics['resolution'] = self.resolution_controller.get_metrics()
+        if self.zone_cropper.enabled:
+            metrics['zone_crop'] = self.zone_cropper.get_metrics()
+        tracker = self.get_tracker()
+        if tracker is not None:
+            metrics['gallery'] = tracker.metric.get_stats()
+        return metrics
+
+    def get_tracker(self):
+        if self.pool_tracker is not None:
+            return self.pool_tracker
+        if self.input is not None:
+            return self.input.tracker
+        return None
+
     def simple_processing(self, frame):
         if frame is None:
             return None, None, None
@@ -119,64 +248,91 @@ class ProcessingManager(SwarmComponentMeta):
     def get_processed_frame(self, camera_frame, return_last=True):
         if camera_frame is not None:
             # camera_frame = camera_frame.copy()
+            frame_data = FrameData.from_camera_frame(camera_frame)
             if self.multi_threaded:
-                if len(self.frames_to_process) < self.buffer_size:
-                    self.frames_to_process.append(FrameData(frame=camera_frame))
-                if len(self.frames_processed) > 0:
-                    self.processed_frame_data = self.frames_processed.popleft()
+                if not self.frames_to_process.insert_data(frame_data):
+                    frame_data.release_slot()
+                processed = self.frames_processed.pop_data()
+                if processed is not None:
+                    self.processed_frame_data = processed
                     return self.processed_frame_data.frame
             else:
-                self.processed_frame_data = self.process_frame(FrameData(frame=camera_frame))
-                return self.processed_frame_data.frame
+                processed = self.process_frame(frame_data)
+                if processed is not None:
+                    self.processed_frame_data = processed
+                    return self.processed_frame_data.frame
         if return_last:
             return None if self.processed_frame_data is None else self.processed_frame_data.frame
         return None
 
 
-    def update(self, debug=False, surfaces=None):
+    def update(self, debug=False, surfaces=None, frame_data=None):
         if debug:
             print(f"Updating Openpose Manager")
+        frame_data = self.processed_frame_data if frame_data is None else frame_data
         # Reset graphs to get new points
 
         for camera in self.cameras:
             camera.p_graph.init_graph()
 
-        if self.processed_frame_data is None or self.processed_frame_data.tracks is None:
+        if frame_data is None or frame_data.tracks is None:
             return
 
-        for track in self.processed_frame_data.tracks:
-            color = (255, 255, 255)
-            if not track.is_confirmed():
-                color = (0, 0, 255)
-            bbox = track.to_tlbr()
-            p1 = Point(int(bbox[0]), int(bbox[1]))
-            p2 = Point(int(bbox[2]), int(bbox[3]))
-            min_p = Point(min(p1.x, p2.x), min(p1.y, p2.y))
-            chest_offset = Point(0, 0)
-            # ((x1+x2)/2, (y1+y2)/2).
-            center_x, center_y = (min_p.x + ((p2.x-p1.x)/2) + chest_offset.x,min_p.y + ((p2.y-p1.y)/2) + chest_offset.y)
-            center_p = Point(center_x, center_y)
-            color = (0, 255, 0)
-            thickness = 1
+        for track in frame_data.tracks:
             if track.is_confirmed():
-                for pair in self.input.POSE_PAIRS:
-                    idFrom = self.input.BODY_PARTS[pair[0]]
-                    idTo = self.input.BODY_PARTS[pair[1]]
-                    points = track.last_seen_detection.pose
-                    if points[idFrom] is not None and points[idTo] is not None:
-                        kp1 = points[idFrom]
-                        kp2 = points[idTo]
-                        p1 = Point(kp1[0], kp1[1])
-                        p2 = Point(kp2[0], kp2[1])
-                        if p1.x > 1 and p1.y > 1 and p2.x > 1 and p2.y > 1:
-                            self.ui_drawer.draw_line(p1, p2, color, thickness, surfaces)
-
-            for camera in self.cameras:
-                # camera.check_track([p1,p2], center_p)
-                camera.check_track([center_p], center_p)
-            if debug:
+                self.draw_track_pose(track, surfaces)
+
+        # Chest position at the center of the bbox: ((x1+x2)/2, (y1+y2)/2)
+        tlbr = np.array([track.to_tlbr() for track in frame_data.tracks], dtype=np.float64).reshape(-1, 4).astype(int)
+        centers = np.minimum(tlbr[:, :2], tlbr[:, 2:]) + (tlbr[:, 2:] - tlbr[:, :2]) / 2
+        if debug:
+            for center_x, center_y in centers:
                 print(f"Center: ({center_x:.2f}, {center_y:.2f})")
 
+        if self.cameras_manager is not None:
+            self.cameras_manager.add_tracks(centers)
+
+    def draw_tracks(self, frame_data, surfaces=None):
+        if frame_data is None or frame_data.tracks is None:
+            return
+        for track in frame_data.tracks:
+            if track.is_confirmed():
+                self.draw_track_pose(track, surfaces)
+
+    def draw_track_pose(self, track, surfaces=None, color=(0, 255, 0), thickness=1):
+        from .tracking import BODY_PARTS, POSE_PAIRS
+        for pair in POSE_PAIRS:
+            idFrom = BODY_PARTS[pair[0]]
+            idTo = BODY_PARTS[pair[1]]
+            points = track.last_seen_detection.pose
+            if points[idFrom] is not None and points[idTo] is not None:
+                kp1 = points[idFrom]
+                kp2 = points[idTo]
+                p1 = Point(kp1[0], kp1[1])
+                p2 = Point(kp2[0], kp2[1])
+                if p1.x > 1 and p1.y > 1 and p2.x > 1 and p2.y > 1:
+                    self.ui_drawer.draw_line(p1, p2, color, thickness, surfaces)
+
     def draw(self, text_pos, debug=False, surfaces=None):
-        text_pos = self.ui_drawer.add_text_line(f"{self.tag} - Time: {self.avg_processing_time:.3f} FPS: {self.fps_counter.fps}, To process: {len(self.frames_to_process)}, Processed: {len(self.frames_processed)}", (255, 255, 0), text_pos, surfaces)
+        text_pos = self.ui_drawer.add_text_line(f"{self.tag} - Time: {self.avg_processing_time:.3f} FPS: {self.fps_counter.fps}, To process: {self.frames_to_process.count()} ({self.frames_to_process.dropped} dropped), Processed: {self.frames_processed.count()} ({self.frames_processed.dropped} dropped)", (255, 255, 0), text_pos, surfaces)
         text_pos.y -= self.ui_drawer.line_height
+        if self.multi_threaded:
+            text_pos = self.ui_drawer.add_text_line(f"  Processing wait: {self.frames_to_process.get_waits.summary()}", (255, 255, 0), text_pos, surfaces)
+        tracker = self.get_tracker()
+        if tracker is not None:
+            g = tracker.metric.get_stats()
+            text_pos = self.ui_drawer.add_text_line(f"  Gallery - Tracks: {g['targets']}, Samples: {g['samples']}, Memory: {g['bytes'] / 1048576:.1f} MB ({g['eviction']})", (255, 255, 0), text_pos, surfaces)
+        if self.input is not None:
+            m = self.resolution_controller.get_metrics()
+            text_pos = self.ui_drawer.add_text_line(f"  Net resolution: {m['net_resolution']} (target {m['target_fps']} FPS, avg {m['avg_time']:.3f}s), Switches: {m['switches']} {m['last_switch']}", (255, 255, 0), text_pos, surfaces)
+        if self.zone_cropper.enabled:
+            m = self.zone_cropper.get_metrics()
+            text_pos = self.ui_drawer.add_text_line(f"  Zone crop - Tiles: {m['tiles']}, Pixels processed: {m['pixel_ratio']:.0%}", (255, 255, 0), text_pos, surfaces)
+        if self.motion_gate.enabled:
+            m = self.motion_gate.get_metrics()
+            text_pos = self.ui_drawer.add_text_line(f"  Motion gate - Inferred: {m['inferred']}, Skipped: {m['skipped']} ({m['skip_rate']:.0%}), Motion: {m['motion']:.4f}", (255, 255, 0), text_pos, surfaces)
+        if self.pose_pool is not None:
+            m = self.pose_pool.get_metrics()
+            text_pos = self.ui_drawer.add_text_line(f"  Pool - In flight: {m['in_flight']}, Reorder: {m['reorder_buffer']}, Dropped: {m['dropped']}, Skipped: {m['skipped']}", (255, 255, 0), text_pos, surfaces)
+            for w in m['workers']:
+                text_pos = self.ui_drawer.add_text_line(f"  Worker {w['worker']} - Ready: {w['ready']} Queue: {w['queue']} Latency: {w['latency']:.3f} Avg: {w['avg_latency']:.3f} Errors: {w['errors']}", (255, 255, 0), text_pos, surfaces)
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def resolution_height(net_resolution):
+    # "-1x320" -> 320, the width follows the frame aspect ratio so the cost goes with the height squared
+    return int(str(net_resolution).lower().split("x")[-1])
+
+
+class ResolutionController:
+    # Picks the OpenPose net_resolution that keeps the pose inference within the target frame rate.
+    # Lower resolutions are only used while people still get enough keypoints, switches need the
+    # inference time to leave a band around the budget and at least min_frames frames at the current one
+    def __init__(self, app_logger=None):
+        self.app_logger = app_logger
+        self.resolutions = ["-1x320"]
+        self.target_fps = 15
+        self.hysteresis = 0.2
+        self.min_frames = 30
+        self.min_keypoints = 10
+        self.preload = False
+        self.index = 0
+        self.frames = 0
+        self.avg_time = 0
+        self.avg_keypoints = None
+        self.switches = 0
+        self.last_switch = ""
+
+    @property
+    def current(self):
+        return self.resolutions[self.index]
+
+    def update_config_data(self, data):
+        current = self.current
+        resolutions = data.get("net_resolutions", self.resolutions)
+        self.resolutions = sorted(dict.fromkeys(resolutions), key=resolution_height)
+        self.target_fps = data.get("target_fps", self.target_fps)
+        self.hysteresis = data.get("resolution_hysteresis", self.hysteresis)
+        self.min_frames = data.get("resolution_min_frames", self.min_frames)
+        self.min_keypoints = data.get("min_keypoints", self.min_keypoints)
+        self.preload = data.get("preload_resolutions", self.preload)
+        # Keep the current resolution if still allowed, otherwise start from the best one
+        self.index = self.resolutions.index(current) if current in self.resolutions else len(self.resolutions) - 1
+
+    def reset(self):
+        self.frames = 0
+        self.avg_time = 0
+
+    def update(self, inference_time, keypoints=None):
+        # Called after every inference with the OpenPose time alone, returns the new resolution when it should change
+        self.frames += 1
+        self.avg_time = inference_time if self.frames <= 1 else self.avg_time * 0.9 + inference_time * 0.1
+        keypoints = np.asarray(keypoints if keypoints is not None else [])
+        if keypoints.ndim == 3 and len(keypoints) > 0:
+            visible = float(np.count_nonzero(keypoints[:, :, 2] > 0.05)) / len(keypoints)
+            self.avg_keypoints = visible if self.avg_keypoints is None else self.avg_keypoints * 0.9 + visible * 0.1
+        if len(self.resolutions) < 2 or self.frames < self.min_frames:
+            return None
+
+        budget = 1. / self.target_fps
+        enough_keypoints = self.avg_keypoints is None or self.avg_keypoints >= self.min_keypoints
+        if self.index > 0 and self.avg_time > budget * (1 + self.hysteresis) and enough_keypoints:
+            return self.switch(self.index - 1, f"{self.avg_time:.3f}s over the {budget:.3f}s budget")
+        if self.index < len(self.resolutions) - 1:
+            scale = (resolution_height(self.resolutions[self.index + 1]) / resolution_height(self.current)) ** 2
+            expected = self.avg_time * scale
+            if expected < budget * (1 - self.hysteresis):
+                return self.switch(self.index + 1, f"{expected:.3f}s expected within the {budget:.3f}s budget")
+            if not enough_keypoints and expected <= budget:
+                return self.switch(self.index + 1, f"{self.avg_keypoints:.1f} keypoints per person")
+        return None
+
+    def switch(self, index, reason):
+        previous = self.current
+        self.index = index
+        self.switches += 1
+        self.last_switch = f"{previous} -> {self.current}: {reason}"
+        if self.app_logger is not None:
+            self.app_logger.info(f"OpenPose net_resolution {self.last_switch}")
+        self.reset()
+        return self.current
+
+    def get_metrics(self):
+        return {'net_resolution': self.current, 'target_fps': self.target_fps, 'avg_time': self.avg_time,
+                'avg_keypoints': self.avg_keypoints, 'switches': self.switches, 'last_switch': self.last_switch}
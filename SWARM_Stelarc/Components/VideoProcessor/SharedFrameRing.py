@@ -0,0 +1,183 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+# Slot states. The writer only moves slots FREE -> WRITING -> READY and the reader only moves them
+# READY -> READING -> FREE (or READY -> FREE when skipping stale frames), so no transition is ever
+# shared between the two sides and the ring needs no lock, even across processes.
+SLOT_FREE = 0
+SLOT_WRITING = 1
+SLOT_READY = 2
+SLOT_READING = 3
+
+# Header fields, each one is only ever written by one side
+WRITE_SEQ = 0
+WRITE_DROPPED = 1
+READ_SEQ = 2
+READ_DROPPED = 3
+HEADER_SIZE = 4
+
+
+class FrameSlot:
+    def __init__(self, ring, index, seq):
+        self.ring = ring
+        self.index = index
+        self.seq = seq
+        self.frame = ring.frames[index]
+
+    def is_valid(self):
+        return self.ring.slot_seq[self.index] == self.seq
+
+    def release(self):
+        self.ring.release(self)
+
+    def __repr__(self):
+        return f"FrameSlot({self.index}, seq={self.seq})"
+
+
+class SharedFrameRing:
+    def __init__(self, shape, n_slots=4, dtype=np.uint8, name=None, create=True):
+        self.shape = tuple(shape)
+        self.n_slots = n_slots
+        self.dtype = np.dtype(dtype)
+        self.created = create
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        header_bytes = 8 * (HEADER_SIZE + 2 * n_slots)
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=header_bytes + n_slots * self.frame_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray((HEADER_SIZE + 2 * n_slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.slot_seq = self.header[HEADER_SIZE:HEADER_SIZE + n_slots]
+        self.slot_state = self.header[HEADER_SIZE + n_slots:]
+        self.frames = np.ndarray((n_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=header_bytes)
+        self.last_read_seq = -1
+        # Wake a writer waiting for a free slot and a reader waiting for a frame. Only the changes made in this
+        # process notify them, the ones made by another process are noticed when the wait times out
+        self.slot_freed = threading.Condition()
+        self.frame_ready = threading.Condition()
+        if create:
+            self.header[:] = 0
+            self.slot_seq[:] = -1
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec['shape'], spec['n_slots'], spec['dtype'], name=spec['name'], create=False)
+
+    def get_spec(self):
+        return {'name': self.name, 'shape': self.shape, 'n_slots': self.n_slots, 'dtype': self.dtype.str}
+
+    # Writer side
+    def begin_write(self):
+        seq = int(self.header[WRITE_SEQ])
+        for i in range(self.n_slots):
+            index = (seq + i) % self.n_slots
+            if self.slot_state[index] == SLOT_FREE:
+                self.slot_state[index] = SLOT_WRITING
+                return FrameSlot(self, index, seq)
+        self.header[WRITE_DROPPED] += 1
+        return None
+
+    def commit(self, slot):
+        self.slot_seq[slot.index] = slot.seq
+        self.slot_state[slot.index] = SLOT_READY
+        self.header[WRITE_SEQ] = slot.seq + 1
+        with self.frame_ready:
+            self.frame_ready.notify_all()
+
+    def abort(self, slot):
+        self.slot_state[slot.index] = SLOT_FREE
+        self.notify_freed()
+
+    def has_free_slot(self):
+        return self.slot_state is not None and bool(np.any(self.slot_state == SLOT_FREE))
+
+    def wait_free(self, timeout=None):
+        # Returns False if no slot was freed within the timeout
+        with self.slot_freed:
+            return self.slot_freed.wait_for(self.has_free_slot, timeout)
+
+    def notify_freed(self):
+        with self.slot_freed:
+            self.slot_freed.notify_all()
+
+    def write(self, frame):
+        slot = self.begin_write()
+        if slot is None:
+            return None
+        if frame.shape != self.shape:
+            import cv2
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=slot.frame)
+        else:
+            np.copyto(slot.frame, frame)
+        self.commit(slot)
+        return slot.seq
+
+    # Reader side
+    def _ready_slots(self):
+        ready = np.flatnonzero(self.slot_state == SLOT_READY)
+        if len(ready) <= 0:
+            return ready, ready
+        return ready, self.slot_seq[ready]
+
+    def _acquire(self, index):
+        self.slot_state[index] = SLOT_READING
+        seq = int(self.slot_seq[index])
+        self.last_read_seq = seq
+        self.header[READ_SEQ] = seq
+        return FrameSlot(self, index, seq)
+
+    def acquire_next(self):
+        ready, seqs = self._ready_slots()
+        if len(ready) <= 0:
+            return None
+        return self._acquire(ready[np.argmin(seqs)])
+
+    def acquire_latest(self):
+        ready, seqs = self._ready_slots()
+        if len(ready) <= 0:
+            return None
+        latest = np.argmax(seqs)
+        stale = np.delete(ready, latest)
+        if len(stale) > 0:
+            self.slot_state[stale] = SLOT_FREE
+            self.header[READ_DROPPED] += len(stale)
+            self.notify_freed()
+        return self._acquire(ready[latest])
+
+    def release(self, slot):
+        if self.slot_state[slot.index] == SLOT_READING and self.slot_seq[slot.index] == slot.seq:
+            self.slot_state[slot.index] = SLOT_FREE
+            self.notify_freed()
+
+    def has_ready_slot(self):
+        return self.slot_state is not None and bool(np.any(self.slot_state == SLOT_READY))
+
+    def wait_ready(self, timeout=None):
+        # Returns False if no frame was committed within the timeout
+        with self.frame_ready:
+            return self.frame_ready.wait_for(self.has_ready_slot, timeout)
+
+    def pending(self):
+        return int(np.count_nonzero(self.slot_state == SLOT_READY))
+
+    def get_stats(self):
+        return {'written': int(self.header[WRITE_SEQ]), 'read': int(self.header[READ_SEQ]),
+                'write_dropped': int(self.header[WRITE_DROPPED]), 'read_dropped': int(self.header[READ_DROPPED]),
+                'pending': self.pending(), 'slots': self.n_slots}
+
+    def close(self):
+        self.header = None
+        self.slot_seq = None
+        self.slot_state = None
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError as e:
+            print(f"Shared frame ring {self.name} still has frames in use: {e}")
+        if self.created:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
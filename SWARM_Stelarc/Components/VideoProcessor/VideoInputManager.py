@@ -1,13 +1,14 @@
 from ..Utils.FPSCounter import FPSCounter
+from ..Utils.DataQueue import DataQueue
 from ..SwarmComponentMeta import SwarmComponentMeta
 from sys import platform
 import time
-from collections import deque
 import threading
 import numpy as np
 import io
 import base64
 from PIL import Image
+from .SharedFrameRing import SharedFrameRing
 
 class VideoInputManager(SwarmComponentMeta):
     def __init__(self, logging, ui_drawer, tasks_manager, screen_w=500, screen_h=500):
@@ -22,13 +23,16 @@ class VideoInputManager(SwarmComponentMeta):
         self.max_capture_index = 10
         self.buffer_size = 2
         self.latest_frame = None
-        self.frame_buffer = deque([])
+        self.frame_buffer = DataQueue(self.buffer_size)
         self.frame_shape = None
         self.frame_size = (0,0)
         self.fps_counter = FPSCounter()
         self.multi_threaded = False
-        self.background_task = self.tasks_manager.add_task("VI", None, self.capture_loop, None)
-        self.buffer_lock = self.background_task.read_lock
+        self.use_shared_memory = False
+        self.ring_slots = 6
+        self.frame_ring = None
+        self.ring_created = threading.Event()
+        self.background_task = self.tasks_manager.add_task("VI", None, self.capture_loop, self.close_ring)
 
         self.stream_input = False
 
@@ -48,13 +52,18 @@ class VideoInputManager(SwarmComponentMeta):
         if self.stream_input:
             time.sleep(0.01)
             return True
-        if len(self.frame_buffer) >= self.buffer_size:
+        if self.use_shared_memory:
+            # Sleep until the reader frees a slot, same as the buffer below
+            if self.frame_ring is not None and not self.frame_ring.wait_free(timeout=0.1):
+                return True
+            self.capture_to_ring()
+            return True
+        # Sleep until the consumer takes a frame instead of spinning on a full buffer, the timeout lets a stop through
+        if not self.frame_buffer.wait_not_full(timeout=0.1):
             return True
         frame = self.capture_frame()
         if frame is not None:
-            with self.buffer_lock:
-                self.frame_buffer.append(frame)
-        time.sleep(0)
+            self.frame_buffer.insert_data(frame)
         return True
 
     def capture_frame(self):
@@ -66,6 +75,40 @@ class VideoInputManager(SwarmComponentMeta):
         self.fps_counter.update(new_frames=1)
         self.cv2.waitKey(1)
         return frame
+
+    def capture_to_ring(self):
+        if self.cap is None:
+            self.setup_capture()
+            return None
+        if self.frame_ring is None:
+            self.frame_ring = SharedFrameRing((self.frame_size[1], self.frame_size[0], 3), self.ring_slots)
+            self.app_logger.info(f"Capturing into shared memory ring {self.frame_ring.name}, {self.ring_slots} slots of {self.frame_ring.shape}")
+            self.ring_created.set()
+        slot = self.frame_ring.begin_write()
+        if slot is None:
+            # Every slot is still waiting to be read, drop this frame
+            self.cap.grab()
+            return None
+        # Decode straight into the shared slot, OpenCV only allocates when the sizes don't match
+        grabbed, frame = self.cap.read(slot.frame)
+        if not grabbed or frame is None:
+            self.frame_ring.abort(slot)
+            return None
+        if frame.ctypes.data != slot.frame.ctypes.data:
+            if frame.shape == slot.frame.shape:
+                np.copyto(slot.frame, frame)
+            else:
+                self.cv2.resize(frame, (self.frame_ring.shape[1], self.frame_ring.shape[0]), dst=slot.frame)
+        self.frame_ring.commit(slot)
+        self.frame_shape = self.frame_ring.shape
+        self.fps_counter.update(new_frames=1)
+        return slot
+
+    def close_ring(self):
+        self.ring_created.clear()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring = None
         
     def setup_capture(self, tasks_manager=None, async_loop=None):
         while True:
@@ -103,28 +146,50 @@ class VideoInputManager(SwarmComponentMeta):
     def update_config_data(self, data, last_modified_time):
       pass
   
-    def get_frame(self):
+    def get_frame_slot(self, timeout=0):
+        # Zero-copy access to the shared ring, the caller must release the slot once done with it.
+        # With the capture thread running, waits up to timeout for a new frame
+        if not self.multi_threaded:
+            self.capture_to_ring()
+        elif timeout > 0 and self.ring_created.wait(timeout):
+            frame_ring = self.frame_ring
+            if frame_ring is not None:
+                frame_ring.wait_ready(timeout)
+        if self.frame_ring is None:
+            return None
+        return self.frame_ring.acquire_latest()
+
+    def get_frame(self, return_last=True, timeout=0):
+        if self.use_shared_memory:
+            slot = self.get_frame_slot(timeout)
+            if slot is not None:
+                self.latest_frame = slot.frame.copy()
+                slot.release()
+            elif not return_last:
+                return None
+            return self.latest_frame
         if self.multi_threaded:
-            if len(self.frame_buffer) <= 0:
+            frame = self.frame_buffer.pop_data(timeout=timeout)
+            if frame is None:
                 return None
-            with self.buffer_lock:
-                self.latest_frame = self.frame_buffer.popleft()
+            self.latest_frame = frame
         else:
             if not self.stream_input:
                 frame = self.capture_frame()
                 if frame is not None:
                     self.latest_frame = frame
+                elif not return_last:
+                    return None
         return self.latest_frame
 
     def add_stream_frame(self, frame_data):
         if frame_data is not None:
             self.stream_input = True
-            if len(self.frame_buffer) >= self.buffer_size:
+            if self.frame_buffer.is_full():
                 return True
 
             frame = self.base64_to_cv2(frame_data['image_data'])
-            with self.buffer_lock:
-                self.frame_buffer.append(frame)
+            self.frame_buffer.insert_data(frame)
     
     def update(self, debug=False):
         if debug:
@@ -133,5 +198,10 @@ class VideoInputManager(SwarmComponentMeta):
     def draw(self, left_text_pos, debug=False, surfaces=None):
         if debug:
             print(f"Drawing VideoInput Manager")
-        left_text_pos = self.ui_drawer.add_text_line(f"VI - FPS: {self.fps_counter.fps }, Frame Buffer: {len(self.frame_buffer)}, Size: {self.frame_shape}", (255, 255, 0), left_text_pos, surfaces)
+        if self.frame_ring is not None:
+            ring_stats = self.frame_ring.get_stats()
+            buffer_str = f"Ring: {ring_stats['pending']}/{ring_stats['slots']}, Dropped: {ring_stats['write_dropped']}/{ring_stats['read_dropped']}"
+        else:
+            buffer_str = f"Frame Buffer: {self.frame_buffer.count()}/{self.frame_buffer.size()}, Dropped: {self.frame_buffer.dropped}, Capture wait: {self.frame_buffer.put_waits.summary()}"
+        left_text_pos = self.ui_drawer.add_text_line(f"VI - FPS: {self.fps_counter.fps }, {buffer_str}, Size: {self.frame_shape}", (255, 255, 0), left_text_pos, surfaces)
         left_text_pos.y -= self.ui_drawer.line_height
\ No newline at end of file
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class CropLayout:
+    # Where every zone rectangle of the frame (src, [x0, y0, x1, y1]) is placed in the mosaic (dst, [x, y])
+    def __init__(self, src, dst, shape):
+        self.src = src
+        self.dst = dst
+        self.shape = shape
+
+    @property
+    def n_tiles(self):
+        return len(self.src)
+
+
+class ZoneCropper:
+    # Pose inference only needs the camera zones: their bounding rectangles (with a margin for the people
+    # standing on the border) are packed in a mosaic, keypoints are mapped back to frame coordinates after
+    def __init__(self):
+        self.enabled = False
+        self.margin = 40
+        self.mosaic = True
+        self.gap = 16
+        self.layout = None
+        self.layout_key = None
+        self.pixel_ratio = 1.
+
+    def update_config_data(self, data):
+        self.enabled = data.get("zone_crop", self.enabled)
+        self.margin = data.get("zone_crop_margin", self.margin)
+        self.mosaic = data.get("zone_crop_mosaic", self.mosaic)
+
+    def get_rects(self, cameras, frame_w, frame_h):
+        rects = []
+        for camera in cameras:
+            if not camera.enabled or len(camera.path_points) <= 0:
+                continue
+            x0 = max(0, int(np.floor(camera.min_point.x)) - self.margin)
+            y0 = max(0, int(np.floor(camera.min_point.y)) - self.margin)
+            x1 = min(frame_w, int(np.ceil(camera.max_point.x)) + self.margin + 1)
+            y1 = min(frame_h, int(np.ceil(camera.max_point.y)) + self.margin + 1)
+            if x1 > x0 and y1 > y0:
+                rects.append([x0, y0, x1, y1])
+        if len(rects) > 0 and not self.mosaic:
+            rects = np.array(rects)
+            return [[rects[:, 0].min(), rects[:, 1].min(), rects[:, 2].max(), rects[:, 3].max()]]
+        # Overlapping rectangles are merged, a person could otherwise be split between two tiles
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return rects
+
+    def pack(self, rects):
+        # Tiles side by side or stacked, whichever makes the smaller mosaic
+        rects = np.array(rects, dtype=np.int64).reshape(-1, 4)
+        sizes = rects[:, 2:] - rects[:, :2]
+        steps = np.vstack(([[0, 0]], np.cumsum(sizes[:-1] + self.gap, axis=0)))
+        gaps = self.gap * (len(rects) - 1)
+        row_w, row_h = sizes[:, 0].sum() + gaps, sizes[:, 1].max()
+        column_w, column_h = sizes[:, 0].max(), sizes[:, 1].sum() + gaps
+        dst = np.zeros((len(rects), 2), dtype=np.int64)
+        if row_w * row_h <= column_w * column_h:
+            dst[:, 0] = steps[:, 0]
+            return CropLayout(rects, dst, (int(row_h), int(row_w)))
+        dst[:, 1] = steps[:, 1]
+        return CropLayout(rects, dst, (int(column_h), int(column_w)))
+
+    def get_layout(self, frame_shape, cameras, zones_version=0):
+        # Only rebuilt when the zones or the frame size change, None means the whole frame is processed
+        frame_h, frame_w = frame_shape[:2]
+        key = (frame_h, frame_w, zones_version, len(cameras), self.margin, self.mosaic)
+        if key != self.layout_key:
+            self.layout_key = key
+            self.layout = None
+            self.pixel_ratio = 1.
+            rects = self.get_rects(cameras, frame_w, frame_h)
+            if len(rects) > 0:
+                layout = self.pack(rects)
+                pixel_ratio = layout.shape[0] * layout.shape[1] / float(frame_w * frame_h)
+                if pixel_ratio < 1:
+                    self.layout = layout
+                    self.pixel_ratio = pixel_ratio
+        return self.layout
+
+    def crop(self, frame, layout):
+        if layout.n_tiles == 1:
+            x0, y0, x1, y1 = layout.src[0]
+            return np.ascontiguousarray(frame[y0:y1, x0:x1])
+        mosaic = np.zeros(tuple(layout.shape) + frame.shape[2:], dtype=frame.dtype)
+        for (x0, y0, x1, y1), (dx, dy) in zip(layout.src, layout.dst):
+            mosaic[dy:dy + y1 - y0, dx:dx + x1 - x0] = frame[y0:y1, x0:x1]
+        return mosaic
+
+    def map_keypoints(self, keypoints, layout):
+        # Every person is moved with the tile its seen keypoints are centered in, unseen (0, 0) keypoints stay 0
+        keypoints = np.asarray(keypoints)
+        if keypoints.ndim != 3 or len(keypoints) <= 0:
+            return keypoints
+        keypoints = keypoints.copy()
+        seen = (keypoints[:, :, 0] != 0) | (keypoints[:, :, 1] != 0)
+        n_seen = np.maximum(np.count_nonzero(seen, axis=1), 1)
+        centers = np.sum(keypoints[:, :, :2], axis=1, where=seen[:, :, None]) / n_seen[:, None]
+        sizes = layout.src[:, 2:] - layout.src[:, :2]
+        inside = np.all((centers[:, None, :] >= layout.dst[None, :, :]) &
+                        (centers[:, None, :] < layout.dst[None, :, :] + sizes[None, :, :]), axis=2)
+        # Centers falling in a gap go with the closest tile
+        distance = np.abs(centers[:, None, :] - (layout.dst + sizes / 2)[None, :, :]).sum(axis=2)
+        tiles = np.where(inside.any(axis=1), inside.argmax(axis=1), distance.argmin(axis=1))
+        offsets = (layout.src[:, :2] - layout.dst)[tiles]
+        keypoints[:, :, :2] += np.where(seen[:, :, None], offsets[:, None, :], 0).astype(keypoints.dtype)
+        return keypoints
+
+    def paste(self, frame, rendered, layout):
+        # The rendered tiles over a copy of the full frame
+        out = frame.copy()
+        for (x0, y0, x1, y1), (dx, dy) in zip(layout.src, layout.dst):
+            out[y0:y1, x0:x1] = rendered[dy:dy + y1 - y0, dx:dx + x1 - x0]
+        return out
+
+    def get_metrics(self):
+        return {'enabled': self.enabled, 'tiles': 0 if self.layout is None else self.layout.n_tiles,
+                'pixel_ratio': self.pixel_ratio}
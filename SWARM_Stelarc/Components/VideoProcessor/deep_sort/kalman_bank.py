@@ -0,0 +1,170 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+"""
+Covariance profiles of the filter bank.
+
+* FIXED_PROFILE: constant transition and observation noise. Equivalent to the
+  pykalman based `my_filter.MyKalmanFilter` used so far, including its extra
+  prediction step in `update` and the noise free projection used for gating.
+* ADAPTIVE_PROFILE: noise relative to the bounding box height, as in
+  `kalman_filter.KalmanFilter` (original deep_sort).
+"""
+FIXED_PROFILE = "fixed"
+ADAPTIVE_PROFILE = "adaptive"
+
+
+class KalmanFilterBank(object):
+    """
+    A Kalman filter that works on the state of many tracks at once.
+
+    Means and covariances are stacked in (N, 8) and (N, 8, 8) arrays so that
+    predict, update and gating run for every track in one vectorized pass.
+    The single track methods have the same signature as
+    `kalman_filter.KalmanFilter` and can be used as a drop-in replacement.
+
+    Parameters
+    ----------
+    profile : str
+        Either `FIXED_PROFILE` or `ADAPTIVE_PROFILE`.
+    transition_covariance : Optional[ndarray]
+        8x8 transition noise of the fixed profile.
+    observation_covariance : Optional[ndarray]
+        4x4 observation noise of the fixed profile.
+
+    """
+    def __init__(self, profile=FIXED_PROFILE, transition_covariance=None,
+                 observation_covariance=None):
+        if profile not in (FIXED_PROFILE, ADAPTIVE_PROFILE):
+            raise ValueError("Unknown Kalman filter profile '%s'" % profile)
+        self.profile = profile
+        ndim, dt = 4, 1.
+
+        self._motion_mat = np.eye(2 * ndim, 2 * ndim)
+        for i in range(ndim):
+            self._motion_mat[i, ndim + i] = dt
+        self._update_mat = np.eye(ndim, 2 * ndim)
+
+        self._transition_cov = np.eye(2 * ndim) * 10 \
+            if transition_covariance is None else transition_covariance
+        self._observation_cov = np.eye(ndim) * 500 \
+            if observation_covariance is None else observation_covariance
+
+        self._std_weight_position = 1. / 20
+        self._std_weight_velocity = 1. / 160
+
+    def _diag(self, std):
+        # (N, k) standard deviations to (N, k, k) diagonal covariances
+        n, k = std.shape
+        cov = np.zeros((n, k, k))
+        cov[:, np.arange(k), np.arange(k)] = np.square(std)
+        return cov
+
+    def initiate_batch(self, measurements):
+        """Create the state of new tracks from unassociated (N, 4)
+        measurements in format (x, y, a, h)."""
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        means = np.hstack((measurements, np.zeros_like(measurements)))
+        if self.profile == FIXED_PROFILE:
+            covariances = np.tile(np.eye(8), (len(measurements), 1, 1))
+        else:
+            h = measurements[:, 3]
+            wp, wv = self._std_weight_position, self._std_weight_velocity
+            std = np.column_stack((
+                2 * wp * h, 2 * wp * h, np.full_like(h, 1e-2), 2 * wp * h,
+                10 * wv * h, 10 * wv * h, np.full_like(h, 1e-5), 10 * wv * h))
+            covariances = self._diag(std)
+        return means, covariances
+
+    def _motion_cov(self, means):
+        if self.profile == FIXED_PROFILE:
+            return self._transition_cov
+        h = means[:, 3]
+        wp, wv = self._std_weight_position, self._std_weight_velocity
+        std = np.column_stack((
+            wp * h, wp * h, np.full_like(h, 1e-2), wp * h,
+            wv * h, wv * h, np.full_like(h, 1e-5), wv * h))
+        return self._diag(std)
+
+    def _innovation_cov(self, means):
+        if self.profile == FIXED_PROFILE:
+            return self._observation_cov
+        h = means[:, 3]
+        wp = self._std_weight_position
+        std = np.column_stack((wp * h, wp * h, np.full_like(h, 1e-1), wp * h))
+        return self._diag(std)
+
+    def predict_batch(self, means, covariances):
+        """Run the prediction step on (N, 8) means and (N, 8, 8)
+        covariances."""
+        motion_cov = self._motion_cov(means)
+        means = means @ self._motion_mat.T
+        covariances = self._motion_mat @ covariances @ self._motion_mat.T + motion_cov
+        return means, covariances
+
+    def project_batch(self, means, covariances):
+        """Project the (N, 8) states to (N, 4) measurement space. The fixed
+        profile doesn't add the observation noise, same as `MyKalmanFilter`."""
+        projected_cov = self._update_mat @ covariances @ self._update_mat.T
+        if self.profile == ADAPTIVE_PROFILE:
+            projected_cov = projected_cov + self._innovation_cov(means)
+        return means @ self._update_mat.T, projected_cov
+
+    def update_batch(self, means, covariances, measurements):
+        """Run the correction step of N states with their (N, 4)
+        measurements."""
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if self.profile == FIXED_PROFILE:
+            # pykalman's filter_update always predicts before correcting
+            means, covariances = self.predict_batch(means, covariances)
+        hp = self._update_mat @ covariances
+        innovation_cov = hp @ self._update_mat.T + self._innovation_cov(means)
+        kalman_gain = np.swapaxes(np.linalg.solve(innovation_cov, hp), 1, 2)
+        innovation = measurements - means @ self._update_mat.T
+        new_means = means + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariances = covariances - kalman_gain @ hp
+        return new_means, new_covariances
+
+    def gating_distance_batch(self, means, covariances, measurements,
+                              only_position=False):
+        """Squared Mahalanobis distance between N states and M measurements.
+
+        Returns
+        -------
+        ndarray
+            An NxM matrix, a suitable threshold can be obtained from
+            `chi2inv95`.
+
+        """
+        means, covariances = self.project_batch(means, covariances)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if only_position:
+            means, covariances = means[:, :2], covariances[:, :2, :2]
+            measurements = measurements[:, :2]
+        cholesky_factor = np.linalg.cholesky(covariances)
+        d = measurements[None, :, :] - means[:, None, :]
+        z = np.linalg.solve(cholesky_factor, np.swapaxes(d, 1, 2))
+        return np.sum(z * z, axis=1)
+
+    # Single track interface, same as kalman_filter.KalmanFilter
+    def initiate(self, measurement):
+        means, covariances = self.initiate_batch(measurement)
+        return means[0], covariances[0]
+
+    def predict(self, mean, covariance):
+        means, covariances = self.predict_batch(mean[None], covariance[None])
+        return means[0], covariances[0]
+
+    def project(self, mean, covariance):
+        means, covariances = self.project_batch(mean[None], covariance[None])
+        return means[0], covariances[0]
+
+    def update(self, mean, covariance, measurement):
+        means, covariances = self.update_batch(mean[None], covariance[None], measurement)
+        return means[0], covariances[0]
+
+    def gating_distance(self, mean, covariance, measurements,
+                        only_position=False):
+        return self.gating_distance_batch(
+            mean[None], covariance[None], measurements, only_position)[0]
@@ -4,14 +4,30 @@ import numpy as np
 from sys import platform
 
 if platform == "win32":
-    from sklearn.utils.linear_assignment_ import linear_assignment
+    from sklearn.utils.linear_assignment_ import linear_assignment as _solver
 else:
-    from scipy.optimize import linear_sum_assignment as linear_assignment
+    from scipy.optimize import linear_sum_assignment as _solver
 from . import kalman_filter
 
 INFTY_COST = 1e+5
 
 
+def linear_assignment(cost_matrix):
+    """Solve the assignment problem of `cost_matrix`.
+
+    Returns
+    -------
+    ndarray
+        A Kx2 integer array of matched (row, col) pairs. sklearn already
+        returns this layout, scipy returns a tuple of row and col indices.
+
+    """
+    indices = _solver(cost_matrix)
+    if isinstance(indices, tuple):
+        indices = np.column_stack(indices)
+    return np.asarray(indices, dtype=np.int64).reshape(-1, 2)
+
+
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
         detection_indices=None):
@@ -60,22 +76,21 @@ def min_cost_matching(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
     indices = linear_assignment(cost_matrix)
-
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
-    for row, col in indices:
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    rows, cols = indices[:, 0], indices[:, 1]
+
+    # Pairs above the threshold are assigned but count as unmatched
+    accepted = cost_matrix[rows, cols] <= max_distance
+    track_matched = np.zeros(len(track_indices), dtype=bool)
+    detection_matched = np.zeros(len(detection_indices), dtype=bool)
+    track_matched[rows[accepted]] = True
+    detection_matched[cols[accepted]] = True
+
+    track_indices = np.asarray(track_indices)
+    detection_indices = np.asarray(detection_indices)
+    matches = list(zip(track_indices[rows[accepted]].tolist(),
+                       detection_indices[cols[accepted]].tolist()))
+    unmatched_tracks = track_indices[~track_matched].tolist()
+    unmatched_detections = detection_indices[~detection_matched].tolist()
     return matches, unmatched_tracks, unmatched_detections
 
 
@@ -91,7 +106,9 @@ def matching_cascade(
         a list of N track indices and M detection indices. The metric should
         return the NxM dimensional cost matrix, where element (i, j) is the
         association cost between the i-th track in the given track indices and
-        the j-th detection in the given detection indices.
+        the j-th detection in the given detection indices. It is called once
+        for all the cascade levels, so element (i, j) must not depend on the
+        other tracks and detections.
     max_distance : float
         Gating threshold. Associations with cost larger than this value are
         disregarded.
@@ -123,26 +140,46 @@ def matching_cascade(
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
+    track_indices = np.asarray(track_indices, dtype=np.int64)
+    detection_indices = np.asarray(detection_indices, dtype=np.int64)
     unmatched_detections = detection_indices
     matches = []
-    for level in range(cascade_depth):
-        if len(unmatched_detections) == 0:  # No detections left
-            break
-
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
-        if len(track_indices_l) == 0:  # Nothing to match at this level
-            continue
-
-        matches_l, _, unmatched_detections = \
-            min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
-                track_indices_l, unmatched_detections)
-        matches += matches_l
-    unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
-    return matches, unmatched_tracks, unmatched_detections
+    if len(track_indices) > 0:
+        # Bucket the tracks by age once, only the levels that have tracks
+        # are visited, youngest first
+        ages = np.array([tracks[k].time_since_update for k in track_indices])
+        in_cascade = (ages >= 1) & (ages <= cascade_depth)
+        order = np.argsort(ages[in_cascade], kind="stable")
+        levels, starts = np.unique(ages[in_cascade][order], return_index=True)
+        cascade_tracks = track_indices[in_cascade][order]
+        buckets = np.split(cascade_tracks, starts[1:])
+        if len(levels) > 0 and len(detection_indices) > 0:
+            # The metric is evaluated once for all the levels, each level
+            # only picks its rows and the detections still unmatched
+            cost_matrix = distance_metric(
+                tracks, detections, cascade_tracks, detection_indices)
+            rows = np.zeros(len(tracks), dtype=np.int64)
+            rows[cascade_tracks] = np.arange(len(cascade_tracks))
+            cols = np.zeros(len(detections), dtype=np.int64)
+            cols[detection_indices] = np.arange(len(detection_indices))
+
+            def level_metric(tracks, dets, track_indices_l, detection_indices_l):
+                return cost_matrix[np.ix_(rows[track_indices_l], cols[detection_indices_l])]
+
+            for track_indices_l in buckets[:len(levels)]:
+                if len(unmatched_detections) == 0:  # No detections left
+                    break
+                matches_l, _, unmatched_detections = \
+                    min_cost_matching(
+                        level_metric, max_distance, tracks, detections,
+                        track_indices_l, unmatched_detections)
+                matches += matches_l
+
+    track_matched = np.zeros(len(track_indices), dtype=bool)
+    if len(matches) > 0:
+        track_matched = np.isin(track_indices, [k for k, _ in matches])
+    unmatched_tracks = track_indices[~track_matched].tolist()
+    return matches, unmatched_tracks, list(unmatched_detections)
 
 
 def gate_cost_matrix(frame, kf, cost_matrix, tracks, detections, track_indices, detection_indices,
@@ -183,8 +220,18 @@ def gate_cost_matrix(frame, kf, cost_matrix, tracks, detections, track_indices,
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return cost_matrix
     measurements = np.asarray(
         [detections[i].to_xyah() for i in detection_indices])
+    if hasattr(kf, "gating_distance_batch"):
+        # All track/detection pairs in a single batched Mahalanobis pass
+        means = np.array([tracks[i].mean for i in track_indices])
+        covariances = np.array([tracks[i].covariance for i in track_indices])
+        gating_distance = kf.gating_distance_batch(
+            means, covariances, measurements, only_position)
+        cost_matrix[gating_distance > gating_threshold] = gated_cost
+        return cost_matrix
     for row, track_idx in enumerate(track_indices):
         track = tracks[track_idx]
         gating_distance = kf.gating_distance(
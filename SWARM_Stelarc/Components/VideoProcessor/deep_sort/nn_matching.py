@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import heapq
 import numpy as np
 
 
@@ -96,11 +97,24 @@ def _nn_cosine_distance(x, y):
     return distances.min(axis=0)
 
 
+FIFO_EVICTION = "fifo"
+RESERVOIR_EVICTION = "reservoir"
+CENTROID_EVICTION = "centroid"
+
+# Per target capacity used when no budget is given
+DEFAULT_BUDGET = 100
+
+
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
 
+    The samples are kept in a preallocated float32 ring per target, so memory
+    is bounded by the number of active targets times `budget`, and the cost
+    matrix of any set of targets comes from a single matrix product over the
+    rings followed by a masked minimum.
+
     Parameters
     ----------
     metric : str
@@ -109,18 +123,30 @@ class NearestNeighborDistanceMetric(object):
         The matching threshold. Samples with larger distance are considered an
         invalid match.
     budget : Optional[int]
-        If not None, fix samples per class to at most this number. Removes
-        the oldest samples when the budget is reached.
+        Number of samples kept per target. Defaults to `DEFAULT_BUDGET`.
+    eviction : Optional[str]
+        What happens to a sample added to a full ring:
+        * "fifo": it replaces the oldest sample.
+        * "reservoir": it replaces a random sample with probability
+          budget / samples seen, so the ring stays a uniform sample of the
+          whole track history.
+        * "centroid": the oldest sample is folded into a running centroid,
+          kept in the first slot, and replaced by the new one.
+    target_capacity : Optional[int]
+        Number of target rings allocated upfront, doubled when exceeded.
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    rings : ndarray
+        The (targets, budget, M) sample rings. With the cosine metric the
+        samples are stored normalized to unit length.
+    counts : ndarray
+        Number of valid samples of each ring.
 
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None,
+                 eviction=FIFO_EVICTION, target_capacity=32, seed=None):
 
 
         if metric == "euclidean":
@@ -130,9 +156,95 @@ class NearestNeighborDistanceMetric(object):
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        if eviction not in (FIFO_EVICTION, RESERVOIR_EVICTION, CENTROID_EVICTION):
+            raise ValueError(
+                "Invalid eviction; must be 'fifo', 'reservoir' or 'centroid'")
+        self.metric = metric
         self.matching_threshold = matching_threshold
-        self.budget = budget
-        self.samples = {}
+        self.budget = DEFAULT_BUDGET if budget is None else budget
+        self.eviction = eviction
+        self.target_capacity = target_capacity
+        self.rings = None
+        self.counts = np.zeros(target_capacity, dtype=np.int64)
+        self.seen = np.zeros(target_capacity, dtype=np.int64)
+        self.next_slot = np.zeros(target_capacity, dtype=np.int64)
+        self._centroids = None
+        self._target_slots = {}
+        self._free_slots = list(range(target_capacity))
+        self._rng = np.random.default_rng(seed)
+
+    def _allocate(self, feature_dim):
+        self.rings = np.zeros((self.target_capacity, self.budget, feature_dim), dtype=np.float32)
+        if self.eviction == CENTROID_EVICTION:
+            self._centroids = np.zeros((self.target_capacity, feature_dim), dtype=np.float64)
+
+    def _grow(self):
+        old = self.target_capacity
+        self.target_capacity *= 2
+        rings = np.zeros((self.target_capacity,) + self.rings.shape[1:], dtype=np.float32)
+        rings[:old] = self.rings
+        self.rings = rings
+        if self._centroids is not None:
+            centroids = np.zeros((self.target_capacity, self.rings.shape[2]), dtype=np.float64)
+            centroids[:old] = self._centroids
+            self._centroids = centroids
+        for name in ("counts", "seen", "next_slot"):
+            values = np.zeros(self.target_capacity, dtype=np.int64)
+            values[:old] = getattr(self, name)
+            setattr(self, name, values)
+        for slot in range(old, self.target_capacity):
+            heapq.heappush(self._free_slots, slot)
+
+    def _get_slot(self, target):
+        slot = self._target_slots.get(target, None)
+        if slot is None:
+            if len(self._free_slots) == 0:
+                self._grow()
+            slot = heapq.heappop(self._free_slots)
+            self._target_slots[target] = slot
+            self.counts[slot] = 0
+            self.seen[slot] = 0
+            self.next_slot[slot] = 0
+        return slot
+
+    def _release_slot(self, target):
+        slot = self._target_slots.pop(target)
+        self.counts[slot] = 0
+        heapq.heappush(self._free_slots, slot)
+
+    def _normalize(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        if self.metric != "cosine" or len(features) == 0:
+            return features
+        return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+    def _add_sample(self, slot, feature):
+        ring, count = self.rings[slot], self.counts[slot]
+        self.seen[slot] += 1
+        if count < self.budget:
+            ring[count] = feature
+            self.counts[slot] = count + 1
+            if self.eviction == CENTROID_EVICTION and count == 0:
+                self._centroids[slot] = feature
+            return
+        if self.eviction == FIFO_EVICTION:
+            ring[self.next_slot[slot]] = feature
+            self.next_slot[slot] = (self.next_slot[slot] + 1) % self.budget
+        elif self.eviction == RESERVOIR_EVICTION:
+            j = self._rng.integers(0, self.seen[slot])
+            if j < self.budget:
+                ring[j] = feature
+        else:
+            # Slot 0 holds the centroid of every evicted sample, the others are a FIFO
+            if self.budget > 1:
+                oldest = 1 + self.next_slot[slot]
+                self._centroids[slot] += ring[oldest]
+                ring[oldest] = feature
+                self.next_slot[slot] = (self.next_slot[slot] + 1) % (self.budget - 1)
+            else:
+                self._centroids[slot] += feature
+            centroid = self._centroids[slot] / (self.seen[slot] - self.budget + 1)
+            ring[0] = self._normalize(centroid[None])[0]
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,11 +259,32 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        features = self._normalize(features)
+        if len(features) > 0 and self.rings is None:
+            self._allocate(features.shape[1])
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            self._add_sample(self._get_slot(target), feature)
+        active_targets = set(active_targets)
+        for target in [t for t in self._target_slots if t not in active_targets]:
+            self._release_slot(target)
+
+    @property
+    def samples(self):
+        """Dict[int -> ndarray] with the samples currently kept for each
+        target."""
+        return {target: self.rings[slot, :self.counts[slot]]
+                for target, slot in self._target_slots.items()}
+
+    def get_stats(self):
+        """Number of targets and samples in the gallery and its memory use in
+        bytes."""
+        n_samples = int(sum(self.counts[slot] for slot in self._target_slots.values()))
+        n_bytes = 0 if self.rings is None else self.rings.nbytes
+        if self._centroids is not None:
+            n_bytes += self._centroids.nbytes
+        return {'targets': len(self._target_slots), 'samples': n_samples,
+                'budget': self.budget, 'eviction': self.eviction,
+                'target_capacity': self.target_capacity, 'bytes': n_bytes}
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -168,10 +301,25 @@ class NearestNeighborDistanceMetric(object):
         ndarray
             Returns a cost matrix of shape len(targets), len(features), where
             element (i, j) contains the closest squared distance between
-            `targets[i]` and `features[j]`.
+            `targets[i]` and `features[j]`. Targets without samples get an
+            infinite cost.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
+        cost_matrix = np.full((len(targets), len(features)), np.inf)
+        slots = np.array([self._target_slots.get(t, -1) for t in targets], dtype=np.int64)
+        known = slots >= 0
+        if len(features) == 0 or not np.any(known):
+            return cost_matrix
+        # Slots are reused lowest first, only the used part of the rings is multiplied
+        n_slots = int(slots.max()) + 1
+        samples = self.rings[:n_slots].reshape(-1, self.rings.shape[2])
+        queries = self._normalize(features)
+        if self.metric == "cosine":
+            distances = 1. - np.dot(samples, queries.T)
+        else:
+            distances = np.maximum(0.0, _pdist(samples, queries))
+        distances = distances.reshape(n_slots, self.budget, len(queries))
+        empty = np.arange(self.budget)[None, :] >= self.counts[:n_slots, None]
+        distances[empty] = np.inf
+        cost_matrix[known] = distances.min(axis=1)[slots[known]]
         return cost_matrix
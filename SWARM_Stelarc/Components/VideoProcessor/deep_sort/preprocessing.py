@@ -1,9 +1,119 @@
 # vim: expandtab:ts=4:sw=4
 import numpy as np
 import cv2
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMPY_BACKEND = "numpy"
+MATRIX_BACKEND = "matrix"
+NUMBA_BACKEND = "numba"
+CV2_BACKEND = "cv2"
+AUTO_BACKEND = "auto"
+NMS_BACKENDS = (NUMPY_BACKEND, MATRIX_BACKEND, NUMBA_BACKEND, CV2_BACKEND, AUTO_BACKEND)
+# Up to this many boxes the auto backend computes the whole overlap matrix at once
+MATRIX_MAX_BOXES = 128
+
+
+def _prepare(boxes, scores):
+    # Corners, areas and the processing order (highest score first) shared by the exact backends
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2] + boxes[:, 0]
+    y2 = boxes[:, 3] + boxes[:, 1]
+
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    if scores is not None:
+        idxs = np.argsort(scores)
+    else:
+        idxs = np.argsort(y2)
+    return x1, y1, x2, y2, area, idxs[::-1]
 
 
-def non_max_suppression(boxes, max_bbox_overlap, scores=None):
+def _nms_numpy(x1, y1, x2, y2, area, order, max_bbox_overlap):
+    # One row of overlaps per kept box, suppressed boxes are only flagged
+    suppressed = np.zeros(len(order), dtype=bool)
+    pick = []
+    for k, i in enumerate(order):
+        if suppressed[k]:
+            continue
+        pick.append(i)
+        rest = order[k + 1:]
+        w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + 1)
+        h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + 1)
+        suppressed[k + 1:] |= (w * h) / area[rest] > max_bbox_overlap
+    return pick
+
+
+def _nms_matrix(x1, y1, x2, y2, area, order, max_bbox_overlap):
+    # All the pairwise overlaps in one broadcast, only the greedy scan is left in Python
+    x1, y1, x2, y2, area = x1[order], y1[order], x2[order], y2[order], area[order]
+    w = np.maximum(0, np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]) + 1)
+    h = np.maximum(0, np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]) + 1)
+    suppress = (w * h) / area[None, :] > max_bbox_overlap
+    suppressed = np.zeros(len(order), dtype=bool)
+    pick = []
+    for k in range(len(order)):
+        if suppressed[k]:
+            continue
+        pick.append(order[k])
+        suppressed[k + 1:] |= suppress[k, k + 1:]
+    return pick
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _nms_greedy(x1, y1, x2, y2, area, order, max_bbox_overlap):
+        n = len(order)
+        suppressed = np.zeros(n, dtype=np.bool_)
+        keep = np.zeros(n, dtype=np.bool_)
+        for k in range(n):
+            if suppressed[k]:
+                continue
+            keep[k] = True
+            i = order[k]
+            for m in range(k + 1, n):
+                if suppressed[m]:
+                    continue
+                j = order[m]
+                w = max(0.0, min(x2[i], x2[j]) - max(x1[i], x1[j]) + 1)
+                h = max(0.0, min(y2[i], y2[j]) - max(y1[i], y1[j]) + 1)
+                if (w * h) / area[j] > max_bbox_overlap:
+                    suppressed[m] = True
+        return order[keep]
+else:
+    _nms_greedy = None
+
+
+def _nms_numba(x1, y1, x2, y2, area, order, max_bbox_overlap):
+    if _nms_greedy is None:
+        return _nms_numpy(x1, y1, x2, y2, area, order, max_bbox_overlap)
+    return list(_nms_greedy(x1, y1, x2, y2, area, np.ascontiguousarray(order), float(max_bbox_overlap)))
+
+
+def _nms_cv2(boxes, max_bbox_overlap, scores):
+    # Approximation: OpenCV suppresses on intersection over union, not over the area of the
+    # other box, and orders equal scores its own way
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if scores is None:
+        scores = boxes[:, 3] + boxes[:, 1]
+    # OpenCV only keeps positive scores, they are shifted so nothing is filtered out
+    scores = np.asarray(scores, dtype=np.float64)
+    scores = scores - scores.min() + 1
+    indices = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), 0., float(max_bbox_overlap))
+    return [int(i) for i in np.asarray(indices).reshape(-1)]
+
+
+_exact_backends = {
+    NUMPY_BACKEND: _nms_numpy,
+    MATRIX_BACKEND: _nms_matrix,
+    NUMBA_BACKEND: _nms_numba,
+}
+
+
+def non_max_suppression(boxes, max_bbox_overlap, scores=None, backend=NUMPY_BACKEND):
     """Suppress overlapping detections.
 
     Original code from [1]_ has been adapted to include confidence score.
@@ -27,6 +137,11 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
         ROIs that overlap more than this values are suppressed.
     scores : Optional[array_like]
         Detector confidence score.
+    backend : Optional[str]
+        One of `NMS_BACKENDS`. The numpy, matrix and numba backends return
+        the same indices, `AUTO_BACKEND` picks the matrix backend for small
+        inputs and numba (numpy when not installed) for large ones. The cv2 backend uses
+        intersection over union and only approximates the others.
 
     Returns
     -------
@@ -34,40 +149,20 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
         Returns indices of detections that have survived non-maxima suppression.
 
     """
+    if backend not in NMS_BACKENDS:
+        raise ValueError("Unknown NMS backend '%s'" % backend)
     if len(boxes) == 0:
         return []
-
-    boxes = boxes.astype(np.float)
-    pick = []
-
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2] + boxes[:, 0]
-    y2 = boxes[:, 3] + boxes[:, 1]
-
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    if scores is not None:
-        idxs = np.argsort(scores)
-    else:
-        idxs = np.argsort(y2)
-
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-
-        overlap = (w * h) / area[idxs[:last]]
-
-        idxs = np.delete(
-            idxs, np.concatenate(
-                ([last], np.where(overlap > max_bbox_overlap)[0])))
-
-    return pick
+    if backend == CV2_BACKEND:
+        return _nms_cv2(boxes, max_bbox_overlap, scores)
+    if backend == AUTO_BACKEND:
+        if len(boxes) <= MATRIX_MAX_BOXES:
+            backend = MATRIX_BACKEND
+        else:
+            backend = NUMPY_BACKEND if _nms_greedy is None else NUMBA_BACKEND
+
+    x1, y1, x2, y2, area, order = _prepare(boxes, scores)
+    if max_bbox_overlap >= 1 and np.all(x2 >= x1) and np.all(y2 >= y1):
+        # A box can't overlap another by more than its whole area, nothing is suppressed
+        return list(order)
+    return _exact_backends[backend](x1, y1, x2, y2, area, order, max_bbox_overlap)
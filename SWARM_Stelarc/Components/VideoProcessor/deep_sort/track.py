@@ -124,6 +124,12 @@ class Track:
 
         """
         self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+        self.mark_predicted()
+
+    def mark_predicted(self):
+        """Advance the track age after its state has been predicted (used
+        when the Kalman filter runs for all the tracks at once).
+        """
         self.age += 1
         self.time_since_update += 1
 
@@ -141,6 +147,12 @@ class Track:
         """
         self.mean, self.covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
+        self.mark_hit(detection)
+
+    def mark_hit(self, detection):
+        """Update the feature cache and track state after its Kalman filter
+        state has been corrected with `detection`.
+        """
         self.features.append(detection.feature)
         self.last_seen_detection = detection
         self.hits += 1
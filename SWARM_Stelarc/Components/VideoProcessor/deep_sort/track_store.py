@@ -0,0 +1,171 @@
+# vim: expandtab:ts=4:sw=4
+import heapq
+import numpy as np
+from .track import Track, TrackState
+
+
+def _column(name, scalar=False):
+    # Property reading and writing the row of `name` in the store, or the values
+    # the view was frozen with once its slot has been released
+    def fget(self):
+        if self._frozen is not None:
+            return self._frozen[name]
+        value = getattr(self._store, name)[self._slot]
+        return int(value) if scalar else value
+
+    def fset(self, value):
+        if self._frozen is not None:
+            self._frozen[name] = value
+        else:
+            getattr(self._store, name)[self._slot] = value
+    return property(fget, fset)
+
+
+class TrackView(Track):
+    """
+    A `Track` whose attributes are a row of a `TrackStore`. All the `Track`
+    methods work on it, so it can be used wherever a list of tracks is
+    expected.
+
+    When the store releases the slot the view keeps a copy of its last
+    values, so views held by frames still in flight don't change identity
+    when the slot is reused.
+
+    """
+    track_id = _column("track_ids", scalar=True)
+    state = _column("states", scalar=True)
+    hits = _column("hits", scalar=True)
+    age = _column("ages", scalar=True)
+    time_since_update = _column("time_since_update", scalar=True)
+    mean = _column("means")
+    covariance = _column("covariances")
+    features = _column("features")
+    last_seen_detection = _column("detections")
+
+    def __init__(self, store, slot):
+        self._store = store
+        self._slot = slot
+        self._frozen = None
+
+    @property
+    def _n_init(self):
+        return self._store.n_init
+
+    @property
+    def _max_age(self):
+        return self._store.max_age
+
+    def _detach(self):
+        store, slot = self._store, self._slot
+        self._frozen = {
+            "track_ids": int(store.track_ids[slot]),
+            "states": int(store.states[slot]),
+            "hits": int(store.hits[slot]),
+            "ages": int(store.ages[slot]),
+            "time_since_update": int(store.time_since_update[slot]),
+            "means": store.means[slot].copy(),
+            "covariances": store.covariances[slot].copy(),
+            "features": store.features[slot],
+            "detections": store.detections[slot],
+        }
+
+
+class TrackStore(object):
+    """
+    Track attributes held in parallel arrays, one row (slot) per track.
+    Slots of deleted tracks are reused, lowest first.
+
+    Parameters
+    ----------
+    n_init : int
+        Number of consecutive detections before a track is confirmed.
+    max_age : int
+        The maximum number of consecutive misses before a track is deleted.
+    capacity : int
+        Number of slots allocated upfront, doubled when exceeded.
+
+    Attributes
+    ----------
+    track_ids, states, hits, ages, time_since_update : ndarray
+        The per slot `Track` attributes.
+    means : ndarray
+        The (capacity, 8) Kalman filter state means.
+    covariances : ndarray
+        The (capacity, 8, 8) Kalman filter state covariances.
+    alive : ndarray
+        True for the slots holding a track.
+    features : List[List[ndarray]]
+        The features cache of every slot, not yet added to the metric.
+    detections : List[Detection]
+        The last detection associated to every slot.
+    views : List[TrackView]
+        The `TrackView` of the track in every slot.
+
+    """
+
+    def __init__(self, n_init, max_age, capacity=32):
+        self.n_init = n_init
+        self.max_age = max_age
+        self.capacity = 0
+        self.track_ids = np.zeros(0, dtype=np.int64)
+        self.states = np.zeros(0, dtype=np.int8)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.ages = np.zeros(0, dtype=np.int64)
+        self.time_since_update = np.zeros(0, dtype=np.int64)
+        self.means = np.zeros((0, 8))
+        self.covariances = np.zeros((0, 8, 8))
+        self.alive = np.zeros(0, dtype=bool)
+        self.features = []
+        self.detections = []
+        self.views = []
+        self._free_slots = []
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for name in ("track_ids", "states", "hits", "ages", "time_since_update",
+                     "means", "covariances", "alive"):
+            column = getattr(self, name)
+            grown = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.features += [[] for _ in range(capacity - old)]
+        self.detections += [None] * (capacity - old)
+        self.views += [None] * (capacity - old)
+        for slot in range(old, capacity):
+            heapq.heappush(self._free_slots, slot)
+        self.capacity = capacity
+
+    def add(self, mean, covariance, track_id, feature=None, detection=None):
+        """Store a new tentative track and return its slot."""
+        if len(self._free_slots) == 0:
+            self._grow(max(1, 2 * self.capacity))
+        slot = heapq.heappop(self._free_slots)
+        self.track_ids[slot] = track_id
+        self.states[slot] = TrackState.Tentative
+        self.hits[slot] = 1
+        self.ages[slot] = 1
+        self.time_since_update[slot] = 0
+        self.means[slot] = mean
+        self.covariances[slot] = covariance
+        self.alive[slot] = True
+        self.features[slot] = [] if feature is None else [feature]
+        self.detections[slot] = detection
+        self.views[slot] = TrackView(self, slot)
+        return slot
+
+    def release(self, slots):
+        """Free the slots of deleted tracks, their views keep their last
+        values."""
+        for slot in np.asarray(slots, dtype=np.int64):
+            self.views[slot]._detach()
+            self.views[slot] = None
+            self.features[slot] = []
+            self.detections[slot] = None
+            self.alive[slot] = False
+            heapq.heappush(self._free_slots, int(slot))
+
+    def active_slots(self):
+        """Slots holding a track, in creation order."""
+        slots = np.flatnonzero(self.alive)
+        return slots[np.argsort(self.track_ids[slots], kind="stable")]
@@ -1,11 +1,11 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
-from . import kalman_filter
-from . import my_filter
+from . import kalman_bank
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .track import Track, TrackState
+from .track_store import TrackStore
 
 
 class Tracker:
@@ -22,6 +22,8 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    kalman_profile : str
+        Covariance profile of the Kalman filter, see `kalman_bank`.
 
     Attributes
     ----------
@@ -31,37 +33,72 @@ class Tracker:
         Maximum number of missed misses before a track is deleted.
     n_init : int
         Number of frames that a track remains in initialization phase.
-    kf : kalman_filter.KalmanFilter
+    kf : kalman_bank.KalmanFilterBank
         A Kalman filter to filter target trajectories in image space.
     tracks : List[Track]
         The list of active tracks at the current time step.
+    means : ndarray
+        The (N, 8) state means of `tracks`, each `track.mean` is a view of
+        its row.
+    covariances : ndarray
+        The (N, 8, 8) state covariances of `tracks`, each `track.covariance`
+        is a view of its row.
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3,
+                 kalman_profile=kalman_bank.FIXED_PROFILE):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
 
-        transition_covariance =  np.eye(8, 8) * 10
-        observation_covariance =  np.eye(4, 4) * 500
-        self.kf = kalman_filter.KalmanFilter()
-        self.mykf = my_filter.MyKalmanFilter(
-            transition_covariance = transition_covariance,
-            observation_covariance = observation_covariance)
-        self.trackerinuse = self.mykf
+        self.kf = kalman_bank.KalmanFilterBank(kalman_profile)
+        self.trackerinuse = self.kf
         self.tracks = []
+        self.means = np.zeros((0, 8))
+        self.covariances = np.zeros((0, 8, 8))
+        self._bound_tracks = None
         self._next_id = 1
 
-    def predict(self):
+    def _bind_states(self):
+        """Stack the track states in `means` and `covariances` and make the
+        tracks point to their rows. Only needed when the track set changed.
+        """
+        if self._bound_tracks is self.tracks and len(self.means) == len(self.tracks):
+            return
+        if len(self.tracks) > 0:
+            self.means = np.array([t.mean for t in self.tracks], dtype=np.float64)
+            self.covariances = np.array([t.covariance for t in self.tracks], dtype=np.float64)
+        else:
+            self.means = np.zeros((0, 8))
+            self.covariances = np.zeros((0, 8, 8))
+        for i, track in enumerate(self.tracks):
+            track.mean = self.means[i]
+            track.covariance = self.covariances[i]
+        self._bound_tracks = self.tracks
+
+    def predict(self, coasting=False):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
+
+        Parameters
+        ----------
+        coasting : bool
+            True for time steps without detections (no `update` follows):
+            the states move forward but the step doesn't count as a miss.
         """
-        # pass
+        self._bind_states()
+        if len(self.tracks) <= 0:
+            return
+        self.means[:], self.covariances[:] = self.kf.predict_batch(
+            self.means, self.covariances)
         for track in self.tracks:
-            track.predict(self.trackerinuse)
+            if coasting:
+                track.age += 1
+            else:
+                track.mark_predicted()
 
     def update(self, frame, detections):
         """Perform measurement update and track management.
@@ -77,14 +114,24 @@ class Tracker:
             self._match(frame, detections)
 
         # Update track set.
+        self._bind_states()
+        if len(matches) > 0:
+            track_indices = np.array([m[0] for m in matches])
+            measurements = np.array(
+                [detections[m[1]].to_xyah() for m in matches])
+            means, covariances = self.kf.update_batch(
+                self.means[track_indices], self.covariances[track_indices],
+                measurements)
+            self.means[track_indices] = means
+            self.covariances[track_indices] = covariances
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-            self.trackerinuse, detections[detection_idx])
+            self.tracks[track_idx].mark_hit(detections[detection_idx])
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
         for detection_idx in unmatched_detections:
             self._initiate_track(detections[detection_idx])
         self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        self._bind_states()
 
         # Update distance metric.
         active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
@@ -111,10 +158,9 @@ class Tracker:
             return cost_matrix
 
         # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        confirmed, time_since_update = self._track_flags()
+        confirmed_tracks = np.flatnonzero(confirmed).tolist()
+        unconfirmed_tracks = np.flatnonzero(~confirmed).tolist()
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
@@ -124,11 +170,9 @@ class Tracker:
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
+            k for k in unmatched_tracks_a if time_since_update[k] == 1]
         unmatched_tracks_a = [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
+            k for k in unmatched_tracks_a if time_since_update[k] != 1]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
                 iou_matching.iou_cost, self.max_iou_distance, self.tracks,
@@ -137,9 +181,136 @@ class Tracker:
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
+    def _track_flags(self):
+        """Confirmed flag and time since update of every track."""
+        confirmed = np.array([t.is_confirmed() for t in self.tracks], dtype=bool)
+        time_since_update = np.array(
+            [t.time_since_update for t in self.tracks], dtype=np.int64)
+        return confirmed, time_since_update
+
     def _initiate_track(self, detection):
         mean, covariance = self.trackerinuse.initiate(detection.to_xyah())
         self.tracks.append(Track(
             mean, covariance, self._next_id, self.n_init, self.max_age,
             detection.feature, detection))
         self._next_id += 1
+
+
+class ColumnarTracker(Tracker):
+    """
+    A `Tracker` that keeps the track attributes in the columns of a
+    `TrackStore`, so that prediction, state updates and track management run
+    as array operations. `tracks` holds `TrackView` objects in creation
+    order, which can be used like `Track` objects.
+
+    Parameters
+    ----------
+    metric : nn_matching.NearestNeighborDistanceMetric
+        A distance metric for measurement-to-track association.
+    max_age : int
+        Maximum number of missed misses before a track is deleted.
+    n_init : int
+        Number of consecutive detections before the track is confirmed.
+    kalman_profile : str
+        Covariance profile of the Kalman filter, see `kalman_bank`.
+    capacity : int
+        Number of track slots allocated upfront.
+
+    Attributes
+    ----------
+    store : track_store.TrackStore
+        The track columns.
+    tracks : List[track_store.TrackView]
+        The views of the active tracks at the current time step.
+
+    """
+
+    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3,
+                 kalman_profile=kalman_bank.FIXED_PROFILE, capacity=32):
+        self.metric = metric
+        self.max_iou_distance = max_iou_distance
+        self.max_age = max_age
+        self.n_init = n_init
+
+        self.kf = kalman_bank.KalmanFilterBank(kalman_profile)
+        self.trackerinuse = self.kf
+        self.store = TrackStore(n_init, max_age, capacity)
+        self._slots = np.zeros(0, dtype=np.int64)
+        self.tracks = []
+        self._next_id = 1
+
+    def _refresh(self):
+        self._slots = self.store.active_slots()
+        self.tracks = [self.store.views[slot] for slot in self._slots]
+
+    def predict(self, coasting=False):
+        """Propagate track state distributions one time step forward, see
+        `Tracker.predict`.
+        """
+        slots, store = self._slots, self.store
+        if len(slots) <= 0:
+            return
+        store.means[slots], store.covariances[slots] = self.kf.predict_batch(
+            store.means[slots], store.covariances[slots])
+        store.ages[slots] += 1
+        if not coasting:
+            store.time_since_update[slots] += 1
+
+    def update(self, frame, detections):
+        """Perform measurement update and track management.
+
+        Parameters
+        ----------
+        detections : List[deep_sort.detection.Detection]
+            A list of detections at the current time step.
+
+        """
+        # Run matching cascade.
+        matches, unmatched_tracks, unmatched_detections = \
+            self._match(frame, detections)
+
+        # Update track set.
+        store = self.store
+        if len(matches) > 0:
+            slots = self._slots[[m[0] for m in matches]]
+            measurements = np.array(
+                [detections[m[1]].to_xyah() for m in matches])
+            store.means[slots], store.covariances[slots] = self.kf.update_batch(
+                store.means[slots], store.covariances[slots], measurements)
+            store.hits[slots] += 1
+            store.time_since_update[slots] = 0
+            confirm = (store.states[slots] == TrackState.Tentative) & \
+                (store.hits[slots] >= self.n_init)
+            store.states[slots[confirm]] = TrackState.Confirmed
+            for slot, (_, detection_idx) in zip(slots, matches):
+                store.features[slot].append(detections[detection_idx].feature)
+                store.detections[slot] = detections[detection_idx]
+        missed = self._slots[np.asarray(unmatched_tracks, dtype=np.int64)]
+        delete = (store.states[missed] == TrackState.Tentative) | \
+            (store.time_since_update[missed] > self.max_age)
+        store.states[missed[delete]] = TrackState.Deleted
+        for detection_idx in unmatched_detections:
+            self._initiate_track(detections[detection_idx])
+        store.release(self._slots[store.states[self._slots] == TrackState.Deleted])
+        self._refresh()
+
+        # Update distance metric.
+        confirmed = self._slots[store.states[self._slots] == TrackState.Confirmed]
+        active_targets = store.track_ids[confirmed].tolist()
+        features, targets = [], []
+        for slot in confirmed:
+            features += store.features[slot]
+            targets += [store.track_ids[slot]] * len(store.features[slot])
+            store.features[slot] = []
+        self.metric.partial_fit(
+            np.asarray(features), np.asarray(targets), active_targets)
+
+    def _track_flags(self):
+        return (self.store.states[self._slots] == TrackState.Confirmed,
+                self.store.time_since_update[self._slots])
+
+    def _initiate_track(self, detection):
+        mean, covariance = self.kf.initiate(detection.to_xyah())
+        self.store.add(mean, covariance, self._next_id, detection.feature,
+                       detection)
+        self._next_id += 1
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from Components.VideoProcessor.deep_sort.detection import Detection
+from Components.VideoProcessor.deep_sort import nn_matching
+from Components.VideoProcessor.deep_sort.tracker import Tracker as DeepTracker, ColumnarTracker
+import Constants
+
+# OpenPose BODY_25 keypoints used to draw the skeletons
+BODY_PARTS = {"Nose": 0, "Neck": 1, "RShoulder": 2, "RElbow": 3, "RWrist": 4,
+              "LShoulder": 5, "LElbow": 6, "LWrist": 7, "MHip": 8, "RHip": 9, "RKnee": 10,
+              "RAnkle": 11, "LHip": 12, "LKnee": 13, "LAnkle": 14, "REye": 15,
+              "LEye": 16, "REar": 17, "LEar": 18}
+
+POSE_PAIRS = [["Neck", "RShoulder"], ["Neck", "LShoulder"], ["RShoulder", "RElbow"],
+              ["RElbow", "RWrist"], ["LShoulder", "LElbow"], ["LElbow", "LWrist"],
+              ["MHip", "RHip"], ["RHip", "RKnee"], ["RKnee", "RAnkle"], ["MHip", "LHip"],
+              ["LHip", "LKnee"], ["LKnee", "LAnkle"], ["Neck", "Nose"], ["Nose", "REye"],
+              ["REye", "REar"], ["Nose", "LEye"], ["LEye", "LEar"]]
+
+
+def create_tracker():
+    metric = nn_matching.NearestNeighborDistanceMetric("cosine", Constants.max_cosine_distance, Constants.nn_budget,
+                                                       eviction=Constants.gallery_eviction)
+    tracker_type = ColumnarTracker if Constants.columnar_tracks else DeepTracker
+    return tracker_type(metric, max_age=Constants.max_age, n_init=Constants.n_init, kalman_profile=Constants.kalman_profile)
+
+
+def detections_to_data(detections):
+    # Plain tuples are much cheaper to send between processes than Detection objects
+    return [(d.tlwh, d.confidence, d.feature, d.pose) for d in detections]
+
+
+def data_to_detections(detections_data):
+    return [Detection(tlwh, confidence, feature, pose) for tlwh, confidence, feature, pose in detections_data]
@@ -0,0 +1,170 @@
+import base64
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+
+class EncodedFrame:
+    # JPEG bytes of an outgoing frame, made once so the socket loop only has to emit them
+    def __init__(self, seq, jpeg, shape, encode_time):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.shape = shape
+        self.encode_time = encode_time
+        self._data_uri = None
+
+    def prepare_data_uri(self):
+        # Only the base64 transport needs it, made on first use
+        if self._data_uri is None:
+            self._data_uri = "data:image/jpeg;base64," + base64.b64encode(self.jpeg).decode()
+        return self._data_uri
+
+    @property
+    def data_uri(self):
+        return self.prepare_data_uri()
+
+
+class FrameEncoder:
+    # Resizes and encodes outgoing frames on a small thread pool, cv2 releases the GIL while doing it.
+    # Frames coming while max_pending are still being encoded are dropped, the stream can't keep up anyway
+    def __init__(self, workers=2, max_pending=None):
+        self.workers = workers
+        self.max_pending = workers * 2 if max_pending is None else max_pending
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="FrameEncoder")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.last_time = 0
+        self.avg_time = 0
+        self.max_time = 0
+
+    def encode(self, seq, frame, size=None, quality=95):
+        start = time.perf_counter()
+        if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+            frame = cv2.resize(frame, tuple(size))
+        retval, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not retval:
+            raise ValueError(f"Could not encode frame {seq}")
+        encoded = EncodedFrame(seq, buffer.tobytes(), frame.shape, 0)
+        encoded.encode_time = time.perf_counter() - start
+        with self.lock:
+            self.encoded += 1
+            self.last_time = encoded.encode_time
+            self.avg_time = encoded.encode_time if self.encoded <= 1 else self.avg_time * 0.9 + encoded.encode_time * 0.1
+            self.max_time = max(self.max_time, encoded.encode_time)
+        return encoded
+
+    def submit(self, seq, frame, size=None, quality=95, callback=None):
+        # callback(encoded) runs on the encoder thread, returns False when the frame was dropped
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending += 1
+        self.executor.submit(self._run, seq, frame, size, quality, callback)
+        return True
+
+    def _run(self, seq, frame, size, quality, callback):
+        try:
+            encoded = self.encode(seq, frame, size, quality)
+            if callback is not None:
+                callback(encoded)
+        except Exception as e:
+            print(f"Error encoding frame {seq}: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+
+    def get_metrics(self):
+        with self.lock:
+            return {'workers': self.workers, 'pending': self.pending, 'encoded': self.encoded, 'dropped': self.dropped,
+                    'last_time': self.last_time, 'avg_time': self.avg_time, 'max_time': self.max_time}
+
+
+class EncodedFrameHandle:
+    # Reference to a cached encoded frame, release() it once sent or dropped
+    def __init__(self, cache, entry):
+        self.cache = cache
+        self.entry = entry
+        self.released = False
+
+    @property
+    def frame(self):
+        return self.entry.encoded
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.cache.release(self.entry)
+
+
+class CacheEntry:
+    def __init__(self, key):
+        self.key = key
+        self.encoded = None
+        self.callbacks = []
+        self.refs = 0
+
+
+class EncodedFrameCache:
+    # Encodes every (frame seq, size, quality) once, however many sockets stream it. Each socket gets its own
+    # handle, the entry leaves the cache when all of them are released or once max_entries newer ones came
+    # in, so a lost handle can't keep a frame around
+    def __init__(self, encoder, max_entries=8):
+        self.encoder = encoder
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def request(self, seq, frame, size=None, quality=95, callback=None):
+        # callback(handle) runs once the frame is encoded, returns False when the encoder dropped the frame
+        key = (seq, None if size is None else tuple(size), int(quality))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry.refs += 1
+                if entry.encoded is None:
+                    entry.callbacks.append(callback)
+                    return True
+            else:
+                self.misses += 1
+                entry = CacheEntry(key)
+                entry.refs = 1
+                entry.callbacks.append(callback)
+                if not self.encoder.submit(seq, frame, size, quality, lambda encoded: self.on_encoded(entry, encoded)):
+                    return False
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                return True
+        callback(EncodedFrameHandle(self, entry))
+        return True
+
+    def on_encoded(self, entry, encoded):
+        with self.lock:
+            entry.encoded = encoded
+            callbacks = entry.callbacks
+            entry.callbacks = []
+        for callback in callbacks:
+            callback(EncodedFrameHandle(self, entry))
+
+    def release(self, entry):
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs <= 0 and self.entries.get(entry.key) is entry:
+                del self.entries[entry.key]
+
+    def get_metrics(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests > 0 else 0}
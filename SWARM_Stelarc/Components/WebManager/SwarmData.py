@@ -1,6 +1,7 @@
 import datetime
 import base64
 import cv2
+from .FrameEncoder import EncodedFrameHandle
 
 class SwarmData:
     def __init__(self, image_data=None, cameras_data=None, swarm_data=None):
@@ -16,6 +17,8 @@ class SwarmData:
             return self.cameras_data
 
     def get_image_string(self):
+        if isinstance(self.image_data, EncodedFrameHandle):
+            return self.image_data.frame.data_uri
         if self.image_data is not None:
             retval, buffer = cv2.imencode('.jpg', self.image_data)
             img_str = base64.b64encode(buffer).decode()
@@ -23,10 +26,34 @@ class SwarmData:
             return "data:image/jpeg;base64," + img_str
         return ''
 
+    def get_image_bytes(self):
+        if isinstance(self.image_data, EncodedFrameHandle):
+            return self.image_data.frame.jpeg
+        if self.image_data is not None:
+            retval, buffer = cv2.imencode('.jpg', self.image_data)
+            return buffer.tobytes()
+        return b''
+
+    def release(self):
+        if isinstance(self.image_data, EncodedFrameHandle):
+            self.image_data.release()
+
     def get_json(self):
         data = {}
         data['swarm_data'] = self.get_swarm_json()
         data['graph_data'] = self.get_cameras_json()
         data['frame_data'] = self.get_image_string()
         data['datetime'] = self.time
-        return data
\ No newline at end of file
+        return data
+
+    def get_binary(self):
+        # The raw JPEG goes as a socket.io binary attachment, everything else in the header
+        header = {}
+        header['swarm_data'] = self.get_swarm_json()
+        header['graph_data'] = self.get_cameras_json()
+        header['datetime'] = self.time
+        header['format'] = 'jpeg'
+        if isinstance(self.image_data, EncodedFrameHandle):
+            header['seq'] = self.image_data.frame.seq
+            header['height'], header['width'] = self.image_data.frame.shape[:2]
+        return {'header': header, 'frame': self.get_image_bytes()}
\ No newline at end of file
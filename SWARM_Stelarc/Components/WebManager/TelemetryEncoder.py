@@ -0,0 +1,129 @@
+import copy
+import json
+import threading
+import time
+import numpy as np
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _pack_default(obj):
+    # numpy scalars and arrays sneaking into the graph and stats data
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Can't pack {type(obj)}")
+
+
+def diff_state(old, new, path=None, delta=None):
+    # Dicts are compared by key and lists by index, only the leaves (or subtrees) that changed are kept.
+    # 'len' resizes a list, 'set' replaces the value at a path and 'del' removes a dict key
+    path = [] if path is None else path
+    delta = {'len': [], 'set': [], 'del': []} if delta is None else delta
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old:
+                diff_state(old[key], value, path + [key], delta)
+            else:
+                delta['set'].append([path + [key], value])
+        for key in old:
+            if key not in new:
+                delta['del'].append(path + [key])
+    elif isinstance(old, list) and isinstance(new, list):
+        if len(old) != len(new):
+            delta['len'].append([path, len(new)])
+        for i, value in enumerate(new):
+            if i < len(old):
+                diff_state(old[i], value, path + [i], delta)
+            else:
+                delta['set'].append([path + [i], value])
+    elif type(old) != type(new) or old != new:
+        delta['set'].append([path, new])
+    return delta
+
+
+def apply_delta(state, delta):
+    # What the receiving end does with a delta, lists are resized before their new items are set
+    def parent(path):
+        node = state
+        for key in path[:-1]:
+            node = node[key]
+        return node
+
+    for path, length in delta['len']:
+        node = parent(path)[path[-1]] if len(path) > 0 else state
+        del node[length:]
+        node.extend([None] * (length - len(node)))
+    for path, value in delta['set']:
+        if len(path) == 0:
+            state = value
+        else:
+            parent(path)[path[-1]] = value
+    for path in delta['del']:
+        del parent(path)[path[-1]]
+    return state
+
+
+class TelemetryEncoder:
+    # Turns the per frame graph and swarm data into a keyframe every keyframe_interval seconds and compact
+    # deltas in between. Every message has a seq, a delta only applies on top of the message with seq - 1:
+    # a receiver seeing a gap asks for a resync and gets a keyframe with the next message
+    def __init__(self, keyframe_interval=5.):
+        self.keyframe_interval = keyframe_interval
+        self.codec = 'msgpack' if msgpack is not None else 'json'
+        self.lock = threading.Lock()
+        self.state = None
+        self.seq = 0
+        self.last_keyframe_time = 0
+        self.keyframe_requested = True
+        self.keyframes = 0
+        self.deltas = 0
+        self.resyncs = 0
+        self.keyframe_bytes = 0
+        self.avg_delta_bytes = 0
+
+    def request_keyframe(self, resync=False):
+        with self.lock:
+            self.keyframe_requested = True
+            if resync:
+                self.resyncs += 1
+
+    def pack(self, message):
+        if msgpack is not None:
+            return msgpack.packb(message, use_bin_type=True, default=_pack_default)
+        return json.dumps(message, default=_pack_default).encode()
+
+    def encode(self, graph_data, swarm_data):
+        # Returns the seq and the packed message to send
+        new_state = {'graph_data': graph_data, 'swarm_data': swarm_data}
+        now = time.time()
+        with self.lock:
+            self.seq += 1
+            message = {'seq': self.seq, 'time': now}
+            keyframe = self.keyframe_requested or self.state is None or now - self.last_keyframe_time >= self.keyframe_interval
+            if keyframe:
+                message['key'] = True
+                message['state'] = new_state
+                self.keyframe_requested = False
+                self.last_keyframe_time = now
+            else:
+                message['key'] = False
+                message['delta'] = diff_state(self.state, new_state)
+            payload = self.pack(message)
+            # The next delta is computed against what was just sent, the sources are free to change it afterwards
+            self.state = copy.deepcopy(new_state)
+            if keyframe:
+                self.keyframes += 1
+                self.keyframe_bytes = len(payload)
+            else:
+                self.deltas += 1
+                self.avg_delta_bytes = len(payload) if self.deltas <= 1 else self.avg_delta_bytes * 0.9 + len(payload) * 0.1
+            return self.seq, payload
+
+    def get_metrics(self):
+        with self.lock:
+            return {'codec': self.codec, 'seq': self.seq, 'keyframes': self.keyframes, 'deltas': self.deltas,
+                    'resyncs': self.resyncs, 'keyframe_bytes': self.keyframe_bytes, 'avg_delta_bytes': self.avg_delta_bytes}
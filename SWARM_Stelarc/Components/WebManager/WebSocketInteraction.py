@@ -49,9 +49,8 @@ class WebSocketInteraction(WebSocketMeta):
     def pop_last_command(self):
         self.out_buffer.insert_data(self.in_buffer.pop_data())
 
-    async def send_data(self):
+    async def send_data(self, remote_command_data=None):
         try:
-            remote_command_data = self.out_buffer.pop_data()
             if remote_command_data is None:
                 return
             data_json = {}
@@ -65,7 +64,7 @@ class WebSocketInteraction(WebSocketMeta):
             self.status_manager.set_disconnected(f"{e}")
 
     def draw_debug(self, ui_drawer, text_pos, surfaces,):
-        cmds_list = [cmd.get("command", "NONE")for cmd in self.in_buffer.buffer]
+        cmds_list = [cmd.get("command", "NONE")for cmd in self.in_buffer.items()]
         status_dbg_str = f"{self.ws_id} {self.status_manager.get_status_info()} - Remote cmds: {cmds_list}"
         data_str = f"Queue Out: {self.out_buffer.count()}/{self.out_buffer.size()}  -  "
         data_str += f"Queue In: {self.in_buffer.count()}/{self.in_buffer.size()}"
@@ -77,7 +76,7 @@ class WebSocketInteraction(WebSocketMeta):
         WebSocketMeta.__init__(self, app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor)
         print(f"Creating websocket interaction {ws_id}")
 
-        self.out_buffer = DataQueue(5)
+        self.out_buffer = DataQueue(5, wakeup=self.data_ready)
         self.in_buffer = DataQueue(5)
 
     def create_ws(app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor=None):
@@ -4,6 +4,7 @@ import datetime
 import cv2
 import asyncio
 from ..Utils.DataQueue import DataQueue
+from ..Utils.AsyncWakeup import AsyncWakeup
 from .WebSocketHandlers import WebSocketHandlers
 from .SwarmData import SwarmData
 import time
@@ -42,7 +43,10 @@ class WebSocketMeta:
         self.scaling_factor = 0.8
         self.last_file_size = 1
 
-        self.out_buffer = DataQueue(50)
+        # Set by the outgoing queues when there is something to send, the loop sleeps on it when idle
+        self.data_ready = AsyncWakeup()
+        self.idle_timeout = 0.5
+        self.out_buffer = DataQueue(50, wakeup=self.data_ready)
         self.in_buffer = DataQueue(50)
 
         self.last_emit = datetime.datetime.now()
@@ -61,7 +65,9 @@ class WebSocketMeta:
                 await self.status_manager.update_status()
                 if self.status_manager.is_ready():
                     await self.background_task()
-                    await asyncio.sleep(0)
+                else:
+                    # The timeout keeps the connection status checks going
+                    await self.data_ready.wait(self.idle_timeout)
         except Exception as e:
             print(f"Exception in {self.namespace} loop: {e}")
 
@@ -71,15 +77,27 @@ class WebSocketMeta:
             self.out_buffer.fps_counter.reset()
         if self.target_framerate > 0:
             if self.out_buffer.fps() > self.target_framerate:
-                self.out_buffer.discard_next()
+                data = self.out_buffer.discard_next()
+                if data is None:
+                    await self.data_ready.wait(self.idle_timeout)
+                self.release_data(data)
                 return
+        # Sleeps until something is queued for this socket, None when only the other queues sharing
+        # data_ready have something or nothing came within the timeout
+        data = await self.out_buffer.get_async(self.idle_timeout)
         try:
-            await self.send_data()
+            await self.send_data(data)
         except Exception as e:
             print(f"Error running send loop {self.namespace} : {e}")
-        await asyncio.sleep(0.00001)
         # print(f"WebSocket loop not implemented!")
 
+    def release_data(self, data):
+        # Called with the items taken out of out_buffer without being sent
+        pass
+
+    def notify_data(self):
+        self.data_ready.set()
+
     def start_async_task(self):
         if not self.task_running:
             self.in_buffer.clear()
@@ -92,6 +110,7 @@ class WebSocketMeta:
         if self.task_running:
             print(f"Stopping {self.namespace} background task")
             self.task_running = False
+            self.notify_data()
 
     def update_status(self):
         if self.enabled:
@@ -107,7 +126,7 @@ class WebSocketMeta:
         self.sync_with_server = data.get("sync_with_server", False)
         self.target_framerate = data.get("target_framerate", -1)
         if self.target_framerate > 0:
-            self.out_buffer = DataQueue(self.target_framerate*2, self.target_framerate)
+            self.out_buffer = DataQueue(self.target_framerate*2, self.target_framerate, wakeup=self.data_ready)
             self.in_buffer = DataQueue(self.target_framerate*2)
         self.enabled = data.get("enabled", self.enabled)
         # self.frame_scaling = data.get("frame_scaling", False)
@@ -129,11 +148,13 @@ class WebSocketMeta:
 
     def draw_debug(self, ui_drawer, text_pos, surfaces,):
         status_dbg_str = f"{self.ws_id} {self.status_manager.get_status_info()}"
-        data_str = f"OUT FPS: {int(self.out_buffer.fps())}, Buff Out: {self.out_buffer.count()}/{self.out_buffer.size()}  -  "
-        data_str += f"IN FPS: {int(self.in_buffer.fps())}, Buff In: {self.in_buffer.count()}/{self.in_buffer.size()}"
+        data_str = f"OUT FPS: {int(self.out_buffer.fps())}, Buff Out: {self.out_buffer.count()}/{self.out_buffer.size()} ({self.out_buffer.dropped} dropped)  -  "
+        data_str += f"IN FPS: {int(self.in_buffer.fps())}, Buff In: {self.in_buffer.count()}/{self.in_buffer.size()} ({self.in_buffer.dropped} dropped)"
         text_pos = ui_drawer.add_text_line(status_dbg_str, (255, 50, 0), text_pos, surfaces)
         text_pos.y -= ui_drawer.line_height
         text_pos = ui_drawer.add_text_line(data_str, (255, 50, 0), text_pos, surfaces)
+        text_pos.y -= ui_drawer.line_height
+        text_pos = ui_drawer.add_text_line(f"Idle wait: {self.data_ready.waits.summary()}", (255, 50, 0), text_pos, surfaces)
 
     def set_status(self, new_status, extra="", debug=True):
         self.status_manager.set_status(new_status, extra)
@@ -1,20 +1,35 @@
 from .WebSocketMeta import WebSocketMeta
 from .WebSocketHandlers import WebSocketHandlers
 from .SwarmData import SwarmData
+from .FrameEncoder import FrameEncoder, EncodedFrameCache, EncodedFrameHandle
+from .TelemetryEncoder import TelemetryEncoder
 import datetime
+import threading
 import cv2
 from ..Utils.utils import *
 from ..Utils.DataQueue import DataQueue
 
 
+class Transports:
+    BASE64 = "base64"
+    BINARY = "binary"
+
+
+class Telemetries:
+    FULL = "full"
+    DELTA = "delta"
+
+
 class WebSocketVideoStreamOut(WebSocketMeta):
     def attach_callbacks(self):
         self.sio.on("connect", handler=WebSocketVideoStreamOut.on_connect, namespace=self.namespace)
-        self.sio.on("disconnect", handler=WebSocketVideoStreamOut.on_disconnect, namespace=self.namespace)
-        self.sio.on("connect_error", handler=WebSocketVideoStreamOut.on_connect_error, namespace=self.namespace)
+        # Bound to this socket, they reset its own transport and telemetry
+        self.sio.on("disconnect", handler=self.on_socket_disconnect, namespace=self.namespace)
+        self.sio.on("connect_error", handler=self.on_socket_connect_error, namespace=self.namespace)
         self.sio.on("hey", handler=WebSocketVideoStreamOut.on_hey, namespace=self.namespace)
         self.sio.on("frame_received", handler=WebSocketVideoStreamOut.on_frame_received, namespace=self.namespace)
         self.sio.on("scale_request", handler=WebSocketVideoStreamOut.on_scale_request, namespace=self.namespace)
+        self.sio.on("telemetry_resync", handler=self.on_telemetry_resync, namespace=self.namespace)
         # self.sio.on("op_frame_new", handler=WebSocketVideoStreamOut.on_op_frame_new, namespace=self.namespace)
 
     async def on_hey(*args):
@@ -25,15 +40,15 @@ class WebSocketVideoStreamOut(WebSocketMeta):
         global ws_vs
         await WebSocketHandlers.on_connect(ws_vs)
 
-    async def on_disconnect():
-        global ws_vs
-        ws_vs.config_update_sent = False
-        await WebSocketHandlers.on_disconnect(ws_vs)
+    async def on_socket_disconnect(self):
+        self.config_update_sent = False
+        self.reset_transport()
+        await WebSocketHandlers.on_disconnect(self)
 
-    async def on_connect_error(data):
-        global ws_vs
-        ws_vs.config_update_sent = False
-        await WebSocketHandlers.on_connect_error(ws_vs, data)
+    async def on_socket_connect_error(self, data):
+        self.config_update_sent = False
+        self.reset_transport()
+        await WebSocketHandlers.on_connect_error(self, data)
 
     async def on_frame_received(*args):
         global ws_vs
@@ -47,6 +62,10 @@ class WebSocketVideoStreamOut(WebSocketMeta):
         global ws_vs
         await WebSocketHandlers.on_scale_request(ws_vs, *args)
 
+    async def on_telemetry_resync(self, *args):
+        self.app_logger.info(f"{self.ws_id} telemetry resync requested {args[0] if len(args) > 0 else ''}")
+        self.telemetry_encoder.request_keyframe(resync=True)
+
     async def send_graph_data(self, swarm_data):
         data_json = swarm_data.get_json()['graph_data']
         try:
@@ -60,24 +79,44 @@ class WebSocketVideoStreamOut(WebSocketMeta):
         self.scaling_factor = scaling_factor
 
     def enqueue_behaviour_data(self, swarm_data):
+        # Sent with delta telemetry too, behaviour changes are only reported once and frames can be dropped
         data = {}
         data['swarm_data'] = swarm_data
         data['datetime'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         self.behaviour_data_out.insert_data(data)
 
-    def enqueue_frame(self, frame, cameras_data, swarm_data):
+    def enqueue_frame(self, frame, cameras_data, swarm_data, seq):
+        # seq numbers the frame, sockets streaming the same seq with the same settings share its encoding
         if frame is None:
             return
+        if swarm_data is not None and 'current_behavior' in swarm_data.keys():
+            self.app_logger.app(f"Keys to send? True - {datetime.datetime.now()}")
+        size = None
         if self.scaling_factor < 0.99:
-            frame = cv2.resize(frame, (int(self.frame_w * self.scaling_factor), int(self.frame_h * self.scaling_factor)))
-        data = SwarmData(frame, cameras_data, swarm_data)
-        if 'current_behavior' in data.get_json()['swarm_data'].keys():
-            self.app_logger.app(f"Keys to send? {'current_behavior' in data.get_json()['swarm_data'].keys()} - {data.get_json()['datetime']}")
-        self.out_buffer.insert_data(data)
+            size = (int(self.frame_w * self.scaling_factor), int(self.frame_h * self.scaling_factor))
+        # Resizing and encoding happen on the encoder threads, the frame is queued once it is ready to be emitted
+        if not self.frame_cache.request(seq, frame, size, self.jpeg_quality,
+                                        lambda handle: self.on_frame_encoded(handle, cameras_data, swarm_data)):
+            self.encoder_dropped += 1
+
+    def on_frame_encoded(self, handle, cameras_data, swarm_data):
+        with self.encoded_lock:
+            # Encoder threads can finish out of order, a frame older than the last queued one is not worth sending
+            if handle.frame.seq <= self.last_encoded_seq:
+                self.encoder_dropped += 1
+                handle.release()
+                return
+            self.last_encoded_seq = handle.frame.seq
+            if self.transport == Transports.BASE64:
+                # Still on the encoder thread, the socket loop finds the string ready
+                handle.frame.prepare_data_uri()
+            if not self.out_buffer.insert_data(SwarmData(handle, cameras_data, swarm_data)):
+                handle.release()
         if not self.multi_threaded:
             self.send_data()
 
-    async def send_data(self):
+    async def send_data(self, swarm_data=None):
+        # swarm_data was popped from out_buffer by the socket loop, the config and behaviour updates go out anyway
         if self.app_config_data is not None and not self.config_update_sent:
             try:
                 await self.sio.emit(event='app_config_update', data=self.app_config_data, namespace=self.namespace)
@@ -85,20 +124,38 @@ class WebSocketVideoStreamOut(WebSocketMeta):
                 self.config_update_sent = True
             except Exception as e:
                 self.app_logger.critical(f"Error sending app_config_data update {e}")
+        negotiated = self.requested_transport == self.transport and self.requested_telemetry == self.telemetry
+        if not negotiated and not self.transport_requested:
+            await self.request_transport()
         behaviour_data = self.behaviour_data_out.pop_data()
         if behaviour_data is not None:
             await self.sio.emit(event='behaviour_update', data=behaviour_data, namespace=self.namespace)
         try:
-            time_since_last_pop = self.out_buffer.time_since_last_pop()
-            swarm_data = self.out_buffer.pop_data()
             if swarm_data is None:
                 return
+            # The payload copies the encoded frame out of the cache, the handle is not needed after it
+            binary = self.transport == Transports.BINARY
+            if binary:
+                payload = swarm_data.get_binary()
+                data_json = payload['header']
+                self.bytes_sent = len(payload['frame'])
+            else:
+                payload = data_json = swarm_data.get_json()
+                self.bytes_sent = len(data_json['frame_data'])
+            self.release_data(swarm_data)
+            self.avg_bytes_sent = self.bytes_sent if self.avg_bytes_sent <= 0 else self.avg_bytes_sent * 0.9 + self.bytes_sent * 0.1
+            if self.telemetry == Telemetries.DELTA:
+                # Graph and swarm data go through the telemetry channel, the frame only says which state it goes with
+                telemetry_seq, telemetry = self.telemetry_encoder.encode(data_json.pop('graph_data'), data_json.pop('swarm_data'))
+                data_json['telemetry_seq'] = telemetry_seq
+                await self.sio.emit(event='telemetry', data=telemetry, namespace=self.namespace)
 
-            data_json = swarm_data.get_json()
             # if 'current_behavior' in data_json['swarm_data'].keys():
             #     self.app_logger.app(f"Sending curr update? {'current_behavior' in data_json['swarm_data'].keys()} - {data_json['datetime']}")
             # self.app_logger.app(f"Sending curr update? {'current_behavior' in data_json['swarm_data'].keys()} - {data_json['datetime']}")
-            data_json["frame_time"] = time_since_last_pop
+            data_json["frame_time"] = self.out_buffer.pop_interval
+            if isinstance(swarm_data.image_data, EncodedFrameHandle):
+                data_json["encode_time"] = swarm_data.image_data.frame.encode_time
             data_json["time"] = f"{datetime.datetime.now()}"
             data_json["fps"] = self.out_buffer.fps()
             data_json["target_fps"] = self.target_framerate
@@ -107,31 +164,106 @@ class WebSocketVideoStreamOut(WebSocketMeta):
             # behaviour_data = data_json['swarm_data'].get('')
 
             # self.app_logger.critical(f"Sending update {data_json['swarm_data'].keys()}")
+            emit_event = self.binary_emit_event if binary else self.emit_event
             if self.sync_with_server:
                 self.status_manager.set_waiting("Sending data")
                 self.last_emit = datetime.datetime.now()
-                await self.sio.emit(event=self.emit_event, data=data_json, namespace=self.namespace, callback=WebSocketHandlers.on_frame_received_ACK)
+                await self.sio.emit(event=emit_event, data=payload, namespace=self.namespace, callback=WebSocketHandlers.on_frame_received_ACK)
             else:
-                await self.sio.emit(event=self.emit_event, data=data_json, namespace=self.namespace)
+                await self.sio.emit(event=emit_event, data=payload, namespace=self.namespace)
         except Exception as e:
             print(f"Error Sending frame data to WebSocket {self.ws_id} {self.namespace}  {e}")
             self.config_update_sent = False
+            self.telemetry_encoder.request_keyframe()
             self.status_manager.set_disconnected(f"{e}")
         
+    async def request_transport(self):
+        # Frames keep going as base64 with the full telemetry until the server acknowledges it can read the
+        # requested transport and telemetry, a server not knowing about them never answers
+        self.transport_requested = True
+        request = {'transport': self.requested_transport, 'event': self.binary_emit_event, 'format': 'jpeg',
+                   'telemetry': self.requested_telemetry, 'codec': self.telemetry_encoder.codec}
+        try:
+            await self.sio.emit(event='stream_transport', data=request, namespace=self.namespace, callback=self.on_transport_ack)
+        except Exception as e:
+            self.app_logger.error(f"Error requesting {self.requested_transport} transport on {self.namespace}: {e}")
+            self.transport_requested = False
+
+    def on_transport_ack(self, *args):
+        data = args[0] if len(args) > 0 and isinstance(args[0], dict) else {}
+        if data.get('transport', None) == self.requested_transport:
+            self.app_logger.info(f"{self.ws_id} sending frames as {self.requested_transport}")
+            self.transport = self.requested_transport
+        if data.get('telemetry', None) == self.requested_telemetry and self.telemetry != self.requested_telemetry:
+            self.app_logger.info(f"{self.ws_id} sending {self.requested_telemetry} telemetry ({self.telemetry_encoder.codec})")
+            self.telemetry_encoder.request_keyframe()
+            self.telemetry = self.requested_telemetry
+
+    def reset_transport(self):
+        # The server might not be the same after a reconnection
+        self.transport = Transports.BASE64
+        self.telemetry = Telemetries.FULL
+        self.transport_requested = False
+        self.telemetry_encoder.request_keyframe()
+
+    def release_data(self, data):
+        if data is not None:
+            data.release()
+
+    def update_config(self, data, url):
+        self.jpeg_quality = data.get("jpeg_quality", self.jpeg_quality)
+        requested_transport = data.get("frame_transport", self.requested_transport)
+        self.binary_emit_event = data.get("binary_emit_event", self.binary_emit_event)
+        requested_telemetry = data.get("telemetry", self.requested_telemetry)
+        self.telemetry_encoder.keyframe_interval = data.get("telemetry_keyframe_interval", self.telemetry_encoder.keyframe_interval)
+        if requested_transport != self.requested_transport or requested_telemetry != self.requested_telemetry:
+            self.requested_transport = requested_transport
+            self.requested_telemetry = requested_telemetry
+            self.reset_transport()
+        WebSocketMeta.update_config(self, data, url)
+
+    def draw_debug(self, ui_drawer, text_pos, surfaces):
+        WebSocketMeta.draw_debug(self, ui_drawer, text_pos, surfaces)
+        m = self.frame_cache.encoder.get_metrics()
+        c = self.frame_cache.get_metrics()
+        text_pos.y -= ui_drawer.line_height
+        ui_drawer.add_text_line(f"Encoder - Workers: {m['workers']}, Pending: {m['pending']}, Time: {m['last_time']:.4f} (avg {m['avg_time']:.4f}, max {m['max_time']:.4f}), Dropped: {self.encoder_dropped}, Cache hits: {c['hit_rate']:.0%}", (255, 50, 0), text_pos, surfaces)
+        text_pos.y -= ui_drawer.line_height
+        ui_drawer.add_text_line(f"Transport: {self.transport} (requested {self.requested_transport}), Frame: {self.avg_bytes_sent / 1024:.1f} kB", (255, 50, 0), text_pos, surfaces)
+        if self.telemetry == Telemetries.DELTA:
+            t = self.telemetry_encoder.get_metrics()
+            text_pos.y -= ui_drawer.line_height
+            ui_drawer.add_text_line(f"Telemetry ({t['codec']}) - Seq: {t['seq']}, Keyframes: {t['keyframes']} ({t['keyframe_bytes'] / 1024:.1f} kB), Deltas: {t['deltas']} (avg {t['avg_delta_bytes'] / 1024:.2f} kB), Resyncs: {t['resyncs']}", (255, 50, 0), text_pos, surfaces)
+
     def send_config_update(self, data):
         self.config_update_sent = False
         data = serialize_datetime(data)
         self.app_config_data = data
+        self.notify_data()
 
-    def __init__(self, app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor=None):
+    def __init__(self, app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor=None, frame_cache=None):
         WebSocketMeta.__init__(self, app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor)
         self.app_config_data = None
         self.behaviour_data_in = DataQueue(10)
-        self.behaviour_data_out = DataQueue(10)
+        self.behaviour_data_out = DataQueue(10, wakeup=self.data_ready)
+        self.frame_cache = EncodedFrameCache(FrameEncoder()) if frame_cache is None else frame_cache
+        self.jpeg_quality = 95
+        self.last_encoded_seq = 0
+        self.encoded_lock = threading.Lock()
+        self.encoder_dropped = 0
+        self.requested_transport = Transports.BASE64
+        self.transport = Transports.BASE64
+        self.transport_requested = False
+        self.requested_telemetry = Telemetries.FULL
+        self.telemetry = Telemetries.FULL
+        self.telemetry_encoder = TelemetryEncoder()
+        self.binary_emit_event = 'gallery_stream_bin'
+        self.bytes_sent = 0
+        self.avg_bytes_sent = 0
 
-    def create_ws(app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor=None):
+    def create_ws(app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor=None, frame_cache=None):
         global ws_vs
-        ws_vs = WebSocketVideoStreamOut(app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor)
+        ws_vs = WebSocketVideoStreamOut(app_logger, ws_id, tasks_manager, url, namespace, frame_w, frame_h, executor, frame_cache)
         ws_vs.attach_callbacks()
         return ws_vs
 
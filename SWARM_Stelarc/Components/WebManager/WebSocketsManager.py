@@ -2,6 +2,7 @@ from .WebSocketVideoStreamIn import WebSocketVideoStreamIn
 from .WebSocketVideoStreamOut import WebSocketVideoStreamOut
 from .WebSocketInteraction import WebSocketInteraction
 from .WebSocketMeta import WebSocketMeta
+from .FrameEncoder import FrameEncoder, EncodedFrameCache
 from concurrent.futures import ThreadPoolExecutor
 from ..SwarmComponentMeta import SwarmComponentMeta
 import pygame
@@ -21,6 +22,9 @@ class WebSocketsManager(SwarmComponentMeta):
         self.app_logger = app_logger
         self.multi_threaded = True
         self.executor = ThreadPoolExecutor(3)  #Create a ProcessPool with 2 processes
+        # JPEG encoding of the outgoing frames, shared by the video stream sockets
+        self.frame_cache = EncodedFrameCache(FrameEncoder(2))
+        self.frame_seq = 0
         self.url = ""
         self.sockets = {}
         self.sockets[WS_TYPES.INTERACTION] = {}
@@ -40,6 +44,10 @@ class WebSocketsManager(SwarmComponentMeta):
         self.config_data = data
         self.last_modified_time = last_modified_time
         self.url = self.config_data.get("url", "")
+        encoder_workers = self.config_data.get("encoder_workers", self.frame_cache.encoder.workers)
+        if encoder_workers != self.frame_cache.encoder.workers:
+            self.frame_cache.encoder.stop()
+            self.frame_cache.encoder = FrameEncoder(encoder_workers)
         sockets_config = self.config_data.get("sockets", self.sockets)
         for s_config in sockets_config:
             namespace = s_config.get("namespace", None)
@@ -55,7 +63,7 @@ class WebSocketsManager(SwarmComponentMeta):
                 s_url = f"{self.url}:{port}"
                 if type in WS_TYPES.VIDEO_STREAM_OUT:
                     if ws_id not in self.sockets[WS_TYPES.VIDEO_STREAM_OUT]:
-                        socket = WebSocketVideoStreamOut.create_ws(self.app_logger, ws_id, self.tasks_manager, s_url, namespace, self.frame_w, self.frame_h, self.executor)
+                        socket = WebSocketVideoStreamOut.create_ws(self.app_logger, ws_id, self.tasks_manager, s_url, namespace, self.frame_w, self.frame_h, self.executor, self.frame_cache)
                         self.sockets[WS_TYPES.VIDEO_STREAM_OUT][ws_id] = socket
                     else:
                         socket = self.sockets[WS_TYPES.VIDEO_STREAM_OUT][ws_id]
@@ -75,10 +83,11 @@ class WebSocketsManager(SwarmComponentMeta):
                     socket.update_config(s_config, s_url)
 
     def enqueue_frame(self, namespace, cv2_frame, cameras_data, swarm_data, draw=False):
+        self.frame_seq += 1
         for ws_id in self.sockets[WS_TYPES.VIDEO_STREAM_OUT]:
             socket = self.sockets[WS_TYPES.VIDEO_STREAM_OUT][ws_id]
             if namespace in socket.namespace:
-                socket.enqueue_frame(cv2_frame, cameras_data, swarm_data)
+                socket.enqueue_frame(cv2_frame, cameras_data, swarm_data, self.frame_seq)
                 socket.enqueue_behaviour_data(swarm_data)
             if 'current_behavior' in swarm_data.keys():
                 self.app_logger.app(f"Keys to send? {'current_behavior' in swarm_data.keys()}")
@@ -28,10 +28,21 @@ use_processing=True
 use_openpose=True
 
 max_cosine_distance = 1
-nn_budget = None
+nn_budget = None # Appearance samples kept per track, None uses the default of nn_matching (100)
+gallery_eviction = "fifo" # "fifo", "reservoir" or "centroid", how full per-track galleries take new samples
 nms_max_overlap = 1.0
+# Non-maxima suppression: "numpy", "matrix", "numba", "auto" (matrix for few boxes, numba for many) or "cv2" (IoU based, approximate)
+nms_backend = "auto"
 max_age = 100
 n_init = 20
+# Kalman filter covariance profile: "fixed" (constant noise, previous pykalman behaviour) or "adaptive" (relative to the box height)
+kalman_profile = "fixed"
+# Keep the tracks in numpy columns (deep_sort.track_store) instead of one Track object each
+columnar_tracks = False
+# ReID encoder: crops from concurrent frames are batched up to reid_max_batch or reid_max_latency seconds
+reid_batching = True
+reid_max_batch = 32
+reid_max_latency = 0.005
 font_size = int(16*scaling)
 
 
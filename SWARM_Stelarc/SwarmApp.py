@@ -2,16 +2,21 @@
 # -*- coding: utf-8 -*-
 import time
 import datetime
+import threading
 import Constants
 from Components.UIDrawer import UIDrawer
 from Components.GUIManager.SceneManager import SceneManager, SceneDrawerType
 from Components.BackgroundTasksManager import BackgroundTasksManager
 from Components.VideoProcessor.VideoInputManager import VideoInputManager
-from Components.VideoProcessor.ProcessingManager import ProcessingManager
+from Components.VideoProcessor.ProcessingManager import ProcessingManager, FrameData
+from Components.VideoProcessor.SharedFrameRing import FrameSlot
 from Components.Camera.CamerasManager import CamerasManager
 from Components.Arduino.ArduinoManager import ArduinoManager
 from Components.WebManager.WebSocketsManager import WebSocketsManager
 from Components.SwarmManager.SwarmManager import SwarmManager
+from Components.FramePipeline import FramePipeline
+from Components.ConfigService import ConfigService
+from Components.SwarmComponentMeta import local_config_folder
 from Components.Utils.utils import Point
 from Components.Utils import utils
 from Components.Logger import app_logger
@@ -35,17 +40,40 @@ class SwarmAPP:
     self.arduino_manager = ArduinoManager(app_logger, self.ui_drawer, self.tasks_manager, arduino_port, mockup_commands)
     self.websocket_manager = WebSocketsManager(app_logger, self.ui_drawer, self.tasks_manager, Constants.SCREEN_WIDTH, Constants.SCREEN_HEIGHT)
     self.swarm_manager = SwarmManager(app_logger, self.ui_drawer, self.tasks_manager, self.arduino_manager, self.websocket_manager)
+    # Guards the camera graphs and swarm state shared between the pipeline stages and the pygame thread
+    self.pipeline_lock = threading.Lock()
+    self.frame_pipeline = FramePipeline(app_logger, self.ui_drawer, self.tasks_manager, release_fun=self.release_packet)
+    self.frame_pipeline.add_source("capture", self.capture_stage)
+    self.frame_pipeline.add_processing_stage("pose", self.pose_stage)
+    self.frame_pipeline.add_processing_stage("graph", self.graph_stage)
+    self.frame_pipeline.add_processing_stage("stream", self.stream_stage)
+
+    # Config files are watched and parsed in the background, changes are applied between frames
+    self.config_service = ConfigService(app_logger, self.ui_drawer, self.tasks_manager)
+    for manager in [self.swarm_manager, self.cameras_manager, self.arduino_manager, self.websocket_manager]:
+      manager.subscribe_config(self.config_service)
+    self.config_service.subscribe("AppConfig.yaml", self.update_data, folders=(local_config_folder,))
 
   def update_data(self, data, last_modified_time):
     self.processing_type = data.get("processing", False)
     self.video_manager.multi_threaded = data.get("mt_capture", False)
+    self.video_manager.use_shared_memory = data.get("shm_capture", False)
     self.local_processing_manager.processing_type = data.get("processing", 'simple')
     self.local_processing_manager.multi_threaded = data.get("mt_processing", False)
+    self.local_processing_manager.pool_workers = data.get("pool_workers", 2)
+    self.local_processing_manager.motion_gate.update_config_data(data)
+    self.local_processing_manager.resolution_controller.update_config_data(data)
+    self.local_processing_manager.zone_cropper.update_config_data(data)
     # self.stream_processing_manager.processing_type = data.get("processing", 'simple')
     # self.stream_processing_manager.multi_threaded = data.get("mt_processing", False)
     self.arduino_manager.multi_threaded = data.get("mt_arduino", False)
     self.websocket_manager.multi_threaded = data.get("mt_networking", False)
     self.websocket_manager.enabled = data.get("websocket_enabled", False)
+    self.frame_pipeline.enabled = data.get("pipelined", False)
+    self.config_service.poll_interval = data.get("config_poll_interval", self.config_service.poll_interval)
+    for stage in self.frame_pipeline.stages[1:]:
+      stage.queue_size = data.get("pipeline_queue_size", stage.queue_size)
+      stage.policy = data.get("pipeline_policy", stage.policy)
     self.last_modified_time = last_modified_time
     self.config_data = data
 
@@ -59,11 +87,17 @@ class SwarmAPP:
     self.cameras_manager.update_config()
     self.arduino_manager.update_config()
     self.websocket_manager.update_config()
-    utils.update_config_from_file(app_logger, "SwarmApp", r"./Config/AppConfig.yaml", self.last_modified_time, self.update_data)
+    if self.frame_pipeline.enabled and self.config_service.has_pending():
+      # The callbacks rebuild the cameras and zone maps the graph stage is reading
+      with self.pipeline_lock:
+        self.config_service.update_config()
+    else:
+      self.config_service.update_config()
     self.local_processing_manager.update_config()
     # self.stream_processing_manager.update_config()
 
   def start_managers(self):
+    self.config_service.init()
     self.update_config()
     self.tasks_manager.init()
     self.scene_manager.init()
@@ -74,6 +108,7 @@ class SwarmAPP:
     self.cameras_manager.init()
     self.arduino_manager.init()
     self.websocket_manager.init()
+    self.frame_pipeline.init()
 
     self.websocket_manager.send_config_update(
       {
@@ -86,10 +121,63 @@ class SwarmAPP:
       }
     )
 
+  def get_camera_frame(self, return_last=True, timeout=0):
+      if self.video_manager.use_shared_memory:
+        return self.video_manager.get_frame_slot(timeout)
+      return self.video_manager.get_frame(return_last=return_last, timeout=timeout)
+
+  def capture_stage(self):
+      # Sleeps until the capture thread has a frame, the timeout lets a stop through
+      return self.get_camera_frame(return_last=False, timeout=0.1)
+
+  def release_packet(self, packet):
+      # Packets dropped before the pose stage still hold their shared ring slot
+      if isinstance(packet.frame, FrameSlot):
+        packet.frame.release()
+      packet.frame = None
+
+  def pose_stage(self, packet):
+      frame_data = self.local_processing_manager.process_frame(FrameData.from_camera_frame(packet.frame))
+      packet.frame = None
+      if frame_data is None:
+        # The pose pool is still working on it, the result will come out with a later packet
+        return None
+      if frame_data.tracks is not None:
+        # The tracker keeps mutating its own list while the next frames are processed
+        frame_data.tracks = list(frame_data.tracks)
+      packet.frame_data = frame_data
+      return packet
+
+  def graph_stage(self, packet):
+      with self.pipeline_lock:
+        self.local_processing_manager.update(surfaces=[], frame_data=packet.frame_data)
+        self.cameras_manager.update(debug=False)
+        packet.cameras_data = self.cameras_manager.get_cameras_data()
+      return packet
+
+  def stream_stage(self, packet):
+      with self.pipeline_lock:
+        swarm_data = self.swarm_manager.get_swarm_data()
+      self.websocket_manager.enqueue_frame("/gallery_stream", packet.frame_data.frame, packet.cameras_data, swarm_data)
+      return packet
+
+  def update_pipelined_components(self, debug=False):
+      packet = self.frame_pipeline.get_latest_output()
+      frame_data = packet.frame_data if packet is not None else None
+      self.local_processing_manager.processed_frame_data = frame_data
+      self.scene_manager.update(frame_data.frame if frame_data is not None else None, debug=False)
+      self.local_processing_manager.draw_tracks(frame_data, surfaces=[self.scene_manager.tag])
+      self.arduino_manager.update(debug=debug)
+      with self.pipeline_lock:
+        self.swarm_manager.update(self.cameras_manager.cameras, debug=False, surfaces=[self.scene_manager.tag])
+
   def update_components(self, debug=False):
       self.update_config()
+      if self.frame_pipeline.enabled:
+        self.update_pipelined_components(debug)
+        return
       # self.video_manager.add_stream_frame(self.websocket_manager.get_stream_frame("/online_interaction"))
-      local_frame = self.video_manager.get_frame()
+      local_frame = self.get_camera_frame()
       processed_local_frame = self.local_processing_manager.get_processed_frame(local_frame, return_last=True)
       self.local_processing_manager.update(debug=debug, surfaces=[self.scene_manager.tag])
 
@@ -113,10 +201,14 @@ class SwarmAPP:
       self.local_processing_manager.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
       # self.stream_processing_manager.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
       self.tasks_manager.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
-      self.cameras_manager.draw(draw_graph_data=False, debug=debug, surfaces=[self.scene_manager.tag])
+      self.config_service.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
+      self.frame_pipeline.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
+      with self.pipeline_lock:
+        self.cameras_manager.draw(draw_graph_data=False, debug=debug, surfaces=[self.scene_manager.tag])
       self.websocket_manager.draw(left_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
 
-      self.swarm_manager.draw(left_text_pos, right_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
+      with self.pipeline_lock:
+        self.swarm_manager.draw(left_text_pos, right_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
       self.arduino_manager.draw(right_text_pos, debug=debug, surfaces=[self.scene_manager.tag])
       right_text_pos.y += self.ui_drawer.line_height
 
@@ -144,3 +236,5 @@ class SwarmAPP:
       if debug:
         app_logger.debug(f"--- End loop ---\n")
     self.tasks_manager.stop_all()
+    self.config_service.stop()
+    self.local_processing_manager.stop()
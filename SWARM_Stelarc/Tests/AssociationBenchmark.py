@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compares the deep_sort association step with the previous loop based one: python -m Tests.AssociationBenchmark
+import time
+import numpy as np
+from Components.VideoProcessor.deep_sort import linear_assignment, iou_matching, kalman_filter, nn_matching
+from Components.VideoProcessor.deep_sort.kalman_bank import KalmanFilterBank
+from Components.VideoProcessor.deep_sort.track import Track
+from Components.VideoProcessor.deep_sort.detection import Detection
+
+MAX_AGE = 100
+
+
+# The association functions as they were before, kept here as a reference
+def ref_min_cost_matching(distance_metric, max_distance, tracks, detections, track_indices, detection_indices):
+    if len(detection_indices) == 0 or len(track_indices) == 0:
+        return [], track_indices, detection_indices
+    cost_matrix = distance_metric(tracks, detections, track_indices, detection_indices)
+    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+    indices = linear_assignment.linear_assignment(cost_matrix)
+    matches, unmatched_tracks, unmatched_detections = [], [], []
+    for col, detection_idx in enumerate(detection_indices):
+        if col not in indices[:, 1]:
+            unmatched_detections.append(detection_idx)
+    for row, track_idx in enumerate(track_indices):
+        if row not in indices[:, 0]:
+            unmatched_tracks.append(track_idx)
+    for row, col in indices:
+        track_idx = track_indices[row]
+        detection_idx = detection_indices[col]
+        if cost_matrix[row, col] > max_distance:
+            unmatched_tracks.append(track_idx)
+            unmatched_detections.append(detection_idx)
+        else:
+            matches.append((track_idx, detection_idx))
+    return matches, unmatched_tracks, unmatched_detections
+
+
+def ref_matching_cascade(distance_metric, max_distance, cascade_depth, tracks, detections, track_indices):
+    unmatched_detections = list(range(len(detections)))
+    matches = []
+    for level in range(cascade_depth):
+        if len(unmatched_detections) == 0:
+            break
+        track_indices_l = [k for k in track_indices if tracks[k].time_since_update == 1 + level]
+        if len(track_indices_l) == 0:
+            continue
+        matches_l, _, unmatched_detections = ref_min_cost_matching(
+            distance_metric, max_distance, tracks, detections, track_indices_l, unmatched_detections)
+        matches += matches_l
+    unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
+    return matches, unmatched_tracks, unmatched_detections
+
+
+def ref_gate_cost_matrix(kf, cost_matrix, tracks, detections, track_indices, detection_indices):
+    gating_threshold = kalman_filter.chi2inv95[2]
+    measurements = np.asarray([detections[i].to_xyah() for i in detection_indices])
+    for row, track_idx in enumerate(track_indices):
+        track = tracks[track_idx]
+        gating_distance = kf.gating_distance(track.mean, track.covariance, measurements, True)
+        cost_matrix[row, gating_distance > gating_threshold] = linear_assignment.INFTY_COST
+    return cost_matrix
+
+
+def ref_iou_cost(tracks, detections, track_indices, detection_indices):
+    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
+    for row, track_idx in enumerate(track_indices):
+        if tracks[track_idx].time_since_update > 1:
+            cost_matrix[row, :] = linear_assignment.INFTY_COST
+            continue
+        bbox = tracks[track_idx].to_tlwh()
+        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
+        cost_matrix[row, :] = 1. - iou_matching.iou(bbox, candidates)
+    return cost_matrix
+
+
+def make_scene(n_tracks, rng):
+    kf = KalmanFilterBank()
+    metric = nn_matching.NearestNeighborDistanceMetric("cosine", 0.3, 16)
+    identities = rng.normal(size=(n_tracks, 128)).astype(np.float32)
+    tracks, boxes = [], rng.uniform([0, 0, 20, 60], [1200, 640, 60, 160], (n_tracks, 4))
+    for i, box in enumerate(boxes):
+        mean, covariance = kf.initiate(Detection(box, 1, identities[i], None).to_xyah())
+        track = Track(mean, covariance, i + 1, 3, MAX_AGE)
+        # Most tracks were seen in the last frame, a few have been lost for a while
+        track.time_since_update = 1 if rng.random() < 0.7 else int(rng.integers(2, MAX_AGE))
+        tracks.append(track)
+    samples = identities[:, None, :] + 0.1 * rng.normal(size=(n_tracks, 4, 128)).astype(np.float32)
+    metric.partial_fit(samples.reshape(-1, 128), np.repeat(np.arange(1, n_tracks + 1), 4), list(range(1, n_tracks + 1)))
+    # 90% of the tracks are detected again, plus 10% new people
+    seen = rng.random(n_tracks) < 0.9
+    det_boxes = np.vstack((boxes[seen] + rng.normal(0, 2, (np.count_nonzero(seen), 4)) * [1, 1, 0, 0],
+                           rng.uniform([0, 0, 20, 60], [1200, 640, 60, 160], (n_tracks // 10, 4))))
+    det_features = np.vstack((identities[seen], rng.normal(size=(n_tracks // 10, 128)).astype(np.float32)))
+    detections = [Detection(b, 1, f, None) for b, f in zip(det_boxes, det_features)]
+    return kf, metric, tracks, detections
+
+
+def associate(kf, metric, tracks, detections, reference):
+    gate = ref_gate_cost_matrix if reference else \
+        lambda *args: linear_assignment.gate_cost_matrix(None, *args, only_position=True)
+    cascade = ref_matching_cascade if reference else linear_assignment.matching_cascade
+    min_cost = ref_min_cost_matching if reference else linear_assignment.min_cost_matching
+    iou_cost = ref_iou_cost if reference else iou_matching.iou_cost
+
+    def gated_metric(tracks, dets, track_indices, detection_indices):
+        features = np.array([dets[i].feature for i in detection_indices])
+        targets = np.array([tracks[i].track_id for i in track_indices])
+        return gate(kf, metric.distance(features, targets), tracks, dets, track_indices, detection_indices)
+
+    matches_a, unmatched_tracks_a, unmatched_detections = cascade(
+        gated_metric, metric.matching_threshold, MAX_AGE, tracks, detections, list(range(len(tracks))))
+    iou_candidates = [k for k in unmatched_tracks_a if tracks[k].time_since_update == 1]
+    matches_b, _, unmatched_detections = min_cost(
+        iou_cost, 0.7, tracks, detections, iou_candidates, unmatched_detections)
+    return sorted(matches_a + matches_b), sorted(unmatched_detections)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    print(f"{'tracks':>7} {'loops (ms)':>11} {'vectorized (ms)':>16} {'speedup':>8}  matches")
+    for n_tracks in [5, 50, 500]:
+        kf, metric, tracks, detections = make_scene(n_tracks, rng)
+        repeats = max(1, 1000 // n_tracks)
+        timings = []
+        for reference in [True, False]:
+            start = time.time()
+            for r in range(repeats):
+                result = associate(kf, metric, tracks, detections, reference)
+            timings.append(((time.time() - start) / repeats, result))
+        (ref_time, ref_result), (new_time, new_result) = timings
+        assert ref_result == new_result
+        print(f"{n_tracks:>7} {ref_time * 1000:>11.3f} {new_time * 1000:>16.3f} {ref_time / new_time:>7.1f}x  {len(new_result[0])}")
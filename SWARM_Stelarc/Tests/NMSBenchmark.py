@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compares the non_max_suppression backends with each other: python -m Tests.NMSBenchmark
+import time
+import numpy as np
+from Components.VideoProcessor.deep_sort import preprocessing
+
+
+def ref_non_max_suppression(boxes, max_bbox_overlap, scores=None):
+    # The np.delete based loop non_max_suppression used to be, kept here as a reference
+    if len(boxes) == 0:
+        return []
+    boxes = boxes.astype(np.float64)
+    pick = []
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2] + boxes[:, 0]
+    y2 = boxes[:, 3] + boxes[:, 1]
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    if scores is not None:
+        idxs = np.argsort(scores)
+    else:
+        idxs = np.argsort(y2)
+    while len(idxs) > 0:
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+        overlap = (w * h) / area[idxs[:last]]
+        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > max_bbox_overlap)[0])))
+    return pick
+
+
+def make_boxes(n_boxes, rng):
+    # People standing in small clusters, so that a good part of the boxes overlap
+    centers = rng.uniform([0, 0], [1280, 720], (max(1, n_boxes // 3), 2))
+    xy = centers[rng.integers(0, len(centers), n_boxes)] + rng.normal(0, 15, (n_boxes, 2))
+    wh = rng.uniform([30, 80], [80, 220], (n_boxes, 2))
+    return np.round(np.hstack((xy, wh)))
+
+
+def run(function, boxes, threshold, scores, repeats, **kwargs):
+    start = time.time()
+    for r in range(repeats):
+        result = function(boxes, threshold, scores, **kwargs)
+    return [int(i) for i in result], (time.time() - start) / repeats
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    backends = [preprocessing.NUMPY_BACKEND, preprocessing.MATRIX_BACKEND, preprocessing.NUMBA_BACKEND,
+                preprocessing.AUTO_BACKEND, preprocessing.CV2_BACKEND]
+    # Compile the numba kernel before timing it
+    preprocessing.non_max_suppression(make_boxes(4, rng), 0.5, backend=preprocessing.NUMBA_BACKEND)
+    if not hasattr(preprocessing._nms_greedy, "signatures"):
+        print("numba is not installed or not compiling, its timings are of plain python")
+    print(f"{'boxes':>6} {'overlap':>8} {'reference':>10}" + "".join(f" {b:>8}" for b in backends) + "  (ms, cv2 agreement)")
+    for n_boxes in [5, 20, 100, 500]:
+        repeats = max(5, 5000 // n_boxes)
+        for threshold in [0.3, 0.7, 1.0]:
+            boxes = make_boxes(n_boxes, rng)
+            # Openpose detections all have confidence 1, ties must be broken the same way
+            scores = np.ones(n_boxes) if threshold == 0.7 else rng.random(n_boxes)
+            ref, ref_time = run(ref_non_max_suppression, boxes, threshold, scores, repeats)
+            line = f"{n_boxes:>6} {threshold:>8} {ref_time * 1000:>10.3f}"
+            for backend in backends:
+                result, elapsed = run(preprocessing.non_max_suppression, boxes, threshold, scores, repeats, backend=backend)
+                if backend != preprocessing.CV2_BACKEND:
+                    assert result == ref, backend
+                else:
+                    agreement = len(set(result) & set(ref)) / len(set(result) | set(ref))
+                line += f" {elapsed * 1000:>8.3f}"
+            print(f"{line}  {agreement:.0%}")
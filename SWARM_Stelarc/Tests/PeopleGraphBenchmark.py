@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compares the numpy PeopleGraph with the previous networkx implementation: python -m Tests.PeopleGraphBenchmark
+import time
+import numpy as np
+import networkx as nx
+from Components.Camera.people_graph import PeopleGraph
+from Components.Utils.utils import Point
+
+
+class NxPeopleGraph:
+    # The networkx graph PeopleGraph used to be, kept here as a reference. The original never counted groups,
+    # its connected_components call was missing the nx. prefix, this one does
+    def __init__(self, edge_threshold=-1):
+        self.nx_graph = nx.Graph()
+        self.edge_threshold = edge_threshold
+        self.n_groups = 0
+        self.avg_people_distance = 0
+        self.avg_machine_distance = 0
+
+    def add_node(self, x, y):
+        node = Point(x, y)
+        self.nx_graph.add_node(node, pos=node.pos)
+
+    def update_graph(self, machine_pos):
+        for i in self.nx_graph.nodes():
+            for j in self.nx_graph.nodes():
+                if i != j and not self.nx_graph.has_edge(i, j):
+                    dist = i.distance_from(j)
+                    if self.edge_threshold <= 0 or dist <= self.edge_threshold:
+                        self.nx_graph.add_edge(i, j, weight=dist)
+        n_edges = self.nx_graph.number_of_edges()
+        if n_edges > 0:
+            self.avg_people_distance = sum(w['weight'] for i, j, w in self.nx_graph.edges(data=True)) / n_edges
+        n_nodes = self.nx_graph.number_of_nodes()
+        if n_nodes > 0:
+            total = sum(node.distance_from(machine_pos) for node in self.nx_graph.nodes())
+            self.avg_machine_distance = total / (n_nodes - 1 if n_nodes > 1 else n_nodes)
+        if self.edge_threshold > 0:
+            self.n_groups = sum(1 for c in nx.connected_components(self.nx_graph) if len(c) > 1)
+
+
+def run_frames(graph_type, points, threshold, machine_pos, repeats):
+    graph = PeopleGraph(threshold, count_groups=True) if graph_type is PeopleGraph else graph_type(threshold)
+    start = time.time()
+    for r in range(repeats):
+        if isinstance(graph, PeopleGraph):
+            graph.init_graph()
+        else:
+            graph.__init__(threshold)
+        for x, y in points:
+            graph.add_node(x, y)
+        graph.update_graph(machine_pos=machine_pos)
+    return graph, (time.time() - start) / repeats
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    machine_pos = Point(640, 0)
+    threshold = 60
+    print(f"{'people':>7} {'networkx (ms)':>14} {'numpy (ms)':>11} {'speedup':>8}  groups")
+    for n_people in [10, 100, 1000]:
+        points = rng.uniform(0, [1280, 720], (n_people, 2))
+        repeats = max(1, 2000 // n_people)
+        nx_repeats = 1 if n_people >= 1000 else repeats
+        ref, nx_time = run_frames(NxPeopleGraph, points, threshold, machine_pos, nx_repeats)
+        graph, np_time = run_frames(PeopleGraph, points, threshold, machine_pos, repeats)
+        assert ref.n_groups == graph.n_groups
+        assert np.isclose(ref.avg_people_distance, graph.avg_people_distance)
+        assert np.isclose(ref.avg_machine_distance, graph.avg_machine_distance)
+        print(f"{n_people:>7} {nx_time * 1000:>14.3f} {np_time * 1000:>11.3f} {nx_time / np_time:>7.1f}x  {graph.n_groups}")
@@ -2,6 +2,8 @@
 import os
 import errno
 import argparse
+import threading
+import time
 import numpy as np
 import cv2
 import tensorflow.compat.v1 as tf
@@ -58,7 +60,7 @@ def extract_image_patch(image, bbox, patch_shape):
 
     # convert to top left, bottom right
     bbox[2:] += bbox[:2]
-    bbox = bbox.astype(np.int)
+    bbox = bbox.astype(int)
 
     # clip at image boundaries
     bbox[:2] = np.maximum(0, bbox[:2])
@@ -99,26 +101,271 @@ class ImageEncoder(object):
         return out
 
 
+def extract_image_patches(image, boxes, patch_shape, out=None):
+    """Extract and resize the image patches of several bounding boxes.
+
+    Same as calling :func:`extract_image_patch` for every box, but the
+    aspect correction and clipping are computed for all boxes at once and
+    the crops are resized straight into `out`. Integer boxes are truncated
+    the same way :func:`extract_image_patch` does.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    boxes : array_like
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    patch_shape : array_like
+        The patch shape (height, width).
+    out : Optional[ndarray]
+        A (N, height, width, channels) uint8 array the patches are written
+        to. If None, a new array is allocated.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The patches and a boolean mask of the boxes that could be
+        extracted. Patches of empty boxes, or boxes fully outside of the
+        image, are left untouched.
+
+    """
+    boxes = np.asarray(boxes)
+    integer_boxes = np.issubdtype(boxes.dtype, np.integer)
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    if out is None:
+        out = np.zeros((len(boxes),) + tuple(patch_shape[:2]) + image.shape[2:], np.uint8)
+    # correct aspect ratio to patch shape
+    target_aspect = float(patch_shape[1]) / patch_shape[0]
+    new_width = target_aspect * boxes[:, 3]
+    boxes[:, 0] -= (new_width - boxes[:, 2]) / 2
+    boxes[:, 2] = new_width
+    if integer_boxes:
+        # extract_image_patch() writes these back into the integer box, truncating each of them
+        boxes[:, [0, 2]] = np.trunc(boxes[:, [0, 2]])
+
+    # convert to top left, bottom right and clip at image boundaries
+    boxes[:, 2:] += boxes[:, :2]
+    boxes = boxes.astype(int)
+    boxes[:, :2] = np.maximum(0, boxes[:, :2])
+    boxes[:, 2:] = np.minimum(np.asarray(image.shape[:2][::-1]) - 1, boxes[:, 2:])
+    valid = np.all(boxes[:, :2] < boxes[:, 2:], axis=1)
+
+    size = (int(patch_shape[1]), int(patch_shape[0]))
+    for i in np.flatnonzero(valid):
+        sx, sy, ex, ey = boxes[i]
+        cv2.resize(image[sy:ey, sx:ex], size, dst=out[i])
+    return out, valid
+
+
+class PatchBuffer(object):
+    """Reusable uint8 batch buffer for the encoder input, grown on demand so
+    that frames don't allocate a new input tensor every time."""
+
+    def __init__(self, patch_shape, capacity=16):
+        self.patch_shape = tuple(patch_shape)
+        self.buffer = np.zeros((capacity,) + self.patch_shape, np.uint8)
+
+    def get(self, n):
+        if n > len(self.buffer):
+            self.buffer = np.zeros((max(n, 2 * len(self.buffer)),) + self.patch_shape, np.uint8)
+        return self.buffer[:n]
+
+
+def _extract_patches(image, boxes, image_shape, patch_buffer):
+    out = patch_buffer.get(len(boxes))
+    image_patches, valid = extract_image_patches(image, boxes, image_shape[:2], out)
+    for i in np.flatnonzero(~valid):
+        print("WARNING: Failed to extract image patch: %s." % str(boxes[i]))
+        image_patches[i] = np.random.uniform(0., 255., image_shape).astype(np.uint8)
+    return image_patches
+
+
 def create_box_encoder(model_filename, input_name="images",
                        output_name="features", batch_size=32):
     image_encoder = ImageEncoder(model_filename, input_name, output_name)
     image_shape = image_encoder.image_shape
 
+    patch_buffer = PatchBuffer(image_shape)
+
     def encoder(image, boxes):
-        image_patches = []
-        for box in boxes:
-            patch = extract_image_patch(image, box, image_shape[:2])
-            if patch is None:
-                print("WARNING: Failed to extract image patch: %s." % str(box))
-                patch = np.random.uniform(
-                    0., 255., image_shape).astype(np.uint8)
-            image_patches.append(patch)
-        image_patches = np.asarray(image_patches)
+        image_patches = _extract_patches(image, boxes, image_shape, patch_buffer)
         return image_encoder(image_patches, batch_size)
 
     return encoder
 
 
+class _EncodeRequest(object):
+
+    def __init__(self, patches):
+        self.patches = patches
+        self.features = None
+        self.error = None
+        self.done = threading.Event()
+        self.created = time.time()
+
+
+class BatchingEncoderService(object):
+    """Share one image encoder between several callers.
+
+    Crops submitted from one or more frames are queued and encoded
+    together with a single session run. A batch is closed when it holds
+    `max_batch_size` crops, when the oldest request has waited
+    `max_latency` seconds or as soon as no other caller is still
+    extracting crops, whichever comes first. A lone caller never waits.
+
+    Parameters
+    ----------
+    image_encoder : ImageEncoder
+        The encoder that runs the network.
+    max_batch_size : int
+        Maximum number of crops encoded by one session run. A single
+        request larger than this is still encoded in one go.
+    max_latency : float
+        Maximum time in seconds a request waits for other crops to join
+        its batch.
+
+    """
+
+    def __init__(self, image_encoder, max_batch_size=32, max_latency=0.005):
+        self.image_encoder = image_encoder
+        self.image_shape = image_encoder.image_shape
+        self.feature_dim = image_encoder.feature_dim
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        # Callers extract into their own buffer, the worker gathers them in the batch buffer
+        self.patch_buffers = threading.local()
+        self.batch_buffer = PatchBuffer(self.image_shape, max_batch_size)
+        self.requests = []
+        # Callers between entering the service and submitting their crops, only they can join a batch
+        self.callers = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.batches = 0
+        self.crops = 0
+        self.avg_batch_size = 0
+        self.avg_wait = 0
+        self.avg_run_time = 0
+        self.thread = threading.Thread(target=self._loop, name="BatchingEncoder", daemon=True)
+        self.thread.start()
+
+    def encode(self, image_patches):
+        self._enter()
+        return self._submit(image_patches)
+
+    def __call__(self, image, boxes):
+        self._enter()
+        try:
+            patch_buffer = getattr(self.patch_buffers, 'buffer', None)
+            if patch_buffer is None:
+                patch_buffer = PatchBuffer(self.image_shape)
+                self.patch_buffers.buffer = patch_buffer
+            image_patches = _extract_patches(image, boxes, self.image_shape, patch_buffer)
+        except Exception:
+            self._leave()
+            raise
+        return self._submit(image_patches)
+
+    def _enter(self):
+        with self.cond:
+            self.callers += 1
+
+    def _leave(self):
+        with self.cond:
+            self.callers -= 1
+            self.cond.notify_all()
+
+    def _submit(self, image_patches):
+        if len(image_patches) <= 0:
+            self._leave()
+            return np.zeros((0, self.feature_dim), np.float32)
+        request = _EncodeRequest(image_patches)
+        with self.cond:
+            self.callers -= 1
+            if not self.running:
+                raise RuntimeError("Encoder service has been stopped")
+            self.requests.append(request)
+            self.cond.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.features
+
+    def _next_batch(self):
+        with self.cond:
+            while self.running and len(self.requests) <= 0:
+                self.cond.wait(0.1)
+            if not self.running:
+                return []
+            deadline = self.requests[0].created + self.max_latency
+            while self.running and self.callers > 0 and sum(len(r.patches) for r in self.requests) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch, size = [], 0
+            while len(self.requests) > 0:
+                n = len(self.requests[0].patches)
+                if len(batch) > 0 and size + n > self.max_batch_size:
+                    break
+                batch.append(self.requests.pop(0))
+                size += n
+            return batch
+
+    def _loop(self):
+        while self.running:
+            batch = self._next_batch()
+            if len(batch) <= 0:
+                continue
+            start = time.time()
+            try:
+                patches = self.batch_buffer.get(sum(len(r.patches) for r in batch))
+                np.concatenate([r.patches for r in batch], out=patches)
+                features = self.image_encoder(patches, len(patches))
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+                    r.done.set()
+                continue
+            run_time = time.time() - start
+            s = 0
+            for r in batch:
+                r.features = features[s:s + len(r.patches)]
+                s += len(r.patches)
+                r.done.set()
+            w = 0.1 if self.batches > 0 else 1.0
+            self.batches += 1
+            self.crops += len(patches)
+            self.avg_batch_size = self.avg_batch_size * (1 - w) + len(patches) * w
+            self.avg_wait = self.avg_wait * (1 - w) + (start - batch[0].created) * w
+            self.avg_run_time = self.avg_run_time * (1 - w) + run_time * w
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            pending = self.requests
+            self.requests = []
+            self.cond.notify_all()
+        for r in pending:
+            r.error = RuntimeError("Encoder service has been stopped")
+            r.done.set()
+        self.thread.join(timeout=1)
+
+    def get_stats(self):
+        return {'batches': self.batches, 'crops': self.crops, 'avg_batch_size': self.avg_batch_size,
+                'avg_wait': self.avg_wait, 'avg_run_time': self.avg_run_time, 'queued': len(self.requests)}
+
+
+def create_batching_box_encoder(model_filename, input_name="images",
+                                output_name="features", max_batch_size=32,
+                                max_latency=0.005):
+    """Like `create_box_encoder`, but crops from concurrent callers are
+    encoded together. The returned service is callable with the same
+    `(image, boxes)` signature and must be stopped when no longer used.
+    """
+    image_encoder = ImageEncoder(model_filename, input_name, output_name)
+    return BatchingEncoderService(image_encoder, max_batch_size, max_latency)
+
+
 def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
     """Generate detections with features.
 
@@ -163,9 +410,9 @@ def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
         detections_in = np.loadtxt(detection_file, delimiter=',')
         detections_out = []
 
-        frame_indices = detections_in[:, 0].astype(np.int)
-        min_frame_idx = frame_indices.astype(np.int).min()
-        max_frame_idx = frame_indices.astype(np.int).max()
+        frame_indices = detections_in[:, 0].astype(int)
+        min_frame_idx = frame_indices.min()
+        max_frame_idx = frame_indices.max()
         for frame_idx in range(min_frame_idx, max_frame_idx + 1):
             print("Frame %05d/%05d" % (frame_idx, max_frame_idx))
             mask = frame_indices == frame_idx